@@ -1,5 +1,6 @@
 #!/usr/bin/python
 
+import time
 import numpy as np
 from Util import transformations as transformations
 
@@ -32,7 +33,7 @@ def align_sim3(model, data):
   data_zerocentered_T = np.transpose(data_zerocentered)
   C = 1.0/n*np.dot(model_zerocentered, data_zerocentered_T)
   sigma2 = 1.0/n*np.multiply(data_zerocentered, data_zerocentered).sum()
-  U_svd,D_svd,V_svd = np.linalg.linalg.svd(C)
+  U_svd,D_svd,V_svd = np.linalg.svd(C)
   D_svd = np.diag(D_svd)
   V_svd = np.transpose(V_svd)
   S = np.eye(3)
@@ -51,6 +52,344 @@ def align_sim3(model, data):
 
   return s, R, t, t_error
 
+def align_sim3_batch(model, data, weights=None):
+  """Batched version of align_sim3, every frame is solved independently
+  with one batched covariance and SVD.
+
+  Input:
+  model -- first trajectories (Tx3xn)
+  data -- second trajectories (Tx3xn)
+  weights -- per point weights (n) or (Txn), e.g. a 0/1 inlier mask,
+             default all ones (the plain Umeyama estimate)
+
+  Output:
+  s -- scale factors (T)
+  R -- rotation matrices (Tx3x3)
+  t -- translation vectors (Tx3x1)
+  t_error -- translational error per point (Txn)
+
+  """
+  model = np.asarray(model, dtype=np.float64)
+  data = np.asarray(data, dtype=np.float64)
+  assert model.shape == data.shape and model.ndim == 3 and model.shape[1] == 3, \
+    "model and data should be Tx3xn, got {} and {}".format(model.shape, data.shape)
+  if weights is None:
+    weights = np.ones(model.shape[2])
+  weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), (len(model), model.shape[2]))
+  weights = weights / weights.sum(axis=1, keepdims=True)
+
+  # substract (weighted) mean
+  mu_M = np.einsum('tin,tn->ti', model, weights)[:, :, np.newaxis]
+  mu_D = np.einsum('tin,tn->ti', data, weights)[:, :, np.newaxis]
+  model_zerocentered = model - mu_M
+  data_zerocentered = data - mu_D
+
+  # correlation
+  C = np.matmul(model_zerocentered * weights[:, np.newaxis, :], data_zerocentered.transpose(0, 2, 1))
+  sigma2 = np.einsum('tij,tij,tj->t', data_zerocentered, data_zerocentered, weights)
+  U_svd, D_svd, Vh_svd = np.linalg.svd(C)
+
+  # reflection fix
+  S = np.ones((len(model), 3))
+  S[np.linalg.det(U_svd) * np.linalg.det(Vh_svd) < 0, 2] = -1
+
+  R = np.matmul(U_svd * S[:, np.newaxis, :], Vh_svd)
+  s = (D_svd * S).sum(axis=1) / sigma2
+  t = mu_M - s[:, np.newaxis, np.newaxis] * np.matmul(R, mu_D)
+
+  model_aligned = s[:, np.newaxis, np.newaxis] * np.matmul(R, data) + t
+  alignment_error = model_aligned - model
+  t_error = np.sqrt(np.einsum('tij,tij->tj', alignment_error, alignment_error))
+
+  return s, R, t, t_error
+
+def so3_exp(w):
+  """Rodrigues formula for a batch of rotation vectors.
+
+  Input:
+  w -- rotation vectors (Tx3)
+
+  Output:
+  R -- rotation matrices (Tx3x3)
+
+  """
+  w = np.asarray(w, dtype=np.float64)
+  theta = np.linalg.norm(w, axis=1)
+  K = _skew(w)
+  small = theta < 1e-8
+  safe = np.where(small, 1.0, theta)
+  a = np.where(small, 1.0 - theta**2 / 6.0, np.sin(safe) / safe)
+  b = np.where(small, 0.5 - theta**2 / 24.0, (1.0 - np.cos(safe)) / safe**2)
+  return np.eye(3) + a[:, np.newaxis, np.newaxis] * K + b[:, np.newaxis, np.newaxis] * np.matmul(K, K)
+
+def _skew(v):
+  """Cross product matrices of the last axis of v (...x3 -> ...x3x3)."""
+  K = np.zeros(v.shape + (3,))
+  K[..., 0, 1] = -v[..., 2]
+  K[..., 0, 2] = v[..., 1]
+  K[..., 1, 0] = v[..., 2]
+  K[..., 1, 2] = -v[..., 0]
+  K[..., 2, 0] = -v[..., 1]
+  K[..., 2, 1] = v[..., 0]
+  return K
+
+def _robust_cost(r2, weights, huber):
+  """Weighted (Huber) cost and the IRLS weights for squared residual norms (Txn)."""
+  if huber is None:
+    return 0.5 * (weights * r2).sum(axis=1), weights
+  r = np.sqrt(r2)
+  inlier = r <= huber
+  rho = np.where(inlier, 0.5 * r2, huber * r - 0.5 * huber**2)
+  irls = np.where(inlier, 1.0, huber / np.maximum(r, 1e-300))
+  return (weights * rho).sum(axis=1), weights * irls
+
+def refine_sim3_batch(model, data, s, R, t, weights=None, huber=None, max_iter=20, tol=1e-10):
+  """Levenberg-Marquardt refinement of model ~ s * R * data + t for every frame.
+
+  The update is R <- exp(w) R, t <- t + dt, s <- s * exp(ds), the
+  Jacobian of the residual s*R*d + t - m is analytic:
+  [-skew(s*R*d), I, s*R*d]. All frames are solved together.
+  For the plain least squares cost the Umeyama estimate is already
+  optimal, the refinement matters with weights or the Huber loss.
+
+  Input:
+  model -- first trajectories (Tx3xn)
+  data -- second trajectories (Tx3xn)
+  s, R, t -- initial estimates (T), (Tx3x3), (Tx3x1), e.g. from
+             align_sim3_batch or the previous frame
+  weights -- per point weights (n) or (Txn), default all ones
+  huber -- Huber threshold in the units of the points, None for least squares
+  max_iter -- maximum number of iterations
+  tol -- stop when the relative cost decrease is below tol
+
+  Output:
+  s -- scale factors (T)
+  R -- rotation matrices (Tx3x3)
+  t -- translation vectors (Tx3x1)
+  t_error -- translational error per point (Txn)
+
+  """
+  model = np.asarray(model, dtype=np.float64)
+  data = np.asarray(data, dtype=np.float64)
+  T, _, n = model.shape
+  s = np.array(s, dtype=np.float64).reshape(T)
+  R = np.array(R, dtype=np.float64).reshape(T, 3, 3)
+  t = np.array(t, dtype=np.float64).reshape(T, 3, 1)
+  weights = np.array(np.broadcast_to(np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64), (T, n)))
+
+  def evaluate(s, R, t):
+    p = s[:, np.newaxis, np.newaxis] * np.matmul(R, data)  # Tx3xn
+    r = p + t - model
+    cost, w = _robust_cost(np.einsum('tkn,tkn->tn', r, r), weights, huber)
+    return p, r, cost, w
+
+  p, r, cost, w = evaluate(s, R, t)
+  lam = np.full(T, 1e-4)
+  active = np.ones(T, dtype=bool)
+  for _ in range(max_iter):
+    # J: Txnx3x7, columns [rotation, translation, log scale]
+    pn = p.transpose(0, 2, 1)
+    J = np.zeros((T, n, 3, 7))
+    J[..., 0:3] = -_skew(pn)
+    J[..., 3:6] = np.eye(3)
+    J[..., 6] = pn
+    H = np.einsum('tnki,tn,tnkj->tij', J, w, J)
+    g = np.einsum('tnki,tn,tnk->ti', J, w, r.transpose(0, 2, 1))
+    diag = np.einsum('tii->ti', H)
+    A = H + (lam[:, np.newaxis] * np.maximum(diag, 1e-12))[:, :, np.newaxis] * np.eye(7)
+    delta = -np.linalg.solve(A, g[:, :, np.newaxis])[:, :, 0]
+    delta[~active] = 0
+
+    s_new = s * np.exp(delta[:, 6])
+    R_new = np.matmul(so3_exp(delta[:, 0:3]), R)
+    t_new = t + delta[:, 3:6, np.newaxis]
+    p_new, r_new, cost_new, w_new = evaluate(s_new, R_new, t_new)
+
+    better = active & (cost_new < cost)
+    # converged: accepted step with a tiny decrease, or no descent even with a tiny step
+    converged = active & np.where(better, cost - cost_new <= tol * np.maximum(cost, 1e-300), lam >= 1e8)
+    s[better], R[better], t[better] = s_new[better], R_new[better], t_new[better]
+    p[better], r[better], w[better] = p_new[better], r_new[better], w_new[better]
+    cost[better] = cost_new[better]
+    lam = np.where(better, lam * 0.1, lam * 10.0)
+    active &= ~converged
+    if not active.any():
+      break
+
+  t_error = np.sqrt(np.einsum('tkn,tkn->tn', r, r))
+  return s, R, t, t_error
+
+def refine_sim3(model, data, s, R, t, weights=None, huber=None, max_iter=20, tol=1e-10):
+  """Single frame version of refine_sim3_batch.
+
+  Input:
+  model -- first trajectory (3xn)
+  data -- second trajectory (3xn)
+  s, R, t -- initial estimate, scalar, (3x3), (3x1)
+
+  Output:
+  s -- scale factor (scalar)
+  R -- rotation matrix (3x3)
+  t -- translation vector (3x1)
+  t_error -- translational error per point (1xn)
+
+  """
+  s, R, t, t_error = refine_sim3_batch(np.asarray(model)[np.newaxis], np.asarray(data)[np.newaxis],
+                                       [s], R, t, weights, huber, max_iter, tol)
+  return s[0], R[0], t[0], t_error[0]
+
+def _sample_indices(rng, n, shape, k):
+  """Random k-subsets of range(n) without repeated points (shape+(k,))."""
+  index = rng.integers(0, n, size=tuple(shape) + (k,))
+  while True:
+    sorted_index = np.sort(index, axis=-1)
+    repeated = (sorted_index[..., 1:] == sorted_index[..., :-1]).any(axis=-1)
+    if not repeated.any():
+      return index
+    index[repeated] = rng.integers(0, n, size=(int(repeated.sum()), k))
+
+def _ransac_iterations(inlier_ratio, sample_size, confidence, max_iter):
+  """Number of samples needed to draw one all-inlier sample with the given confidence."""
+  w = np.clip(np.asarray(inlier_ratio, dtype=np.float64) ** sample_size, 1e-12, 1 - 1e-12)
+  return np.minimum(max_iter, np.ceil(np.log(1 - confidence) / np.log1p(-w))).astype(int)
+
+def ransac_sim3_batch(model, data, threshold=None, sample_size=3, max_iter=1000, time_budget=None,
+                      confidence=0.999, hypotheses=32, score_points=2048, rng=None, huber=None):
+  """RANSAC estimate of model ~ s * R * data + t for every frame.
+
+  Every round draws `hypotheses` minimal samples (distinct points) per
+  frame, solves all of them with one align_sim3_batch call and scores
+  them on a random subset of the points. Frames stop drawing when the
+  adaptive RANSAC bound for `confidence` is met. The best hypothesis of
+  every frame is re-estimated on its inliers (weighted Umeyama, twice),
+  optionally followed by refine_sim3_batch with the Huber loss.
+  Without a threshold the hypotheses are scored by the median residual
+  (LMedS) and the inlier threshold is 2.5 robust standard deviations.
+
+  Input:
+  model -- first trajectories (Tx3xn)
+  data -- second trajectories (Tx3xn)
+  threshold -- inlier distance in the units of the points, None for LMedS
+  sample_size -- points per hypothesis, at least 3
+  max_iter -- maximum number of hypotheses per frame
+  time_budget -- stop drawing hypotheses after this many seconds, None for no limit
+  confidence -- probability of drawing at least one all-inlier sample
+  hypotheses -- hypotheses per frame and round
+  score_points -- number of points the hypotheses are scored on
+  rng -- numpy Generator or seed, the result is reproducible for a fixed seed
+  huber -- Huber threshold for the final refinement, None to skip it
+
+  Output:
+  s -- scale factors (T)
+  R -- rotation matrices (Tx3x3)
+  t -- translation vectors (Tx3x1)
+  t_error -- translational error per point (Txn)
+  inliers -- inlier mask (Txn), inliers.mean(axis=1) is the inlier ratio
+
+  """
+  start_time = time.time()
+  rng = np.random.default_rng(rng)
+  model = np.asarray(model, dtype=np.float64)
+  data = np.asarray(data, dtype=np.float64)
+  assert model.shape == data.shape and model.ndim == 3 and model.shape[1] == 3, \
+    "model and data should be Tx3xn, got {} and {}".format(model.shape, data.shape)
+  T, _, n = model.shape
+  assert 3 <= sample_size <= n, "sample_size should be in [3, {}], got {}".format(n, sample_size)
+  frames = np.arange(T)
+
+  # hypotheses are only scored on a subset of the points
+  score_index = np.sort(rng.choice(n, size=score_points, replace=False)) if n > score_points else np.arange(n)
+  score_model = model[:, :, score_index]
+  score_data = data[:, :, score_index]
+  m = len(score_index)
+
+  best_cost = np.full(T, np.inf)
+  best_s = np.ones(T)
+  best_R = np.tile(np.eye(3), (T, 1, 1))
+  best_t = np.zeros((T, 3, 1))
+  # LMedS has no inlier ratio, assume its breakdown point (half of the points are outliers)
+  needed = np.full(T, max_iter if threshold is not None else _ransac_iterations(0.5, sample_size, confidence, max_iter))
+  drawn = np.zeros(T, dtype=int)
+  while True:
+    active = frames[drawn < needed]
+    if len(active) == 0 or (time_budget is not None and drawn.any() and time.time() - start_time > time_budget):
+      break
+    b = hypotheses
+    index = _sample_indices(rng, n, (len(active), b), sample_size)  # a x b x k
+    sample_model = model[active[:, np.newaxis, np.newaxis], :, index].transpose(0, 1, 3, 2).reshape(-1, 3, sample_size)
+    sample_data = data[active[:, np.newaxis, np.newaxis], :, index].transpose(0, 1, 3, 2).reshape(-1, 3, sample_size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+      s, R, t, _ = align_sim3_batch(sample_model, sample_data)
+    s, R, t = s.reshape(-1, b), R.reshape(-1, b, 3, 3), t.reshape(-1, b, 3, 1)
+
+    # score every hypothesis: truncated squared error (MSAC) or median squared error (LMedS)
+    aligned = s[:, :, np.newaxis, np.newaxis] * np.matmul(R, score_data[active][:, np.newaxis]) + t
+    r2 = np.einsum('abkn,abkn->abn', aligned - score_model[active][:, np.newaxis],
+                   aligned - score_model[active][:, np.newaxis])
+    if threshold is None:
+      cost = np.median(r2, axis=2)
+    else:
+      cost = np.minimum(r2, threshold ** 2).sum(axis=2)
+    cost[~np.isfinite(cost)] = np.inf
+    best = np.argmin(cost, axis=1)
+    hypothesis_cost = cost[np.arange(len(active)), best]
+    improved = hypothesis_cost < best_cost[active]
+    better = active[improved]
+    best_cost[better] = hypothesis_cost[improved]
+    best_s[better] = s[improved, best[improved]]
+    best_R[better] = R[improved, best[improved]]
+    best_t[better] = t[improved, best[improved]]
+    drawn[active] += b
+
+    # adaptive number of hypotheses from the inlier ratio of the best hypothesis so far
+    if threshold is not None and improved.any():
+      inlier_ratio = (r2[improved, best[improved]] <= threshold ** 2).mean(axis=1)
+      needed[better] = _ransac_iterations(inlier_ratio, sample_size, confidence, max_iter)
+
+  # inlier set of the best hypothesis on all points, re-estimated on its inliers
+  s, R, t = best_s, best_R, best_t
+  for _ in range(2):
+    aligned = s[:, np.newaxis, np.newaxis] * np.matmul(R, data) + t
+    r2 = np.einsum('tkn,tkn->tn', aligned - model, aligned - model)
+    if threshold is None:
+      # robust standard deviation (Rousseeuw & Leroy) of the best LMedS hypothesis
+      sigma = 1.4826 * (1 + 5.0 / max(n - sample_size, 1)) * np.sqrt(np.median(r2, axis=1))
+      limit = (2.5 * sigma) ** 2
+    else:
+      limit = np.full(T, threshold ** 2)
+    inliers = r2 <= limit[:, np.newaxis]
+    enough = inliers.sum(axis=1) >= sample_size
+    if enough.any():
+      s_new, R_new, t_new, _ = align_sim3_batch(model[enough], data[enough], inliers[enough])
+      s[enough], R[enough], t[enough] = s_new, R_new, t_new
+  if huber is not None:
+    s, R, t, _ = refine_sim3_batch(model, data, s, R, t, weights=inliers, huber=huber)
+
+  aligned = s[:, np.newaxis, np.newaxis] * np.matmul(R, data) + t
+  t_error = np.sqrt(np.einsum('tkn,tkn->tn', aligned - model, aligned - model))
+  return s, R, t, t_error, inliers
+
+def ransac_sim3(model, data, threshold=None, sample_size=3, max_iter=1000, time_budget=None,
+                confidence=0.999, hypotheses=32, score_points=2048, rng=None, huber=None):
+  """Single frame version of ransac_sim3_batch.
+
+  Input:
+  model -- first trajectory (3xn)
+  data -- second trajectory (3xn)
+
+  Output:
+  s -- scale factor (scalar)
+  R -- rotation matrix (3x3)
+  t -- translation vector (3x1)
+  t_error -- translational error per point (1xn)
+  inliers -- inlier mask (n)
+
+  """
+  s, R, t, t_error, inliers = ransac_sim3_batch(np.asarray(model)[np.newaxis], np.asarray(data)[np.newaxis],
+                                                threshold, sample_size, max_iter, time_budget, confidence,
+                                                hypotheses, score_points, rng, huber)
+  return s[0], R[0], t[0], t_error[0], inliers[0]
+
 def align_se3(model,data, precision = False):
     """Align two trajectories using the method of Horn (closed-form).
 
@@ -72,7 +411,7 @@ def align_se3(model,data, precision = False):
     W = np.zeros((3, 3))
     for column in range(model.shape[1]):
         W += np.outer(model_zerocentered[:,column],data_zerocentered[:,column])
-    U,d,Vh = np.linalg.linalg.svd(W.transpose())
+    U,d,Vh = np.linalg.svd(W.transpose())
     S = np.matrix(np.identity( 3 ))
     if(np.linalg.det(U) * np.linalg.det(Vh)<0):
         S[2,2] = -1
@@ -116,9 +455,9 @@ def hand_eye_calib(q_gt, q_es, p_gt, p_es, I, delta=10, verbose=True):
     b_B[3*ix:3*ix+3,0] = np.dot(np.transpose(B1), p_gt[i+delta,:]-p_gt[i,:])
 
   # compute rotation
-  D,V = np.linalg.linalg.eig(np.dot(M.transpose(), M))
+  D,V = np.linalg.eig(np.dot(M.transpose(), M))
   Lambda = np.diag([np.sqrt(1.0/D[0]), np.sqrt(1.0/D[1]), np.sqrt(1.0/D[2])])
-  Vinv = np.linalg.linalg.inv(V)
+  Vinv = np.linalg.inv(V)
   X = np.dot(V, np.dot(Lambda, np.dot(Vinv, M.transpose())))
 
   # compute translation
@@ -0,0 +1,78 @@
+import os
+import traceback
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+批量处理文件的并行执行
+每个文件是一个独立的任务, 多进程执行, 结果顺序与任务顺序一致
+单个任务出错只记录错误, 不中断整个批处理
+注意: windows 下使用多进程的脚本需要放在 if __name__ == "__main__": 之下
+串行执行时公共参数直接传给每个任务, 不修改全局变量, 可以在多个线程中同时调用 (例如 Util.pipeline 的 stage)
+"""
+
+_shared_args = ()  # 每个工作进程只接收一次的公共参数, 例如 face_index, 只由 _init_worker 设置
+
+
+def _init_worker(shared_args):
+    global _shared_args
+    _shared_args = shared_args
+
+
+def _call_safely(func, shared_args, task):
+    """
+    :return: (True, 结果) 或 (False, 错误信息)
+    """
+    try:
+        return True, func(*(shared_args + tuple(task)))
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def _call_in_worker(func, task):
+    return _call_safely(func, _shared_args, task)
+
+
+def run_batch(func, tasks, workers=1, chunksize=16, shared_args=()):
+    """
+    对每个任务执行 func(*shared_args, *task)
+    :param func: 模块级的函数 (多进程时需要可以被 pickle)
+    :param tasks: 每个任务的参数元组 list
+    :param workers: 进程数, 1 为串行执行, None 或 0 为 cpu 核数;
+                    大于 1 时在当前线程中新建进程池, 在 pipeline 的工作线程中调用时也是如此 (linux 下为 fork)
+    :param chunksize: 每次发送给一个进程的任务个数
+    :param shared_args: 所有任务共用的参数元组, 每个进程只传递一次
+    :return: 结果 list (与 tasks 顺序一致, 出错的任务为 None), 错误 list [(任务序号, 错误信息)]
+    """
+    tasks = list(tasks)
+    shared_args = tuple(shared_args)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(len(tasks), 1))
+    if workers == 1:
+        outputs = [_call_safely(func, shared_args, task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shared_args,)) as executor:
+            outputs = list(executor.map(partial(_call_in_worker, func), tasks, chunksize=max(chunksize, 1)))
+    results = []
+    errors = []
+    for i, (ok, output) in enumerate(outputs):
+        if ok:
+            results.append(output)
+        else:
+            results.append(None)
+            errors.append((i, output))
+    return results, errors
+
+
+def report_errors(errors, names):
+    """
+    打印出错的任务
+    :param errors: run_batch 返回的错误 list
+    :param names: 每个任务的名字 (例如文件名) list
+    """
+    for i, message in errors:
+        print("处理 {} 失败:\n{}".format(names[i], message))
+    if errors:
+        print("共 {} 个文件处理失败".format(len(errors)))
@@ -0,0 +1,259 @@
+import numpy as np
+from scipy import sparse
+from scipy.fft import dct, idct
+from Util.mesh_io import load_obj_arrays
+
+"""
+稀疏的 blendshape
+大多数表情 (例如 L_cheekSquint, R_mouthStretchDn_Fix) 只移动很少一部分顶点,
+每个表情相对基础模型的偏移按 CSR 稀疏矩阵 (K, 3V) 保存, 只保存移动的顶点
+计算: v = base + weights.dot(deltas), 一帧或 (T, K) 的多帧系数都是一次稀疏矩阵乘法, 只写被移动过的坐标
+BlendshapeSolver 反过来由目标顶点拟合每一帧的系数
+"""
+
+
+class BlendshapeRig(object):
+
+    def __init__(self, base, deltas, faces=None, names=None, tolerance=0.0):
+        """
+        :param base: 基础模型的顶点 (V, 3)
+        :param deltas: 每个表情相对基础模型的偏移, (K, V, 3) 数组或 (K, 3V) 的稀疏矩阵
+        :param faces: 共用的面片
+        :param names: 每个表情的名字
+        :param tolerance: 偏移长度不超过 tolerance 的顶点视为没有移动
+        """
+        self.base = np.ascontiguousarray(base, dtype=np.float32).reshape(-1)
+        self.faces = faces
+        if sparse.issparse(deltas):
+            matrix = sparse.csr_matrix(deltas, dtype=np.float32)
+        else:
+            deltas = np.asarray(deltas, dtype=np.float32).reshape(len(deltas), -1, 3)
+            moved = np.linalg.norm(deltas, axis=2) > tolerance  # (K, V) 每个表情移动的顶点
+            deltas = deltas * moved[:, :, np.newaxis]
+            matrix = sparse.csr_matrix(deltas.reshape(len(deltas), -1))
+        assert matrix.shape[1] == len(self.base), "偏移的维度 {} 与基础模型 {} 不一致".format(matrix.shape[1], len(self.base))
+        matrix.eliminate_zeros()
+        self.matrix = matrix
+        self.names = list(names) if names is not None else ["{}".format(i) for i in range(matrix.shape[0])]
+        self.touched = np.unique(matrix.indices)  # 至少被一个表情移动的坐标
+        self._touched_base = self.base[self.touched]
+        self._compact_t = sparse.csr_matrix(matrix[:, self.touched].T)  # (C, K), 只包含移动过的坐标
+
+    @classmethod
+    def from_targets(cls, base, targets, faces=None, names=None, tolerance=0.0):
+        """
+        :param base: 基础模型的顶点 (V, 3)
+        :param targets: 每个表情的完整顶点 (K, V, 3) 或 (V, 3) 的 list
+        """
+        base = np.asarray(base, dtype=np.float32)
+        deltas = np.asarray(targets, dtype=np.float32) - base
+        return cls(base, deltas, faces, names, tolerance)
+
+    @classmethod
+    def from_obj_files(cls, base_file, target_files, names=None, tolerance=0.0):
+        """
+        :param base_file: 基础模型 obj
+        :param target_files: 每个表情的 obj 文件 list
+        """
+        base, faces = load_obj_arrays(base_file)
+        targets = np.empty((len(target_files), len(base), 3), dtype=np.float32)
+        for i, file in enumerate(target_files):
+            v, _ = load_obj_arrays(file)
+            assert v.shape == base.shape, "{} 与 {} 顶点数不一致".format(file, base_file)
+            targets[i] = v
+        return cls.from_targets(base, targets, faces, names, tolerance)
+
+    @property
+    def number_shapes(self):
+        return self.matrix.shape[0]
+
+    @property
+    def number_vertices(self):
+        return len(self.base) // 3
+
+    @property
+    def density(self):
+        """
+        :return: 非零偏移所占的比例
+        """
+        return self.matrix.nnz / float(self.matrix.shape[0] * self.matrix.shape[1])
+
+    def shape_coordinates(self, k):
+        """
+        :param k: 表情序号
+        :return: 第 k 个表情移动的坐标序号 (展开为 3V 后), 对应的偏移
+        """
+        start, end = self.matrix.indptr[k], self.matrix.indptr[k + 1]
+        return self.matrix.indices[start:end], self.matrix.data[start:end]
+
+    def apply_delta(self, out, k, delta_weight):
+        """
+        增量更新: 第 k 个表情的系数改变 delta_weight 时, 只改写该表情移动的坐标
+        :param out: 当前系数对应的顶点 (V, 3), 例如 buffer() 或 evaluate 的结果, 原地修改
+        :param k: 表情序号
+        :param delta_weight: 系数的变化量
+        :return: out
+        """
+        index, data = self.shape_coordinates(k)
+        flat = out.reshape(-1)
+        flat[index] += np.float32(delta_weight) * data
+        return out
+
+    def buffer(self, number_frames=None):
+        """
+        新建填充了基础模型的 float32 缓冲区, 作为 evaluate 的 out 反复使用
+        :param number_frames: None 时为一帧 (V, 3), 否则为 (T, V, 3)
+        """
+        if number_frames is None:
+            return self.base.reshape(-1, 3).copy()
+        return np.tile(self.base, (number_frames, 1)).reshape(number_frames, -1, 3)
+
+    def evaluate(self, weights, out=None, chunk_size=64):
+        """
+        :param weights: 一帧的系数 (K,) 或多帧的系数 (T, K)
+        :param out: buffer() 返回的缓冲区, 或者上一次 evaluate 的结果, 只会改写被移动过的坐标;
+                    为 None 时新建
+        :param chunk_size: 多帧时每次计算的帧数
+        :return: 顶点 (V, 3) 或 (T, V, 3) float32
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        single = weights.ndim == 1
+        w_t = np.ascontiguousarray(weights.reshape(-1, self.number_shapes).T)  # (K, T)
+        number_frames = w_t.shape[1]
+        if out is None:
+            out = self.buffer(None if single else number_frames)
+        flat = out.reshape(number_frames, -1)
+        assert np.shares_memory(flat, out), "out 需要是连续的数组"
+        for start in range(0, number_frames, chunk_size):
+            moved = self._compact_t.dot(w_t[:, start:start + chunk_size])  # (C, 块的帧数)
+            moved += self._touched_base[:, np.newaxis]
+            flat[start:start + chunk_size, self.touched] = moved.T
+        return out
+
+
+class BlendshapeSolver(object):
+    """
+    按目标顶点拟合每一帧的 blendshape 系数:
+        min 1/2 |A w_t - b_t|^2 + l2/2 |w_t|^2 + l1 |w_t|_1 + temporal/2 |w_t - w_(t-1)|^2,  bounds[0] <= w <= bounds[1]
+    A 为 (标记点的) 偏移, 正规方程 A^T A + l2 I 只分解一次 (特征分解, 可以加任意的对角平移),
+    约束和 L1 用 ADMM 处理, 时间平滑项沿时间做 DCT 后对角化, 所有帧一起求解
+    """
+
+    def __init__(self, rig, markers=None, bounds=(0.0, 1.0), l2=0.0, l1=0.0, temporal=0.0, rho=None):
+        """
+        :param rig: BlendshapeRig
+        :param markers: 只用这些顶点 (序号从 0 开始) 拟合, 默认全部顶点
+        :param bounds: 系数的上下限, None 为不限制
+        :param l2: L2 正则的系数
+        :param l1: L1 正则的系数 (稀疏的系数)
+        :param temporal: 相邻帧系数差的平方的系数 (平滑)
+        :param rho: ADMM 的步长, 默认为 A^T A + l2 I 特征值的平均值
+        """
+        self.rig = rig
+        self.markers = None if markers is None else np.asarray(markers, dtype=np.int64)
+        if self.markers is None:
+            coords = rig.touched
+        else:
+            coords = (3 * self.markers[:, np.newaxis] + np.arange(3)).reshape(-1)
+        # 没有被任何表情移动的坐标只给残差加上常数, 不影响系数
+        self.coords = coords[np.isin(coords, rig.touched)]
+        self.basis = sparse.csr_matrix(rig.matrix[:, self.coords], dtype=np.float64)  # A^T (K, C)
+        self.base = rig.base[self.coords].astype(np.float64)
+        self.bounds = bounds
+        self.l1 = l1
+        self.temporal = temporal
+        normal = self.basis.dot(self.basis.T).toarray() + l2 * np.eye(rig.number_shapes)
+        self.eigenvalues, self.eigenvectors = np.linalg.eigh(normal)
+        self.eigenvalues = np.maximum(self.eigenvalues, 1e-12 * max(self.eigenvalues[-1], 1.0))
+        self.rho = float(np.mean(self.eigenvalues)) if rho is None else rho
+
+    def _targets_to_rhs(self, targets, chunk_size=256):
+        """
+        :param targets: (T, V, 3) 目标顶点, 或者只有标记点的 (T, M, 3), 可以是内存映射
+        :return: A^T b_t (T, K)
+        """
+        number_frames = len(targets)
+        rhs = np.empty((number_frames, self.rig.number_shapes), dtype=np.float64)
+        full = np.shape(targets)[1] == self.rig.number_vertices
+        if full:
+            coords = self.coords
+        else:
+            assert self.markers is not None and np.shape(targets)[1] == len(self.markers), "目标的顶点数与 rig 和标记点都不一致"
+            marker_coords = (3 * self.markers[:, np.newaxis] + np.arange(3)).reshape(-1)
+            order = np.argsort(marker_coords)
+            coords = order[np.searchsorted(marker_coords, self.coords, sorter=order)]
+        for start in range(0, number_frames, chunk_size):
+            block = np.asarray(targets[start:start + chunk_size], dtype=np.float64).reshape(-1, np.prod(np.shape(targets)[1:]))
+            rhs[start:start + chunk_size] = self.basis.dot((block[:, coords] - self.base).T).T
+        return rhs
+
+    def _solve_shifted(self, rhs, shift, time_shift=None):
+        """
+        求解 (A^T A + l2 I + shift I) W_t + temporal * (L W)_t = rhs_t, L 为沿时间的拉普拉斯矩阵
+        :param rhs: (T, K)
+        :param time_shift: 拉普拉斯矩阵的特征值 (T,), 为 None 时不加时间项
+        """
+        x = rhs.dot(self.eigenvectors)
+        if time_shift is None:
+            x /= self.eigenvalues + shift
+        else:
+            x = dct(x, axis=0, norm='ortho')
+            x /= self.eigenvalues + shift + time_shift[:, np.newaxis]
+            x = idct(x, axis=0, norm='ortho')
+        return x.dot(self.eigenvectors.T)
+
+    def _prox(self, x, rho):
+        if self.l1 > 0:
+            x = np.sign(x) * np.maximum(np.abs(x) - self.l1 / rho, 0)
+        if self.bounds is not None:
+            x = np.clip(x, self.bounds[0], self.bounds[1])
+        return x
+
+    def _admm(self, rhs, init, extra_shift, time_shift, max_iter, tol):
+        if self.bounds is None and self.l1 == 0:
+            return self._solve_shifted(rhs, extra_shift, time_shift)
+        rho = self.rho
+        z = self._prox(self._solve_shifted(rhs, extra_shift, time_shift) if init is None else np.array(init, dtype=np.float64), rho)
+        u = np.zeros_like(z)
+        for _ in range(max_iter):
+            w = self._solve_shifted(rhs + rho * (z - u), extra_shift + rho, time_shift)
+            z_old = z
+            z = self._prox(w + u, rho)
+            u += w - z
+            primal = np.linalg.norm(w - z)
+            dual = rho * np.linalg.norm(z - z_old)
+            if primal <= tol * max(np.linalg.norm(w), 1.0) and dual <= tol * max(rho * np.linalg.norm(u), 1.0):
+                break
+        return z
+
+    def solve(self, targets, init=None, max_iter=200, tol=1e-5):
+        """
+        一起拟合整个序列 (时间平滑项使每一帧同时受到前后帧的约束)
+        :param targets: (T, V, 3) 目标顶点, 或者只有标记点的 (T, M, 3), 可以是 MeshSequence 的 frames
+        :param init: 初始系数 (T, K), 例如上一次拟合的结果
+        :return: 系数 (T, K)
+        """
+        rhs = self._targets_to_rhs(targets)
+        time_shift = None
+        if self.temporal > 0 and len(rhs) > 1:
+            # 路径图拉普拉斯矩阵的特征向量为 DCT-II 的基, 特征值为 4 sin^2(pi j / 2T)
+            time_shift = self.temporal * 4 * np.sin(np.pi * np.arange(len(rhs)) / (2 * len(rhs))) ** 2
+        return self._admm(rhs, init, 0.0, time_shift, max_iter, tol)
+
+    def solve_frame(self, target, previous=None, max_iter=200, tol=1e-5):
+        """
+        逐帧拟合 (实时), 以上一帧的系数为初值, 时间平滑项只约束到上一帧
+        :param target: (V, 3) 或只有标记点的 (M, 3) 目标顶点
+        :param previous: 上一帧的系数 (K,)
+        :return: 系数 (K,)
+        """
+        rhs = self._targets_to_rhs(np.asarray(target)[np.newaxis])
+        shift = 0.0
+        init = None
+        if previous is not None:
+            previous = np.asarray(previous, dtype=np.float64)
+            init = previous[np.newaxis]
+            if self.temporal > 0:
+                rhs += self.temporal * previous
+                shift = self.temporal
+        return self._admm(rhs, init, shift, None, max_iter, tol)[0]
@@ -0,0 +1,140 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+from scipy.interpolate import RBFInterpolator
+from Util.spatial_index import nearest_vertices
+from Util.topology import triangulate_faces
+
+"""
+变形迁移 (Sumner & Popovic 2004, Deformation Transfer for Triangle Meshes), 代替 matlab 的迁移步骤
+每个三角形加上沿法向的第 4 个点, 变形梯度 T = [x2-x1, x3-x1, x4-x1] [v2-v1, v3-v1, v4-v1]^-1 对未知顶点是线性的
+角色的变形梯度等于对应的演员三角形的变形梯度 -> 稀疏最小二乘 A^T A x = A^T b
+A^T A 只与角色的中性模型有关, 消去第 4 个点后只分解一次, 每个演员 blendshape 只是一组新的右端项 (三个坐标一起, 多个表情一批)
+"""
+
+
+def _triangles(faces):
+    """
+    :param faces: 面片 (从 1 开始), 可以是四边形, 按 triangulate_faces 三角化
+    :return: (F, 3) 三角形, 从 0 开始
+    """
+    tris, _ = triangulate_faces(faces)
+    return tris.astype(np.int64) - 1
+
+
+def _edge_frames(v, tris):
+    """
+    :return: (F, 3, 3) 每个三角形的 [v2-v1, v3-v1, v4-v1] (按列), v4-v1 = n / sqrt(|n|)
+    """
+    v = np.asarray(v, dtype=np.float64).reshape(-1, 3)
+    e1 = v[tris[:, 1]] - v[tris[:, 0]]
+    e2 = v[tris[:, 2]] - v[tris[:, 0]]
+    n = np.cross(e1, e2)
+    e3 = n / np.sqrt(np.linalg.norm(n, axis=1))[:, np.newaxis]
+    return np.stack((e1, e2, e3), axis=2)
+
+
+def triangle_correspondence(source_v, source_faces, target_v, target_faces, source_markers, target_markers):
+    """
+    演员与角色三角形的对应关系: 按标记点用薄板样条把演员变形到角色上, 再为每个角色三角形找中心最近的演员三角形
+    :param source_v: 演员中性模型顶点 (Vs, 3)
+    :param source_faces: 演员面片 (从 1 开始)
+    :param target_v: 角色中性模型顶点 (Vt, 3)
+    :param target_faces: 角色面片 (从 1 开始)
+    :param source_markers: 演员标记点的顶点序号 (从 0 开始)
+    :param target_markers: 角色标记点的顶点序号 (从 0 开始), 与 source_markers 一一对应
+    :return: (Ft,) 每个角色三角形对应的演员三角形序号
+    """
+    source_v = np.asarray(source_v, dtype=np.float64).reshape(-1, 3)
+    target_v = np.asarray(target_v, dtype=np.float64).reshape(-1, 3)
+    source_markers = np.asarray(source_markers, dtype=np.int64)
+    target_markers = np.asarray(target_markers, dtype=np.int64)
+    assert len(source_markers) == len(target_markers), "标记点个数不一致"
+    warp = RBFInterpolator(source_v[source_markers], target_v[target_markers] - source_v[source_markers],
+                           kernel='thin_plate_spline')
+    warped = source_v + warp(source_v)
+    source_tris = _triangles(source_faces)
+    target_tris = _triangles(target_faces)
+    source_centers = warped[source_tris].mean(axis=1)
+    target_centers = target_v[target_tris].mean(axis=1)
+    return nearest_vertices(source_centers, target_centers)
+
+
+class DeformationTransfer(object):
+
+    def __init__(self, source_v, source_faces, target_v, target_faces, correspondence, fixed=None):
+        """
+        建立并分解角色的稀疏方程
+        :param source_v: 演员中性模型顶点 (Vs, 3)
+        :param source_faces: 演员面片 (从 1 开始), 所有演员 blendshape 的点序与中性模型相同
+        :param target_v: 角色中性模型顶点 (Vt, 3)
+        :param target_faces: 角色面片 (从 1 开始)
+        :param correspondence: 每个角色三角形对应的演员三角形序号, 见 triangle_correspondence
+        :param fixed: 位置固定为中性模型的角色顶点序号 (从 0 开始), 默认只固定第 0 个点 (消除平移)
+        """
+        self.source_tris = _triangles(source_faces)
+        self.source_inverse = np.linalg.inv(_edge_frames(source_v, self.source_tris))
+        self.target_v = np.asarray(target_v, dtype=np.float64).reshape(-1, 3)
+        self.target_tris = _triangles(target_faces)
+        self.correspondence = np.asarray(correspondence, dtype=np.int64)
+        assert len(self.correspondence) == len(self.target_tris), "对应关系的长度与角色三角形个数不一致"
+        number_vertices = len(self.target_v)
+        number_tris = len(self.target_tris)
+        # 未知数: 角色顶点 + 每个三角形的第 4 个点; 每个三角形 3 行 (变形梯度的 3 列), 每行 4 个非零元素
+        inverse = np.linalg.inv(_edge_frames(self.target_v, self.target_tris))  # (F, 3, 3)
+        columns = np.column_stack((self.target_tris, number_vertices + np.arange(number_tris)))  # (F, 4)
+        values = np.concatenate((-inverse.sum(axis=1)[:, np.newaxis, :], inverse), axis=1)  # (F, 4, 3)
+        rows = np.arange(3 * number_tris).reshape(number_tris, 1, 3)
+        A = sparse.csr_matrix((values.reshape(-1), (np.broadcast_to(rows, values.shape).reshape(-1),
+                                                     np.broadcast_to(columns[:, :, np.newaxis], values.shape).reshape(-1))),
+                              shape=(3 * number_tris, number_vertices + number_tris))
+        if fixed is None:
+            fixed = [0]
+        self.fixed = np.asarray(fixed, dtype=np.int64)
+        free = np.ones(number_vertices, dtype=bool)
+        free[self.fixed] = False
+        self.free = np.flatnonzero(free)
+        A = A.tocsc()
+        A_free = A[:, self.free]
+        A_extra = A[:, number_vertices:]
+        # 每个第 4 个点只出现在自己三角形的 3 行中, 它们的法方程块是对角矩阵, 直接消去 (Schur 补),
+        # 只剩下与网格邻接关系相同稀疏度的 (自由顶点数, 自由顶点数) 方程
+        self.A_free_t = A_free.T.tocsr()
+        self.A_extra_t = A_extra.T.tocsr()
+        self.coupling = self.A_free_t.dot(A_extra).tocsr()  # (自由顶点, F)
+        self.extra_diagonal = np.asarray(A_extra.multiply(A_extra).sum(axis=0)).reshape(-1)
+        schur = self.A_free_t.dot(A_free) - self.coupling.dot(sparse.diags(1.0 / self.extra_diagonal)).dot(self.coupling.T)
+        self.fixed_offset = A[:, self.fixed].dot(self.target_v[self.fixed])  # 固定点对每一行的贡献 (3F, 3), 所有表情都相同
+        self.factor = splu(sparse.csc_matrix(schur), permc_spec='COLAMD')
+
+    def _gradients(self, source_shapes):
+        """
+        :param source_shapes: 演员 blendshape 顶点 (K, Vs, 3)
+        :return: 每个角色三角形的目标变形梯度按行展开 (3F, K, 3), 与 A 的行对应
+        """
+        S = np.stack([np.matmul(_edge_frames(v, self.source_tris), self.source_inverse) for v in source_shapes])
+        S = S[:, self.correspondence]  # (K, Ft, 3, 3)
+        return S.transpose(1, 3, 0, 2).reshape(3 * len(self.target_tris), len(source_shapes), 3)
+
+    def transfer(self, source_shapes, batch_size=32):
+        """
+        :param source_shapes: 演员 blendshape 顶点 (K, Vs, 3) 或一个 (Vs, 3)
+        :param batch_size: 每批一起回代的表情个数
+        :return: 角色 blendshape 顶点 (K, Vt, 3) 或 (Vt, 3)
+        """
+        source_shapes = np.asarray(source_shapes, dtype=np.float64)
+        single = source_shapes.ndim == 2
+        if single:
+            source_shapes = source_shapes[np.newaxis]
+        number_vertices = len(self.target_v)
+        out = np.empty((len(source_shapes), number_vertices, 3), dtype=np.float64)
+        for start in range(0, len(source_shapes), batch_size):
+            batch = source_shapes[start:start + batch_size]
+            n = len(batch)
+            b = (self._gradients(batch) - self.fixed_offset[:, np.newaxis, :]).reshape(-1, 3 * n)
+            rhs_extra = self.A_extra_t.dot(b) / self.extra_diagonal[:, np.newaxis]
+            rhs = self.A_free_t.dot(b) - self.coupling.dot(rhs_extra)
+            solution = self.factor.solve(rhs).reshape(-1, n, 3)  # (自由顶点, K, 3)
+            out[start:start + n, self.free] = solution.transpose(1, 0, 2)
+            out[start:start + n, self.fixed] = self.target_v[self.fixed]
+        return out[0] if single else out
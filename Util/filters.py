@@ -0,0 +1,70 @@
+import numpy as np
+
+"""
+One Euro 滤波 (Casiez et al. 2012, 1€ Filter: A Simple Speed-based Low-pass Filter for Noisy Input in Interactive Systems)
+速度慢时截止频率低, 去抖动; 速度快时截止频率高, 减少延迟
+每个滤波器对象保存自己的状态, 一次处理一帧中所有的点 (N, D)
+"""
+
+
+def _alpha(cutoff, freq):
+    tau = 1.0 / (2 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau * freq)
+
+
+class OneEuroFilter(object):
+
+    def __init__(self, freq=10.0, mincutoff=10.0, beta=0.05, dcutoff=1.0):
+        """
+        :param freq: 采样频率 (帧率), 调用时给出 timestamp 则按时间间隔更新
+        :param mincutoff: 最小截止频率, 越小越平滑, 延迟越大
+        :param beta: 速度系数, 越大快速运动时延迟越小
+        :param dcutoff: 速度 (导数) 低通滤波的截止频率
+        """
+        self.freq = freq
+        self.mincutoff = mincutoff
+        self.beta = beta
+        self.dcutoff = dcutoff
+        self.reset()
+
+    def reset(self):
+        self._x = None
+        self._dx = None
+        self._timestamp = None
+
+    def __call__(self, x, timestamp=None):
+        """
+        滤波一帧
+        :param x: 当前帧的数据, 例如 (N, D) 的关键点或顶点
+        :param timestamp: 当前帧的时间 (秒), None 时按 freq 等间隔
+        :return: 滤波后的数据 (新数组)
+        """
+        x = np.array(x, dtype=np.float64)
+        if timestamp is not None:
+            if self._timestamp is not None and timestamp > self._timestamp:
+                self.freq = 1.0 / (timestamp - self._timestamp)
+            self._timestamp = timestamp
+        if self._x is None:
+            self._x = x
+            self._dx = np.zeros_like(x)
+            return x.copy()
+        dx = (x - self._x) * self.freq
+        a_d = _alpha(self.dcutoff, self.freq)
+        self._dx = a_d * dx + (1 - a_d) * self._dx
+        cutoff = self.mincutoff + self.beta * np.abs(self._dx)
+        a = _alpha(cutoff, self.freq)
+        self._x = a * x + (1 - a) * self._x
+        return self._x.copy()
+
+    def filter_sequence(self, frames, out=None):
+        """
+        离线滤波整个序列, 从当前状态开始依次处理每一帧
+        :param frames: (T, N, D) 数组, 可以是内存映射
+        :param out: 保存结果的 (T, N, D) 数组, 可以是 frames 本身, 默认新建
+        :return: 滤波后的序列
+        """
+        if out is None:
+            out = np.empty(np.shape(frames), dtype=np.float64)
+        for i in range(len(frames)):
+            out[i] = self(frames[i])
+        return out
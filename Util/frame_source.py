@@ -0,0 +1,144 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from Util.mesh_io import load_obj_arrays
+
+"""
+播放器使用的帧数据源
+已经解码的帧保存在 LRU 缓存中, 后台线程按照当前的播放方向预读后面的 N 帧,
+按键切换帧时一般直接命中缓存, 不再等待磁盘(网络路径)和 obj 解析
+后台线程只读文件和做 numpy 运算, 不调用 vtk
+"""
+
+
+class FrameSource(object):
+
+    def __init__(self, loader, number_frames=None, cache_size=64, prefetch=8):
+        """
+        :param loader: loader(i) 返回第 i 帧的数据, 帧不存在时返回 None
+        :param number_frames: 帧数, None 表示未知(不限制预读的范围)
+        :param cache_size: 缓存的帧数
+        :param prefetch: 沿播放方向预读的帧数
+        """
+        self.loader = loader
+        self.number_frames = number_frames
+        self.cache_size = max(cache_size, prefetch + 1)
+        self.prefetch = prefetch
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._current = None
+        self._direction = 1
+        self._closed = False
+        self._thread = None
+        if prefetch > 0:
+            self._thread = threading.Thread(target=self._prefetch_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    @classmethod
+    def from_obj_pattern(cls, pattern, number_frames=None, dtype=np.float32, **kwargs):
+        """
+        :param pattern: 带帧号的 obj 路径, 例如 os.path.join(model_path, "hand-{}.obj") 或 "align-{:03}.obj"
+        :param number_frames: 帧数
+        :param dtype: 顶点的数据类型
+        :return: 每一帧为顶点 (V, 3) 数组的 FrameSource
+        """
+        def loader(i):
+            file_name = pattern.format(i)
+            if not os.path.exists(file_name):
+                return None
+            v, _ = load_obj_arrays(file_name, dtype)
+            return v
+        return cls(loader, number_frames, **kwargs)
+
+    @classmethod
+    def from_sequence(cls, seq, **kwargs):
+        """
+        :param seq: MeshSequence
+        :return: 每一帧为顶点 (V, 3) 数组的 FrameSource, 预读会把内存映射的数据提前读入内存
+        """
+        return cls(lambda i: np.array(seq[i]), len(seq), **kwargs)
+
+    def __len__(self):
+        assert self.number_frames is not None, "帧数未知"
+        return self.number_frames
+
+    def _in_range(self, i):
+        return i >= 0 and (self.number_frames is None or i < self.number_frames)
+
+    def _put(self, i, frame):
+        """
+        需要在持有 self._lock 时调用
+        """
+        self._cache[i] = frame
+        self._cache.move_to_end(i)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def get(self, i):
+        """
+        取第 i 帧, 并让后台线程沿 上一次 -> 这一次 的方向继续预读
+        :param i: 帧号
+        :return: 第 i 帧的数据, 帧不存在时为 None
+        """
+        with self._lock:
+            if self._current is not None and i != self._current:
+                self._direction = 1 if i > self._current else -1
+            self._current = i
+            frame = self._cache.get(i)
+            if frame is not None:
+                self._cache.move_to_end(i)
+            self._wakeup.notify()
+        if frame is None and self._in_range(i):
+            frame = self.loader(i)
+            if frame is not None:
+                with self._lock:
+                    self._put(i, frame)
+        return frame
+
+    def _next_missing(self):
+        """
+        需要在持有 self._lock 时调用
+        :return: 当前方向上第一个没有缓存的帧号, 没有时为 None
+        """
+        if self._current is None:
+            return None
+        for k in range(1, self.prefetch + 1):
+            j = self._current + k * self._direction
+            if not self._in_range(j):
+                return None
+            if j not in self._cache:
+                return j
+        return None
+
+    def _prefetch_loop(self):
+        while True:
+            with self._lock:
+                j = self._next_missing()
+                while j is None and not self._closed:
+                    self._wakeup.wait()
+                    j = self._next_missing()
+                if self._closed:
+                    return
+            try:
+                frame = self.loader(j)
+            except Exception as e:
+                print("预读第 {} 帧失败: {}".format(j, e))
+                frame = None
+            with self._lock:
+                if frame is None:  # 不存在的帧之后停止预读, 直到下一次 get
+                    self._current = None
+                else:
+                    self._put(j, frame)
+
+    def close(self):
+        """
+        停止后台预读线程
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,185 @@
+import numpy as np
+from Util.align_trajectory import align_sim3_batch, so3_exp
+from Util.spatial_index import get_kdtree
+from Util.topology import triangulate_faces
+
+"""
+没有点对点对应关系时的刚体 (可选缩放) 对齐: ICP, 例如 PhotoScan, Wrap 的扫描或 MANO 的输出
+对应点: 目标模型的 KD 树只建一次 (spatial_index 按内容缓存), 每次迭代一次查询所有点
+剔除: 距离超过 max_distance 的对应点, 再按 trim 只保留距离最小的一部分 (trimmed ICP), 可选 Huber 权重
+点到面: 沿目标法向的线性化最小二乘 (Gauss-Newton), 收敛快, 默认使用
+点到点: 每次迭代用加权 Umeyama 求闭式解, 收敛慢, 离初值较远时容易停在局部极小,
+没有初值时先用 coarse_iter 次点到面迭代得到接近的位姿
+对齐序列时每一帧从上一帧的结果开始迭代
+约定与 align_sim3 相同: target ≈ s * R * source + t
+"""
+
+
+def vertex_normals(v, faces=None, k=12):
+    """
+    :param v: 顶点 (n, 3)
+    :param faces: 面片 (从 1 开始, 可以是四边形), 给出时使用面积加权的面法向平均
+    :param k: 没有面片时用 k 个最近邻的 PCA 估计法向 (方向不统一, 点到面距离与方向无关)
+    :return: 单位法向 (n, 3)
+    """
+    v = np.asarray(v, dtype=np.float64).reshape(-1, 3)
+    if faces is not None:
+        tris, _ = triangulate_faces(faces)
+        tris = tris.astype(np.int64) - 1
+        face_normals = np.cross(v[tris[:, 1]] - v[tris[:, 0]], v[tris[:, 2]] - v[tris[:, 0]])  # 长度为面积的两倍
+        normals = np.zeros_like(v)
+        for corner in range(3):
+            for axis in range(3):
+                normals[:, axis] += np.bincount(tris[:, corner], face_normals[:, axis], minlength=len(v))
+    else:
+        _, index = get_kdtree(v).query(v, k=min(k, len(v)))
+        neighbors = v[index] - v[index].mean(axis=1, keepdims=True)  # (n, k, 3)
+        _, vectors = np.linalg.eigh(np.matmul(neighbors.transpose(0, 2, 1), neighbors))
+        normals = vectors[:, :, 0]  # 最小特征值对应的特征向量
+    length = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(length > 0, length, 1.0)
+
+
+class ICP(object):
+
+    def __init__(self, target_v, target_faces=None, point_to_plane=True, scale=False, trim=0.9, max_distance=None,
+                 huber=None, max_iter=50, tol=1e-6, normal_neighbors=12, coarse_iter=10):
+        """
+        :param target_v: 目标顶点 (n, 3), KD 树和法向只计算一次
+        :param target_faces: 目标面片 (从 1 开始), 用于计算法向, 没有时按最近邻估计
+        :param point_to_plane: True 为点到面, False 为点到点
+                               (点到点需要接近的初值, 没有 init 时先做 coarse_iter 次点到面迭代)
+        :param scale: 是否同时求缩放
+        :param trim: 每次迭代保留的对应点比例 (按距离从小到大), 1 为不剔除
+        :param max_distance: 对应点的最大距离, 超过的不参与计算, None 为不限制
+        :param huber: Huber 阈值, 在剔除之后进一步降低误差大的对应点的权重, None 为最小二乘
+        :param max_iter: 最大迭代次数
+        :param tol: 位姿的变化 (旋转弧度 + 平移/目标尺寸) 小于 tol 时停止
+        :param normal_neighbors: 估计法向时的最近邻个数
+        :param coarse_iter: 点到点没有初值时先做的点到面迭代次数, 0 为不做 (此时只对齐重心, 旋转相差较大时会失败)
+        """
+        self.target = np.ascontiguousarray(target_v, dtype=np.float64).reshape(-1, 3)
+        self.tree = get_kdtree(self.target)
+        self.point_to_plane = point_to_plane
+        self.coarse_iter = 0 if point_to_plane else coarse_iter
+        self.normals = None
+        if point_to_plane or self.coarse_iter > 0:
+            self.normals = vertex_normals(self.target, target_faces, normal_neighbors)
+        self.scale = scale
+        self.trim = trim
+        self.max_distance = max_distance
+        self.huber = huber
+        self.max_iter = max_iter
+        self.tol = tol
+        self.size = np.linalg.norm(self.target.max(axis=0) - self.target.min(axis=0))
+
+    def _initial(self, source):
+        """
+        没有初值时只对齐重心 (和尺寸)
+        """
+        mu_source = source.mean(axis=0)
+        mu_target = self.target.mean(axis=0)
+        s = 1.0
+        if self.scale:
+            s = np.sqrt(((self.target - mu_target) ** 2).sum(axis=1).mean() / ((source - mu_source) ** 2).sum(axis=1).mean())
+        return s, np.eye(3), (mu_target - s * mu_source).reshape(3, 1)
+
+    def _correspondences(self, moved):
+        """
+        :return: 每个点最近的目标顶点序号, 距离, 权重 (被剔除的为 0)
+        """
+        upper = np.inf if self.max_distance is None else self.max_distance
+        distance, index = self.tree.query(moved, distance_upper_bound=upper)
+        valid = index < self.tree.n
+        weights = valid.astype(np.float64)
+        if self.trim < 1 and valid.any():
+            limit = np.quantile(distance[valid], self.trim)
+            weights[distance > limit] = 0
+        if self.huber is not None:
+            weights *= np.where(distance <= self.huber, 1.0, self.huber / np.maximum(distance, 1e-300))
+        index[~valid] = 0
+        return index, np.where(valid, distance, np.inf), weights
+
+    def _point_to_point(self, source, matched, weights):
+        s, R, t, _ = align_sim3_batch(matched.T[np.newaxis], source.T[np.newaxis], weights[np.newaxis])
+        s, R, t = s[0], R[0], t[0]
+        if not self.scale:
+            # 旋转与缩放无关, 只需要按 s = 1 重新计算平移
+            w = weights / weights.sum()
+            s = 1.0
+            t = (w.dot(matched) - R.dot(w.dot(source))).reshape(3, 1)
+        return s, R, t
+
+    def _point_to_plane(self, source, index, weights, s, R, t):
+        """
+        残差 n·(s*R*x + t - q) 在当前位姿处线性化, 更新 R <- exp(w) R, t <- t + dt, s <- s * exp(ds)
+        """
+        normals = self.normals[index]
+        a = s * source.dot(R.T)
+        r = ((a + t[:, 0] - self.target[index]) * normals).sum(axis=1)
+        J = np.column_stack((np.cross(a, normals), normals) + (((a * normals).sum(axis=1),) if self.scale else ()))
+        H = (J * weights[:, np.newaxis]).T.dot(J)
+        g = (J * weights[:, np.newaxis]).T.dot(r)
+        delta = -np.linalg.solve(H + 1e-9 * np.trace(H) * np.eye(len(H)), g)
+        if self.scale:
+            s = s * np.exp(delta[6])
+        return s, so3_exp(delta[np.newaxis, 0:3])[0].dot(R), t + delta[3:6].reshape(3, 1)
+
+    def _iterate(self, source, s, R, t, point_to_plane, max_iter):
+        for _ in range(max_iter):
+            moved = s * source.dot(R.T) + t[:, 0]
+            index, distance, weights = self._correspondences(moved)
+            if weights.sum() <= 0:
+                break
+            if point_to_plane:
+                s_new, R_new, t_new = self._point_to_plane(source, index, weights, s, R, t)
+            else:
+                s_new, R_new, t_new = self._point_to_point(source, self.target[index], weights)
+            angle = np.arccos(np.clip((np.trace(R_new.dot(R.T)) - 1) / 2, -1, 1))
+            change = angle + np.linalg.norm(t_new - t) / self.size + abs(np.log(s_new / s))
+            s, R, t = s_new, R_new, t_new
+            if change < self.tol:
+                break
+        return s, R, t
+
+    def align(self, source_v, init=None):
+        """
+        :param source_v: 要对齐的顶点 (m, 3)
+        :param init: 初值 (s, R, t), 例如上一帧的结果, None 时只对齐重心 (点到点再先做 coarse_iter 次点到面迭代)
+        :return: s, R (3 x 3), t (3 x 1), 保留的对应点的平均距离, 保留的对应点比例
+        """
+        source = np.asarray(source_v, dtype=np.float64).reshape(-1, 3)
+        if init is None:
+            s, R, t = self._initial(source)
+            s, R, t = self._iterate(source, s, R, t, True, self.coarse_iter)
+        else:
+            s, R, t = init
+            s, R, t = float(s), np.array(R, dtype=np.float64), np.array(t, dtype=np.float64).reshape(3, 1)
+        s, R, t = self._iterate(source, s, R, t, self.point_to_plane, self.max_iter)
+        moved = s * source.dot(R.T) + t[:, 0]
+        _, distance, weights = self._correspondences(moved)
+        kept = weights > 0
+        res = distance[kept].mean() if kept.any() else np.inf
+        return s, R, t, res, kept.mean()
+
+    def align_sequence(self, frames, out=None, init=None):
+        """
+        对齐序列的每一帧, 每一帧从上一帧的结果开始迭代
+        :param frames: (T, m, 3) 数组, 可以是内存映射 (MeshSequence.frames)
+        :param out: 保存对齐后顶点的 (T, m, 3) 数组, 可以是 frames 本身, None 时不保存
+        :param init: 第一帧的初值 (s, R, t)
+        :return: s (T,), R (T x 3 x 3), t (T x 3 x 1), 每帧的平均距离 (T,), 每帧保留的对应点比例 (T,)
+        """
+        number_frames = len(frames)
+        s = np.empty((number_frames,))
+        R = np.empty((number_frames, 3, 3))
+        t = np.empty((number_frames, 3, 1))
+        res = np.empty((number_frames,))
+        ratio = np.empty((number_frames,))
+        for i in range(number_frames):
+            source = np.asarray(frames[i], dtype=np.float64)
+            s[i], R[i], t[i], res[i], ratio[i] = self.align(source, init)
+            init = (s[i], R[i], t[i])
+            if out is not None:
+                out[i] = s[i] * source.dot(R[i].T) + t[i, :, 0]
+        return s, R, t, res, ratio
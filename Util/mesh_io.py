@@ -0,0 +1,371 @@
+import os
+import re
+import time
+import hashlib
+from itertools import chain
+import numpy as np
+
+"""
+obj 文件的快速读取
+整个文件一次读入, 用 numpy 在字节上找出所有 v / f 行, 按连续的行块一次切出,
+再批量分词和转换数值, 不再逐行 split 和逐个 float()
+face 中的 v/vt/vn 形式只保留顶点索引
+可选的本地二进制缓存 MeshCache: 同一个文件再次读取时只做一次内存映射
+"""
+
+_FACE_ATTR = re.compile(rb'/[^ \t\r\n]*')  # 去掉 v/vt/vn 中 / 之后的部分
+_COMMENT = re.compile(rb'#[^\n]*')  # 去掉 # 之后的注释, 保留换行符
+
+_mesh_cache = None  # enable_mesh_cache 之后 load_obj_arrays 默认使用的缓存
+
+
+def _select_lines(data, buf, starts, ends, tag):
+    """
+    取出以 tag 开头的所有行 (如 v 不包含 vt vn)
+    :param data: obj 文件内容 bytes, 以换行符结尾
+    :param buf: data 的 uint8 视图
+    :param starts: 每一行的起始位置
+    :param ends: 每一行换行符的位置
+    :param tag: 行首标记 b'v' b'vt' 或 b'f'
+    :return: 去掉行首标记后以换行符连接的内容, 行数
+    """
+    last_index = len(buf) - 1
+    mask = np.ones(len(starts), dtype=bool)
+    for j, c in enumerate(tag):
+        mask &= buf[np.minimum(starts + j, last_index)] == c
+    c1 = buf[np.minimum(starts + len(tag), last_index)]
+    selected = np.flatnonzero(mask & ((c1 == 32) | (c1 == 9)))
+    if len(selected) == 0:
+        return b'', 0
+    # obj 中同类的行一般是连续的, 按连续的行块切片
+    breaks = np.flatnonzero(np.diff(selected) != 1)
+    first = selected[np.concatenate(([0], breaks + 1))]
+    last = selected[np.concatenate((breaks, [len(selected) - 1]))]
+    block = b''.join([data[s:e + 1] for s, e in zip(starts[first].tolist(), ends[last].tolist())])
+    return block.translate(None, tag), len(selected)
+
+
+def _count_tokens(block, n_lines):
+    """
+    统计多行文本中每一行的数值个数, 以及每个数值中 / 的个数
+    :param block: 以换行符连接的多行内容 bytes (不含行首的 v/f)
+    :param n_lines: 行数
+    :return: 每一行的数值个数, 每个数值中 / 的个数
+    """
+    if n_lines == 0:
+        return np.zeros((0,), dtype=np.int64), np.zeros((0,), dtype=np.int64)
+    buf = np.frombuffer(block, dtype=np.uint8)
+    is_token = buf > 32  # 空格 制表符 换行 回车 都小于等于 32
+    starts = is_token.copy()
+    starts[1:] &= ~is_token[:-1]  # 每个数值的第一个字符
+    starts = np.flatnonzero(starts)
+    line_id = np.searchsorted(np.flatnonzero(buf == 10), starts)
+    token_id = np.searchsorted(starts, np.flatnonzero(buf == 47), side='right') - 1
+    slashes = np.bincount(token_id, minlength=len(starts))
+    return np.bincount(line_id, minlength=n_lines), slashes
+
+
+def _pack_rows(values, counts, width, fill):
+    """
+    将长度不一的行填充为 (n, width) 的矩阵
+    :param values: 所有数值的一维数组
+    :param counts: 每一行的数值个数
+    :param width: 输出的列数, 多余的数值被丢弃
+    :param fill: 不足 width 的位置的填充值
+    :return: (n, width) 的矩阵
+    """
+    n = len(counts)
+    if n == 0:  # 例如没有 f 行的点云或标记点 obj
+        return np.full((0, width), fill, dtype=values.dtype)
+    if (counts == width).all():
+        return values.reshape(n, width)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    row = np.repeat(np.arange(n), counts)
+    col = np.arange(len(values)) - np.repeat(offsets, counts)
+    keep = col < width
+    out = np.full((n, width), fill, dtype=values.dtype)
+    out[row[keep], col[keep]] = values[keep]
+    return out
+
+
+def load_obj_arrays(path, dtype=np.float32, cache=None):
+    """
+    快速读取三角形/四边形/多边形的 obj
+    :param path: obj 文件路径
+    :param dtype: 顶点的数据类型 np.float32 或 np.float64
+    :param cache: MeshCache, 为 None 时使用 enable_mesh_cache 设置的缓存(没有设置则不缓存)
+    :return: 顶点 (n, 3) dtype 连续数组, 面片 (m, k) int32 数组
+             面片索引与 obj 一致从 1 开始, k 为最大的边数, 边数不足 k 的面用 0 补齐
+    """
+    if cache is None:
+        cache = _mesh_cache
+    if cache is not None:
+        return cache.load(path, dtype)
+    with open(path, 'rb') as f:
+        data = f.read()
+    return parse_obj_bytes(data, dtype)
+
+
+def _line_index(data):
+    """
+    :return: 以换行符结尾的 data, 它的 uint8 视图, 每一行的起始位置, 每一行换行符的位置
+    """
+    if not data.endswith(b'\n'):
+        data = data + b'\n'
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return data, buf, starts, ends
+
+
+def _parse_face_block(data, buf, starts, ends, component=0):
+    """
+    解析所有的 f 行
+    :param component: 0 取顶点索引, 1 取纹理坐标索引 (v/vt/vn 中的第几项)
+    :return: 面片 (m, k) int32 数组, 用 0 补齐
+    """
+    block, n_lines = _select_lines(data, buf, starts, ends, b'f')
+    block = block.replace(b'//', b'/0/')
+    counts, slashes = _count_tokens(block, n_lines)
+    if len(slashes) and slashes.max() > 0:  # 根据需要这里补充obj的其他格式解析
+        if (slashes == slashes[0]).all():  # v/vt v/vt/vn 各个面格式一致, 只取每组的第 component 个
+            values = np.fromstring(block.replace(b'/', b' '), dtype=np.int64, sep=' ')[component::slashes[0] + 1]
+        else:
+            assert component == 0, 'obj 中各个面的格式不一致, 无法解析纹理坐标索引'
+            values = np.fromstring(_FACE_ATTR.sub(b'', block), dtype=np.int64, sep=' ')
+    elif component == 0:
+        values = np.fromstring(block, dtype=np.int64, sep=' ')
+    else:  # 没有纹理坐标索引
+        values = np.zeros((counts.sum(),), dtype=np.int64)
+    assert len(values) == counts.sum(), 'obj 面片解析失败'
+    width = int(counts.max()) if len(counts) else 3
+    return np.ascontiguousarray(_pack_rows(values.astype(np.int32), counts, width, 0))
+
+
+def parse_obj_bytes(data, dtype=np.float32):
+    """
+    解析内存中的 obj 文件内容, 参数与返回值同 load_obj_arrays
+    """
+    data, buf, starts, ends = _line_index(data)
+    block, n_lines = _select_lines(data, buf, starts, ends, b'v')
+    if b'#' in block:  # 行尾注释, 例如 v 1 2 3 # c
+        block = _COMMENT.sub(b'', block)
+    values = np.array(block.split(), dtype=dtype)
+    if len(values) == 3 * n_lines:  # 绝大多数 obj 每行正好 3 个坐标
+        vertices = values.reshape(-1, 3)
+    else:  # 带顶点颜色等附加数据
+        counts, _ = _count_tokens(block, n_lines)
+        vertices = np.ascontiguousarray(_pack_rows(values, counts, 3, 0))
+    faces = _parse_face_block(data, buf, starts, ends)
+    return vertices, faces
+
+
+def load_obj_uv(path, dtype=np.float32):
+    """
+    读取 obj 的纹理坐标
+    :param path: obj 文件路径
+    :param dtype: 纹理坐标的数据类型
+    :return: 纹理坐标 (n, 2), 每个面的纹理坐标索引 (m, k) int32 从 1 开始, 与 load_obj_arrays 的面片一一对应
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    data, buf, starts, ends = _line_index(data)
+    block, n_lines = _select_lines(data, buf, starts, ends, b'vt')
+    values = np.array(block.split(), dtype=dtype)
+    counts, _ = _count_tokens(block, n_lines)
+    vts = np.ascontiguousarray(_pack_rows(values, counts, 2, 0))
+    face_uvs = _parse_face_block(data, buf, starts, ends, component=1)
+    return vts, face_uvs
+
+
+def faces_to_list(faces):
+    """
+    将 load_obj_arrays 返回的面片数组转化为 loadObj 使用的 list, 去掉补齐用的 0
+    :param faces: (m, k) 面片数组
+    :return: 面片 list
+    """
+    faces_list = faces.tolist()
+    if faces.size and (faces == 0).any():
+        faces_list = [[i for i in face if i != 0] for face in faces_list]
+    return faces_list
+
+
+def faces_to_array(faces):
+    """
+    将 loadObj 使用的面片 list 转化为 (m, k) int32 数组, 边数不足 k 的面用 0 补齐
+    :param faces: 面片 list 或数组
+    :return: 面片数组
+    """
+    if isinstance(faces, np.ndarray):
+        return faces
+    counts = np.fromiter(map(len, faces), dtype=np.int64, count=len(faces))
+    if len(counts) == 0:
+        return np.zeros((0, 3), dtype=np.int32)
+    values = np.fromiter(chain.from_iterable(faces), dtype=np.int32, count=int(counts.sum()))
+    return _pack_rows(values, counts, int(counts.max()), 0)
+
+
+_FACE_PAD = re.compile(rb' 0(?:/0)?(?=[ \n])')  # 面片中补齐用的 0
+
+
+def _format_rows(tag, rows, fmt):
+    """
+    一次格式化所有行, 例如 tag='v' fmt='%.6f' 得到 'v x y z\n...', fmt 为 '%d/%d' 时每两列为一项
+    """
+    if rows.size == 0:
+        return ''
+    line = tag + (' ' + fmt) * (rows.shape[1] // fmt.count('%')) + '\n'
+    return (line * rows.shape[0]) % tuple(rows.ravel().tolist())
+
+
+def write_obj_arrays(path, vertices, faces, vts=None, face_uvs=None, precision=6, verbose=False):
+    """
+    一次性格式化顶点, 纹理坐标和面片并一次写出 obj
+    :param path: 保存的文件路径
+    :param vertices: 顶点 (n, 3)
+    :param faces: 面片 (m, k), 从 1 开始, 可以是 load_obj_arrays 返回的用 0 补齐的数组
+    :param vts: 纹理坐标 (n_vt, 2), 写在面片之前
+    :param face_uvs: 每个面的纹理坐标索引 (m, k), 与 faces 一一对应;
+                     为 None 且纹理坐标与顶点个数相同时, 使用与顶点相同的索引
+    :param precision: 坐标保留的小数位数, None 时与 str(float) 一致保留全部精度
+    :param verbose: 是否打印保存信息
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = faces_to_array(faces).astype(np.int64)
+    fmt = '%r' if precision is None else '%.{}f'.format(precision)
+    text = _format_rows('v', vertices, fmt)
+    if vts is not None:
+        vts = np.asarray(vts, dtype=np.float64)
+        text += _format_rows('vt', vts[:, :2], fmt)
+        if face_uvs is None:
+            assert len(vts) == len(vertices), '纹理坐标与顶点个数不同时需要给出 face_uvs'
+            face_uvs = faces
+        face_uvs = faces_to_array(face_uvs).astype(np.int64)
+        assert face_uvs.shape == faces.shape, 'face_uvs 与 faces 形状不一致'
+        pairs = np.stack((faces, face_uvs), axis=2).reshape(len(faces), -1)
+        f_text = _format_rows('f', pairs, '%d/%d')
+    else:
+        f_text = _format_rows('f', faces, '%d')
+    f_text = f_text.encode('ascii')
+    if (faces == 0).any():  # 去掉补齐用的 0 (及其 /0)
+        f_text = _FACE_PAD.sub(b'', f_text)
+    with open(path, 'wb') as f:
+        f.write(text.encode('ascii') + f_text)
+    if verbose:
+        print("saved mesh to {}".format(path))
+
+
+class MeshCache(object):
+    """
+    obj 解析结果的本地二进制缓存
+    以 (绝对路径, 修改时间, 文件大小, dtype) 为键, 顶点和面片各存为一个 .npy 文件,
+    命中时以内存映射(copy-on-write)的方式返回, 不再读取和解析原始 obj
+    缓存目录总大小超过 max_bytes 时按最近使用时间淘汰
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2 * 1024 ** 3):
+        """
+        :param cache_dir: 缓存目录, 默认 ~/.util_tool_cache/mesh
+        :param max_bytes: 缓存目录大小上限 字节
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.util_tool_cache', 'mesh')
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.used_bytes = sum(size for _, size, _ in self._entries())
+
+    def _key(self, path, dtype):
+        st = os.stat(path)
+        raw = '{}|{}|{}|{}'.format(os.path.abspath(path), st.st_mtime_ns, st.st_size, np.dtype(dtype).name)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def _entries(self):
+        """
+        :return: 缓存目录中所有的 (文件路径, 大小, 最近使用时间)
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npy'):
+                st = entry.stat()
+                entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    def load(self, path, dtype=np.float32):
+        """
+        读取 obj, 参数与返回值同 load_obj_arrays
+        """
+        key = self._key(path, dtype)
+        v_file = os.path.join(self.cache_dir, key + '.v.npy')
+        f_file = os.path.join(self.cache_dir, key + '.f.npy')
+        if os.path.exists(v_file) and os.path.exists(f_file):
+            try:
+                vertices = np.load(v_file, mmap_mode='c')
+                faces = np.load(f_file, mmap_mode='c')
+                now = time.time()
+                os.utime(v_file, (now, now))  # 以修改时间记录最近使用时间
+                os.utime(f_file, (now, now))
+                return vertices, faces
+            except (IOError, OSError, ValueError):
+                pass  # 缓存损坏或为空数组 重新解析
+        with open(path, 'rb') as f:
+            data = f.read()
+        vertices, faces = parse_obj_bytes(data, dtype)
+        self.used_bytes += self._save(v_file, vertices) + self._save(f_file, faces)
+        if self.used_bytes > self.max_bytes:
+            self.evict()
+        return vertices, faces
+
+    def _save(self, file_name, array):
+        tmp_file = '{}.{}.tmp'.format(file_name, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_file, file_name)  # 多个进程同时写入时保证文件完整
+        return os.path.getsize(file_name)
+
+    def evict(self):
+        """
+        按最近使用时间从旧到新删除缓存文件, 直到总大小不超过 max_bytes 的 90%
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.used_bytes = sum(size for _, size, _ in entries)
+        for file_name, size, _ in entries:
+            if self.used_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(file_name)
+                self.used_bytes -= size
+            except OSError:
+                pass  # windows 下正在被内存映射的文件无法删除
+
+    def clear(self):
+        """
+        清空缓存目录
+        """
+        for file_name, _, _ in self._entries():
+            try:
+                os.remove(file_name)
+            except OSError:
+                pass
+        self.used_bytes = 0
+
+
+def enable_mesh_cache(cache_dir=None, max_bytes=2 * 1024 ** 3):
+    """
+    打开 load_obj_arrays(以及 loadObj) 的本地缓存, 适合反复读取同一批(网络上的) obj 的脚本
+    :param cache_dir: 缓存目录, 默认 ~/.util_tool_cache/mesh
+    :param max_bytes: 缓存目录大小上限 字节
+    :return: MeshCache
+    """
+    global _mesh_cache
+    _mesh_cache = MeshCache(cache_dir, max_bytes)
+    return _mesh_cache
+
+
+def disable_mesh_cache():
+    """
+    关闭 load_obj_arrays 的本地缓存
+    """
+    global _mesh_cache
+    _mesh_cache = None
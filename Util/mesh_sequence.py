@@ -0,0 +1,220 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+from Util.mesh_io import load_obj_arrays, write_obj_arrays, faces_to_array
+
+"""
+拓扑相同的 obj 序列 (例如 {i}.obj, hand-{i}.obj, align-{i:03}.obj) 的存储格式
+一个序列是一个目录:
+    faces.npy   共用的面片 (F, K) int32, 与 load_obj_arrays 一致从 1 开始, 用 0 补齐
+    frames.npy  所有帧的顶点 (T, V, 3) float32
+    names.json  每一帧对应的 obj 文件名
+frames.npy 以内存映射方式打开, 读取任意一帧都不需要读取整个序列
+"""
+
+FACES_FILE = 'faces.npy'
+FRAMES_FILE = 'frames.npy'
+NAMES_FILE = 'names.json'
+
+
+def natural_sort_key(name):
+    """
+    按文件名中的数字排序, 2.obj 排在 10.obj 之前
+    """
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', name)]
+
+
+class MeshSequence(object):
+    """
+    共用拓扑的 mesh 序列, seq[i] 返回第 i 帧的顶点 (V, 3)
+    """
+
+    def __init__(self, seq_path, mode='r'):
+        """
+        :param seq_path: 序列目录
+        :param mode: 'r' 只读, 'r+' 可以修改顶点, 'c' 修改只在内存中生效
+        """
+        self.seq_path = seq_path
+        self.faces = np.load(os.path.join(seq_path, FACES_FILE))
+        self.frames = np.load(os.path.join(seq_path, FRAMES_FILE), mmap_mode=mode)
+        names_file = os.path.join(seq_path, NAMES_FILE)
+        if os.path.exists(names_file):
+            with open(names_file, 'r') as f:
+                self.names = json.load(f)
+        else:
+            self.names = ["{}.obj".format(i) for i in range(len(self.frames))]
+        self._name_index = None
+
+    @classmethod
+    def create(cls, seq_path, faces, number_frames, number_vertices, names=None):
+        """
+        新建一个空序列, 之后通过 seq.frames[i] = v 写入每一帧
+        :param seq_path: 序列目录
+        :param faces: 共用的面片 (F, K)
+        :param number_frames: 帧数 T
+        :param number_vertices: 每一帧的顶点数 V
+        :param names: 每一帧的名字 list
+        :return: 可写的 MeshSequence
+        """
+        if not os.path.isdir(seq_path):
+            os.makedirs(seq_path)
+        np.save(os.path.join(seq_path, FACES_FILE), np.asarray(faces, dtype=np.int32))
+        frames = np.lib.format.open_memmap(os.path.join(seq_path, FRAMES_FILE), mode='w+', dtype=np.float32,
+                                           shape=(number_frames, number_vertices, 3))
+        del frames  # 只需要分配文件
+        if names is not None:
+            assert len(names) == number_frames, "names 的长度与帧数不一致"
+            with open(os.path.join(seq_path, NAMES_FILE), 'w') as f:
+                json.dump(list(names), f)
+        return cls(seq_path, mode='r+')
+
+    def __len__(self):
+        return self.frames.shape[0]
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    @property
+    def number_vertices(self):
+        return self.frames.shape[1]
+
+    def index(self, name):
+        """
+        :param name: obj 文件名
+        :return: 该文件在序列中的帧号
+        """
+        if self._name_index is None:
+            self._name_index = {n: i for i, n in enumerate(self.names)}
+        return self._name_index[name]
+
+    def flush(self):
+        if isinstance(self.frames, np.memmap):
+            self.frames.flush()
+
+
+def obj_dir_to_sequence(obj_dir, seq_path, filenames=None):
+    """
+    将一个目录下拓扑相同的 obj 导入为序列
+    先写入 seq_path + ".tmp", 所有帧写完后再改名为 seq_path, 中途出错或中断时不会留下不完整的序列
+    :param obj_dir: obj 所在目录
+    :param seq_path: 要保存的序列目录, 已经存在时被替换
+    :param filenames: 按帧顺序排列的文件名, 默认为目录下所有 obj 按数字排序
+    :return: MeshSequence
+    """
+    if filenames is None:
+        filenames = sorted([n for n in os.listdir(obj_dir) if n.endswith('.obj')], key=natural_sort_key)
+    assert len(filenames) > 0, "{} 中没有obj文件".format(obj_dir)
+    v0, f0 = load_obj_arrays(os.path.join(obj_dir, filenames[0]))
+    tmp_path = seq_path.rstrip('\\/') + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)  # 上一次中断留下的
+    seq = MeshSequence.create(tmp_path, f0, len(filenames), len(v0), filenames)
+    seq.frames[0] = v0
+    for i in range(1, len(filenames)):
+        v, f = load_obj_arrays(os.path.join(obj_dir, filenames[i]))
+        assert v.shape == v0.shape and np.array_equal(f, f0), "{} 与 {} 拓扑不一致".format(filenames[i], filenames[0])
+        seq.frames[i] = v
+        if i % 100 == 0:
+            print("process {}...".format(i))
+    seq.flush()
+    del seq  # 改名之前关闭内存映射 (windows)
+    if os.path.isdir(seq_path):
+        shutil.rmtree(seq_path)
+    os.replace(tmp_path, seq_path)
+    return MeshSequence(seq_path, mode='r+')
+
+
+def sequence_to_obj_dir(seq, obj_dir, frame_index=None, precision=6):
+    """
+    将序列导出为 obj 文件
+    :param seq: MeshSequence 或序列目录
+    :param obj_dir: 导出目录
+    :param frame_index: 要导出的帧号, 默认全部导出
+    :param precision: 顶点坐标保留的小数位数
+    """
+    if not isinstance(seq, MeshSequence):
+        seq = MeshSequence(seq)
+    if not os.path.isdir(obj_dir):
+        os.makedirs(obj_dir)
+    if frame_index is None:
+        frame_index = range(len(seq))
+    for i in frame_index:
+        write_obj_arrays(os.path.join(obj_dir, seq.names[i]), seq[i], seq.faces, precision)
+
+
+def gather_vertices(frames, index, out=None, chunk_size=256):
+    """
+    从每一帧中取出 index 对应的顶点, 例如从头部序列中取出面部
+    :param frames: (T, H, 3) 数组, 可以是内存映射 (MeshSequence.frames)
+    :param index: 要取出的顶点序号 (F,), 从 0 开始
+    :param out: 保存结果的 (T, F, 3) 数组, 默认新建
+    :param chunk_size: 每次读入的帧数, 限制内存映射输入时的内存占用
+    :return: (T, F, 3) 数组
+    """
+    index = np.asarray(index, dtype=np.intp)
+    if out is None:
+        out = np.empty((len(frames), len(index), 3), dtype=frames.dtype)
+    for start in range(0, len(frames), chunk_size):
+        end = min(start + chunk_size, len(frames))
+        out[start:end] = frames[start:end, index]
+    return out
+
+
+def scatter_vertices(frames, template, index, out=None, chunk_size=256):
+    """
+    将每一帧的顶点写入模板中 index 对应的位置, 其余顶点与模板相同, 例如把面部序列换到同一个头上
+    :param frames: (T, F, 3) 数组, 可以是内存映射 (MeshSequence.frames)
+    :param template: 模板顶点 (H, 3)
+    :param index: frames 中每个顶点在模板中的序号 (F,), 从 0 开始
+    :param out: 保存结果的 (T, H, 3) 数组, 默认新建
+    :param chunk_size: 每次处理的帧数
+    :return: (T, H, 3) 数组
+    """
+    index = np.asarray(index, dtype=np.intp)
+    template = np.asarray(template)
+    assert frames.shape[1] == len(index), "帧的顶点数 {} 与 index 长度 {} 不一致".format(frames.shape[1], len(index))
+    if out is None:
+        out = np.empty((len(frames),) + template.shape, dtype=frames.dtype)
+    for start in range(0, len(frames), chunk_size):
+        end = min(start + chunk_size, len(frames))
+        out[start:end] = template
+        out[start:end, index] = frames[start:end]
+    return out
+
+
+def head_sequence_to_face(head_seq, face_index, face_f, face_seq_path):
+    """
+    :param head_seq: 头部 MeshSequence 或序列目录
+    :param face_index: 面部顶点在头部中的序号 (从 0 开始)
+    :param face_f: 面部点序
+    :param face_seq_path: 要保存的面部序列目录
+    :return: 面部 MeshSequence
+    """
+    if not isinstance(head_seq, MeshSequence):
+        head_seq = MeshSequence(head_seq)
+    face_seq = MeshSequence.create(face_seq_path, faces_to_array(face_f), len(head_seq), len(face_index),
+                                   head_seq.names)
+    gather_vertices(head_seq.frames, face_index, out=face_seq.frames)
+    face_seq.flush()
+    return face_seq
+
+
+def face_sequence_to_head(face_seq, head_v, head_f, face_index, head_seq_path):
+    """
+    :param face_seq: 面部 MeshSequence 或序列目录
+    :param head_v: 模板头部顶点
+    :param head_f: 模板头部点序
+    :param face_index: 面部顶点在头部中的序号 (从 0 开始)
+    :param head_seq_path: 要保存的头部序列目录
+    :return: 头部 MeshSequence
+    """
+    if not isinstance(face_seq, MeshSequence):
+        face_seq = MeshSequence(face_seq)
+    head_v = np.asarray(head_v, dtype=np.float32)
+    head_seq = MeshSequence.create(head_seq_path, faces_to_array(head_f), len(face_seq), len(head_v),
+                                   face_seq.names)
+    scatter_vertices(face_seq.frames, head_v, face_index, out=head_seq.frames)
+    head_seq.flush()
+    return head_seq
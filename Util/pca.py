@@ -0,0 +1,210 @@
+import os
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.utils import gen_batches
+from Util.batch import run_batch, report_errors
+from Util.mesh_io import write_obj_arrays
+from Util.mesh_sequence import MeshSequence
+
+"""
+大量帧的 PCA
+数据矩阵 (T, 3V) 直接使用 MeshSequence 的内存映射 (seq.frames.reshape(T, -1)), 不再在循环中 hstack,
+按内存上限分块用 IncrementalPCA 拟合, 系数也分块计算
+保存的均值, 主成分, 系数供 blendshape 和去噪工具使用
+去噪: 只用选定的主成分分块重建 (每块一次矩阵乘法), 直接写入序列或多进程写 obj, 不生成整个重建矩阵
+"""
+
+MEAN_FILE = 'mean.npy'
+COMPONENTS_FILE = 'components.npy'
+VARIANCE_FILE = 'explained_variance.npy'
+VARIANCE_RATIO_FILE = 'explained_variance_ratio.npy'
+COEFFICIENTS_FILE = 'coefficients.npy'
+
+
+class PCAModel(object):
+    """
+    X ≈ coefficients.dot(components) + mean
+    """
+
+    def __init__(self, mean, components, explained_variance, explained_variance_ratio, coefficients=None):
+        """
+        :param mean: 均值 (D,)
+        :param components: 主成分 (K, D), 每行一个
+        :param explained_variance: 每个主成分的方差 (K,)
+        :param explained_variance_ratio: 每个主成分的方差占总方差的比例 (K,)
+        :param coefficients: 训练数据每一帧的系数 (T, K)
+        """
+        self.mean = mean
+        self.components = components
+        self.explained_variance = explained_variance
+        self.explained_variance_ratio = explained_variance_ratio
+        self.coefficients = coefficients
+
+    @property
+    def number_components(self):
+        return len(self.components)
+
+    def transform(self, X, chunk_size=1024):
+        """
+        :param X: (T, D) 数组, 可以是内存映射
+        :return: 系数 (T, K)
+        """
+        coe = np.empty((len(X), self.number_components), dtype=np.float64)
+        for batch in gen_batches(len(X), chunk_size):
+            coe[batch] = (np.asarray(X[batch], dtype=np.float64) - self.mean).dot(self.components.T)
+        return coe
+
+    def inverse_transform(self, coe):
+        """
+        :param coe: 系数 (T, K) 或 (K,)
+        :return: 重建的数据 (T, D) 或 (D,)
+        """
+        return np.dot(coe, self.components) + self.mean
+
+    def save(self, model_path):
+        """
+        :param model_path: 保存的目录
+        """
+        if not os.path.isdir(model_path):
+            os.makedirs(model_path)
+        np.save(os.path.join(model_path, MEAN_FILE), self.mean)
+        np.save(os.path.join(model_path, COMPONENTS_FILE), self.components)
+        np.save(os.path.join(model_path, VARIANCE_FILE), self.explained_variance)
+        np.save(os.path.join(model_path, VARIANCE_RATIO_FILE), self.explained_variance_ratio)
+        if self.coefficients is not None:
+            np.save(os.path.join(model_path, COEFFICIENTS_FILE), self.coefficients)
+        print("saved pca model to {}".format(model_path))
+
+    @classmethod
+    def load(cls, model_path, mmap_mode=None):
+        """
+        :param model_path: save 保存的目录
+        :param mmap_mode: 主成分和系数的内存映射方式, 例如 'r'
+        :return: PCAModel
+        """
+        coefficients = None
+        if os.path.exists(os.path.join(model_path, COEFFICIENTS_FILE)):
+            coefficients = np.load(os.path.join(model_path, COEFFICIENTS_FILE), mmap_mode=mmap_mode)
+        return cls(np.load(os.path.join(model_path, MEAN_FILE)),
+                   np.load(os.path.join(model_path, COMPONENTS_FILE), mmap_mode=mmap_mode),
+                   np.load(os.path.join(model_path, VARIANCE_FILE)),
+                   np.load(os.path.join(model_path, VARIANCE_RATIO_FILE)),
+                   coefficients)
+
+
+def fit_pca(X, n_components, max_bytes=1024 ** 3, max_components=256):
+    """
+    分块拟合 PCA, 内存占用与帧数无关
+    :param X: (T, D) 数组, 可以是内存映射, 例如 MeshSequence(seq_path).frames.reshape(len(seq), -1)
+    :param n_components: 主成分个数; 小于 1 的小数表示保留的方差比例 (与 sklearn.PCA 一致)
+    :param max_bytes: 每次拟合的数据块大约占用的内存 字节
+    :param max_components: n_components 为方差比例时最多拟合的主成分个数
+    :return: 带训练数据系数的 PCAModel
+    """
+    number_frames, dim = X.shape
+    if isinstance(n_components, float) and n_components < 1:
+        k = min(max_components, number_frames, dim)
+    else:
+        k = int(n_components)
+    assert k <= min(number_frames, dim), "主成分个数 {} 超过了数据的维度 {}".format(k, (number_frames, dim))
+    # 每块除了数据本身, IncrementalPCA 还要对 (k + 块大小, D) 的矩阵做 SVD, 约为 3 份拷贝
+    batch_size = max(k, int(max_bytes // (dim * 8 * 3)) - k)
+    ipca = IncrementalPCA(n_components=k)
+    for batch in gen_batches(number_frames, batch_size, min_batch_size=k):
+        ipca.partial_fit(np.asarray(X[batch], dtype=np.float64))
+        print("fit frames {}-{}...".format(batch.start, batch.stop))
+    ratio = ipca.explained_variance_ratio_
+    if k != n_components:
+        k = min(int(np.searchsorted(np.cumsum(ratio), n_components)) + 1, k)
+    model = PCAModel(ipca.mean_, ipca.components_[:k], ipca.explained_variance_[:k], ratio[:k])
+    model.coefficients = model.transform(X, chunk_size=batch_size)
+    return model
+
+
+def select_components(model, keep=None, drop=None, energy=None):
+    """
+    选择重建时使用的主成分
+    :param model: PCAModel
+    :param keep: 保留的主成分序号, 默认全部
+    :param drop: 去掉的主成分序号, 例如 [0] 去掉方差最大的 (通常是整体的抖动)
+    :param energy: 只保留方差比例累计达到 energy 的前几个主成分, 例如 0.999
+    :return: 主成分序号数组 (从小到大)
+    """
+    index = np.arange(model.number_components)
+    if energy is not None:
+        n = int(np.searchsorted(np.cumsum(model.explained_variance_ratio), energy)) + 1
+        index = index[:n]
+    if keep is not None:
+        index = np.intersect1d(index, keep)
+    if drop is not None:
+        index = np.setdiff1d(index, drop)
+    return index
+
+
+def _reconstruct(coe, components, mean, out=None):
+    out = np.dot(coe, components, out=out)
+    out += mean
+    return out
+
+
+def reconstruct_to_sequence(model, index, faces, seq_path, names=None, coefficients=None, chunk_size=256):
+    """
+    用选定的主成分重建每一帧并写入序列
+    :param model: PCAModel
+    :param index: 使用的主成分序号, 见 select_components
+    :param faces: 序列共用的面片
+    :param seq_path: 要保存的序列目录
+    :param names: 每一帧的文件名, 默认 {i}.obj
+    :param coefficients: 每一帧的系数 (T, K), 默认为训练数据的系数 model.coefficients
+    :param chunk_size: 每次重建的帧数
+    :return: MeshSequence
+    """
+    if coefficients is None:
+        coefficients = model.coefficients
+    components = np.asarray(model.components[index], dtype=np.float32)
+    mean = model.mean.astype(np.float32)
+    seq = MeshSequence.create(seq_path, faces, len(coefficients), len(mean) // 3, names)
+    frames = seq.frames.reshape([len(seq), -1])
+    buf = np.empty((chunk_size, len(mean)), dtype=np.float32)
+    for batch in gen_batches(len(coefficients), chunk_size):
+        n = batch.stop - batch.start
+        coe = np.asarray(coefficients[batch][:, index], dtype=np.float32)
+        frames[batch] = _reconstruct(coe, components, mean, out=buf[:n])
+    seq.flush()
+    return seq
+
+
+def _write_reconstructed(components, mean, faces, precision, coe, obj_paths):
+    v = _reconstruct(coe, components, mean).reshape([len(coe), -1, 3])
+    for i, path in enumerate(obj_paths):
+        write_obj_arrays(path, v[i], faces, precision=precision)
+
+
+def reconstruct_to_obj_dir(model, index, faces, obj_dir, names=None, coefficients=None, chunk_size=64,
+                           workers=None, precision=6):
+    """
+    用选定的主成分重建每一帧并写为 obj, 每个进程重建并写出一块帧
+    :param model: PCAModel
+    :param index: 使用的主成分序号, 见 select_components
+    :param faces: 共用的面片
+    :param obj_dir: 导出目录
+    :param names: 每一帧的文件名, 默认 {i}.obj
+    :param coefficients: 每一帧的系数 (T, K), 默认为训练数据的系数 model.coefficients
+    :param chunk_size: 每个任务的帧数
+    :param workers: 进程数, None 为 cpu 核数
+    :param precision: 顶点坐标保留的小数位数
+    """
+    if coefficients is None:
+        coefficients = model.coefficients
+    if names is None:
+        names = ["{}.obj".format(i) for i in range(len(coefficients))]
+    if not os.path.isdir(obj_dir):
+        os.makedirs(obj_dir)
+    components = np.asarray(model.components[index], dtype=np.float64)
+    tasks = []
+    for batch in gen_batches(len(coefficients), chunk_size):
+        tasks.append((np.asarray(coefficients[batch][:, index], dtype=np.float64),
+                      [os.path.join(obj_dir, name) for name in names[batch]]))
+    _, errors = run_batch(_write_reconstructed, tasks, workers, chunksize=1,
+                          shared_args=(components, model.mean, np.asarray(faces), precision))
+    report_errors(errors, ["{}-{}".format(task[1][0], task[1][-1]) for task in tasks])
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+"""
+带缓存, 可以断点续跑的流水线 (有向无环图)
+每个 stage 声明输入和输出路径 (文件或目录), 依赖关系由路径推出: 一个 stage 的输入与另一个 stage 的输出相同或互相包含时依赖它
+每个 stage 的 key 由函数, 参数和输入的内容 (文件的 sha1, 按文件大小和修改时间缓存) 计算,
+与上次成功运行时相同并且输出都存在时跳过; 没有依赖关系的 stage (例如演员和角色的处理) 多线程同时运行
+最后打印每个 stage 的耗时
+"""
+
+CACHE_FILE = ".pipeline_cache.json"
+
+
+def _is_under(path, parent):
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+
+class Stage(object):
+
+    def __init__(self, name, func, args=(), kwargs=None, inputs=(), outputs=()):
+        """
+        :param name: stage 的名字, 在一个 Pipeline 中唯一
+        :param func: 要执行的函数 func(*args, **kwargs)
+        :param inputs: 输入的文件或目录
+        :param outputs: 输出的文件或目录, 没有扩展名的视为目录, 运行前自动创建
+        """
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.inputs = [os.path.abspath(path) for path in inputs]
+        self.outputs = [os.path.abspath(path) for path in outputs]
+
+
+class Pipeline(object):
+
+    def __init__(self, root, workers=2):
+        """
+        :param root: 缓存文件 .pipeline_cache.json 所在目录
+        :param workers: 同时运行的 stage 个数
+        """
+        self.root = root
+        self.workers = workers
+        self.stages = OrderedDict()
+        self.cache_path = os.path.join(root, CACHE_FILE)
+        self.cache = {"stages": {}, "files": {}}
+        if os.path.isfile(self.cache_path):
+            with open(self.cache_path, 'r') as f:
+                self.cache = json.load(f)
+        self.timing = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, args=(), kwargs=None, inputs=(), outputs=()):
+        assert name not in self.stages, "stage {} 重复".format(name)
+        self.stages[name] = Stage(name, func, args, kwargs, inputs, outputs)
+        return self.stages[name]
+
+    def dependencies(self, name):
+        """
+        :return: stage name 依赖的 stage 名字 list
+        """
+        stage = self.stages[name]
+        deps = []
+        for other in self.stages.values():
+            if other is stage:
+                continue
+            if any(_is_under(i, o) or _is_under(o, i) for i in stage.inputs for o in other.outputs):
+                deps.append(other.name)
+        return deps
+
+    def _file_hash(self, path):
+        st = os.stat(path)
+        with self._lock:
+            cached = self.cache["files"].get(path)
+        if cached is not None and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        with self._lock:
+            self.cache["files"][path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def _path_hash(self, path):
+        if os.path.isfile(path):
+            return self._file_hash(path)
+        if not os.path.isdir(path):
+            return "missing"
+        h = hashlib.sha1()
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if file_name == CACHE_FILE:
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                h.update(os.path.relpath(file_path, path).encode('utf-8'))
+                h.update(self._file_hash(file_path).encode())
+        return h.hexdigest()
+
+    def _stage_key(self, stage):
+        h = hashlib.sha1()
+        h.update("{}.{}".format(stage.func.__module__, stage.func.__name__).encode('utf-8'))
+        h.update(repr(stage.args).encode('utf-8'))
+        h.update(repr(sorted(stage.kwargs.items())).encode('utf-8'))
+        for path in stage.inputs:
+            h.update(path.encode('utf-8'))
+            h.update(self._path_hash(path).encode())
+        return h.hexdigest()
+
+    def _save_cache(self):
+        with self._lock:
+            tmp = self.cache_path + ".tmp"
+            with open(tmp, 'w') as f:
+                json.dump(self.cache, f)
+            os.replace(tmp, self.cache_path)
+
+    def _run_stage(self, stage, force):
+        key = self._stage_key(stage)
+        with self._lock:
+            cached_key = self.cache["stages"].get(stage.name)
+        if not force and cached_key == key and all(os.path.exists(path) for path in stage.outputs):
+            print("skip stage {}".format(stage.name))
+            return "skip", 0.0, None
+        # 运行前先删除缓存的 key, 中途失败时输出可能不完整, 下次不能跳过; 成功后才写入新的 key
+        with self._lock:
+            removed = self.cache["stages"].pop(stage.name, None)
+        if removed is not None:
+            self._save_cache()
+        for path in stage.outputs:
+            if not os.path.splitext(path)[1] and not os.path.isdir(path):
+                os.makedirs(path)
+        print("run stage {}...".format(stage.name))
+        start = time.time()
+        result = stage.func(*stage.args, **stage.kwargs)
+        elapsed = time.time() - start
+        with self._lock:
+            self.cache["stages"][stage.name] = key
+        self._save_cache()
+        return "run", elapsed, result
+
+    def run(self, targets=None, force=False, raise_on_failure=False):
+        """
+        :param targets: 要得到的 stage 名字 list, 同时运行它们依赖的 stage, 默认全部
+        :param force: 忽略缓存全部重新运行
+        :param raise_on_failure: 有 stage 失败或没有运行时抛出 RuntimeError, 否则只打印
+        :return: {stage 名字: 返回值}, 跳过和失败的 stage 没有返回值
+        """
+        deps = {name: self.dependencies(name) for name in self.stages}
+        todo = set()
+        pending = list(self.stages) if targets is None else list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in todo:
+                todo.add(name)
+                pending.extend(deps[name])
+        results = {}
+        done = set()
+        failed = set()
+        self.timing = OrderedDict()
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor:
+            running = {}
+            while todo or running:
+                for name in [n for n in self.stages if n in todo]:
+                    if any(d in failed for d in deps[name]):
+                        print("stage {} 的依赖失败, 不运行".format(name))
+                        todo.discard(name)
+                        failed.add(name)
+                        self.timing[name] = ("not run", 0.0)
+                    elif all(d in done for d in deps[name]):
+                        todo.discard(name)
+                        running[executor.submit(self._run_stage, self.stages[name], force)] = name
+                if not running:
+                    for name in todo:
+                        print("stage {} 的依赖存在环, 不运行".format(name))
+                        self.timing[name] = ("not run", 0.0)
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        status, elapsed, result = future.result()
+                        results[name] = result
+                        done.add(name)
+                    except Exception:
+                        print("stage {} 失败:\n{}".format(name, traceback.format_exc()))
+                        status, elapsed = "failed", 0.0
+                        failed.add(name)
+                    self.timing[name] = (status, elapsed)
+        self.report()
+        not_finished = [name for name, (status, _) in self.timing.items() if status in ("failed", "not run")]
+        if raise_on_failure and not_finished:
+            raise RuntimeError("pipeline 的 stage 失败或没有运行: {}".format(", ".join(not_finished)))
+        return results
+
+    def report(self):
+        """
+        打印上一次 run 每个 stage 的状态和耗时
+        """
+        total = sum(elapsed for _, elapsed in self.timing.values())
+        for name, (status, elapsed) in sorted(self.timing.items(), key=lambda item: -item[1][1]):
+            print("{:<32} {:<8} {:8.2f}s".format(name, status, elapsed))
+        print("{:<32} {:<8} {:8.2f}s".format("total (stage 耗时之和)", "", total))
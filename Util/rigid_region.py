@@ -0,0 +1,124 @@
+import numpy as np
+from Util.align_trajectory import align_sim3_batch
+from Util.mesh_sequence import MeshSequence
+
+"""
+自动选择稳定人脸用的刚体区域 (代替手工挑选的对齐点, 例如 [16438, 2977, 984, 14115, 14916, 5011])
+迭代: 用当前的锚点 (第一次为所有顶点) 把每一帧 sim3 对齐到参考形状, 流式 (Welford) 统计对齐后每个顶点位置的方差,
+方差最小的顶点就是非刚体运动最少的区域 (额头, 鼻梁, 耳朵等), 作为下一次的锚点, 参考形状更新为平均形状
+序列只按块读取, 内存占用与帧数无关; 结果 (锚点, 权重) 直接传给 AlignFramesWithFixedPoints / BatchAlignFacewithFixedPoints
+"""
+
+
+class WelfordAccumulator(object):
+    """
+    流式统计均值和方差 (Welford, 按块合并用 Chan 的公式), 每次加入一块样本 (n, ...)
+    """
+
+    def __init__(self, shape):
+        """
+        :param shape: 每个样本的形状, 例如 (V, 3)
+        """
+        self.count = 0
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+
+    def update(self, samples):
+        """
+        :param samples: 一块样本 (n,) + shape
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        n = len(samples)
+        if n == 0:
+            return
+        batch_mean = samples.mean(axis=0)
+        batch_m2 = ((samples - batch_mean) ** 2).sum(axis=0)
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.mean += delta * (float(n) / total)
+        self.m2 += batch_m2 + delta ** 2 * (float(self.count) * n / total)
+        self.count = total
+
+    @property
+    def variance(self):
+        """
+        :return: 总体方差, 与 np.var(samples, axis=0) 一致
+        """
+        return self.m2 / max(self.count, 1)
+
+
+def _spread_select(points, order, number, min_distance):
+    """
+    按 order 的顺序贪心选择 number 个点, 与已选点的距离都不小于 min_distance, 避免锚点挤在一起使旋转不稳定
+    """
+    chosen = []
+    for i in order:
+        if min_distance and chosen and np.min(np.linalg.norm(points[chosen] - points[i], axis=1)) < min_distance:
+            continue
+        chosen.append(i)
+        if len(chosen) == number:
+            break
+    return np.array(chosen, dtype=np.int64)
+
+
+def rigid_vertex_variance(frames, reference, anchors=None, weights=None, chunk_size=256):
+    """
+    把每一帧按锚点 sim3 对齐到参考形状后, 流式统计每个顶点的方差
+    :param frames: (T, V, 3) 数组, 可以是内存映射 (MeshSequence.frames)
+    :param reference: 参考形状 (V, 3)
+    :param anchors: 对齐使用的顶点序号, 默认所有顶点
+    :param weights: 锚点的权重, 默认相同
+    :param chunk_size: 每次读入的帧数
+    :return: 每个顶点对齐后位置的方差 (V,) (三个坐标的方差之和), 对齐后的平均形状 (V, 3)
+    """
+    reference = np.asarray(reference, dtype=np.float64)
+    if anchors is None:
+        anchors = np.arange(len(reference))
+    anchors = np.asarray(anchors, dtype=np.intp)
+    model = reference[anchors].T  # 3 x k
+    accumulator = WelfordAccumulator(reference.shape)
+    for start in range(0, len(frames), chunk_size):
+        chunk = np.asarray(frames[start:start + chunk_size], dtype=np.float64)
+        data = chunk[:, anchors, :].transpose(0, 2, 1)  # c x 3 x k
+        s, R, t, _ = align_sim3_batch(np.broadcast_to(model, data.shape), data, weights)
+        aligned = s[:, np.newaxis, np.newaxis] * np.matmul(chunk, R.transpose(0, 2, 1)) + t.transpose(0, 2, 1)
+        accumulator.update(aligned)
+    return accumulator.variance.sum(axis=1), accumulator.mean
+
+
+def select_rigid_anchors(frames, number_anchors=64, iterations=3, reference=None, candidates=None, min_distance=None,
+                         chunk_size=256):
+    """
+    找到整个序列中非刚体运动最少的顶点作为稳定人脸的锚点
+    :param frames: MeshSequence, 序列目录或 (T, V, 3) 数组
+    :param number_anchors: 锚点个数
+    :param iterations: 对齐 - 统计方差 - 选择锚点 的迭代次数
+    :param reference: 初始参考形状 (V, 3), 默认第一帧
+    :param candidates: 可以作为锚点的顶点序号, 例如只在面部区域中选择, 默认所有顶点
+    :param min_distance: 锚点之间的最小距离, 默认为参考形状包围盒对角线的 2%
+    :param chunk_size: 每次读入的帧数
+    :return: 锚点序号 (number_anchors,) 从 0 开始, 锚点权重 (与方差成反比, 平均为 1), 每个顶点的方差 (V,)
+    """
+    if isinstance(frames, str):
+        frames = MeshSequence(frames)
+    if isinstance(frames, MeshSequence):
+        frames = frames.frames
+    reference = np.asarray(frames[0] if reference is None else reference, dtype=np.float64)
+    candidates = np.arange(len(reference)) if candidates is None else np.asarray(candidates, dtype=np.int64)
+    assert number_anchors >= 3, "至少需要 3 个锚点"
+    if min_distance is None:
+        min_distance = 0.02 * np.linalg.norm(reference.max(axis=0) - reference.min(axis=0))
+    anchors, weights = None, None
+    for i in range(iterations):
+        variance, reference = rigid_vertex_variance(frames, reference, anchors, weights, chunk_size)
+        order = candidates[np.argsort(variance[candidates], kind='stable')]
+        anchors = _spread_select(reference, order, number_anchors, min_distance)
+        if len(anchors) < number_anchors:
+            anchors = order[:number_anchors]  # 候选区域太小, 放弃间距限制
+        # 逆方差权重, 以锚点方差的中位数为下限, 避免几乎不动的点独占权重
+        anchor_variance = variance[anchors]
+        weights = 1.0 / (anchor_variance + np.median(anchor_variance) + 1e-12)
+        weights /= weights.mean()
+        print("iteration {}: anchor variance {} (mean of all vertices {})".format(i, anchor_variance.mean(),
+                                                                                variance.mean()))
+    return anchors, weights, variance
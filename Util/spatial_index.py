@@ -0,0 +1,93 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from scipy.spatial import cKDTree
+
+"""
+顶点的最近邻查询
+每个顶点数组只建一次 KD 树, 按数组内容的指纹缓存, 同一个模型反复查询 (例如 make_Face_Marker, BlendShapeTransferStep1)
+不再重复建树, 查询一次完成所有点
+"""
+
+_MAX_TREES = 8  # 缓存的 KD 树个数
+_tree_cache = OrderedDict()
+
+
+def array_fingerprint(points):
+    """
+    :param points: 顶点 (n, 3) 数组或 list
+    :return: 由形状和内容计算的指纹字符串
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    h = hashlib.sha1(str(points.shape).encode())
+    h.update(points.data)
+    return h.hexdigest()
+
+
+def get_kdtree(points):
+    """
+    :param points: 顶点 (n, 3) 数组或 list
+    :return: 该顶点数组的 cKDTree, 内容相同的数组共用一棵树
+    """
+    points = np.ascontiguousarray(points, dtype=np.float64)
+    key = array_fingerprint(points)
+    tree = _tree_cache.get(key)
+    if tree is None:
+        tree = cKDTree(points)
+        _tree_cache[key] = tree
+        while len(_tree_cache) > _MAX_TREES:
+            _tree_cache.popitem(last=False)
+    else:
+        _tree_cache.move_to_end(key)
+    return tree
+
+
+def clear_kdtree_cache():
+    _tree_cache.clear()
+
+
+def nearest_vertices(points, queries, k=1, max_distance=None, matlab=False, return_distance=False):
+    """
+    对每个查询点找到 points 中最近的 k 个顶点
+    :param points: 顶点 (n, 3) 数组或 list
+    :param queries: 查询点 (m, 3) 数组或 list
+    :param k: 最近邻的个数
+    :param max_distance: 距离阈值, 超过阈值的结果索引为 -1, 距离为 inf
+    :param matlab: 索引是否为matlab格式 (从 1 开始), 找不到时仍为 -1
+    :param return_distance: 是否同时返回距离
+    :return: 索引 (m,) (k 为 1 时) 或 (m, k), return_distance 为 True 时返回 (索引, 距离)
+    """
+    tree = get_kdtree(points)
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, tree.m)
+    upper = np.inf if max_distance is None else max_distance
+    distance, index = tree.query(queries, k=k, distance_upper_bound=upper)
+    missing = index >= tree.n
+    index = index.astype(np.int64)
+    if matlab:
+        index += 1
+    index[missing] = -1
+    if return_distance:
+        return index, distance
+    return index
+
+
+def match_vertices(points, queries, tolerance):
+    """
+    为每个查询点找到 points 中坐标相同 (距离不超过 tolerance) 的顶点
+    :param points: 顶点 (n, 3) 数组或 list
+    :param queries: 查询点 (m, 3) 数组或 list
+    :param tolerance: 距离容差
+    :return: 索引 (m,) 找不到时为 -1, 多个顶点在容差内时取序号最小的一个;
+             没有匹配的查询点序号, 有多个匹配的查询点序号
+    """
+    tree = get_kdtree(points)
+    queries = np.asarray(queries, dtype=np.float64).reshape(-1, tree.m)
+    radius = np.nextafter(tolerance, np.inf)  # 包含距离正好等于容差的点
+    _, nearest = tree.query(queries, k=2, distance_upper_bound=radius)
+    index = nearest[:, 0].astype(np.int64)
+    unmatched = np.flatnonzero(index >= tree.n)
+    ambiguous = np.flatnonzero(nearest[:, 1] < tree.n)
+    index[unmatched] = -1
+    for i in ambiguous:
+        index[i] = min(tree.query_ball_point(queries[i], radius))
+    return index, unmatched, ambiguous
@@ -0,0 +1,52 @@
+import numpy as np
+from Util.mesh_io import faces_to_array
+
+"""
+面片拓扑的转换
+任意边数的面按扇形三角化: (f0, f1, f2) (f0, f2, f3) ... 四边形 1 2 3 4 得到 (1,2,3)(1,3,4)
+同时给出每个三角形来自哪个原始面 (tri_to_face), 三角面顺序任意打乱后仍可以据此还原原始面片
+"""
+
+
+def triangulate_faces(faces):
+    """
+    :param faces: 面片 list 或 (F, K) 数组, 从 1 开始, 可以是三角形 四边形 多边形混合 (用 0 补齐)
+    :return: 三角面 (M, 3) int32 从 1 开始, tri_to_face (M,) 每个三角面对应的原始面序号 (从 0 开始)
+    """
+    faces = faces_to_array(faces)
+    counts = (faces > 0).sum(axis=1)
+    assert (counts >= 3).all(), "存在少于 3 个点的面"
+    K = faces.shape[1]
+    j = np.arange(1, K - 1)
+    # (F, K-2, 3): 第 j 个扇形三角形为 (f0, fj, fj+1), 只保留 j + 1 < 边数 的三角形
+    tris = np.stack((np.broadcast_to(faces[:, :1], (len(faces), K - 2)), faces[:, 1:K - 1], faces[:, 2:K]), axis=2)
+    valid = j + 1 < counts[:, np.newaxis]
+    tri_to_face = np.broadcast_to(np.arange(len(faces))[:, np.newaxis], valid.shape)[valid]
+    return tris[valid].astype(np.int32), tri_to_face.astype(np.int64)
+
+
+def restore_faces(tri_faces, tri_to_face, number_faces=None):
+    """
+    triangulate_faces 的逆变换, 三角面的顺序可以与 triangulate_faces 的输出不同, 同一个面的三角形保持扇形顺序即可
+    :param tri_faces: 三角面 (M, 3) 数组或 list, 从 1 开始
+    :param tri_to_face: 每个三角面对应的原始面序号 (M,)
+    :param number_faces: 原始面的个数, 默认为 tri_to_face 的最大值 + 1
+    :return: 原始面片 (F, K) int32, 从 1 开始, 边数不足 K 的面用 0 补齐
+    """
+    tri_faces = np.asarray(tri_faces, dtype=np.int32).reshape(-1, 3)
+    tri_to_face = np.asarray(tri_to_face, dtype=np.int64)
+    assert len(tri_faces) == len(tri_to_face), "三角面个数 {} 与还原表长度 {} 不一致".format(len(tri_faces), len(tri_to_face))
+    if number_faces is None:
+        number_faces = int(tri_to_face.max()) + 1 if len(tri_to_face) else 0
+    order = np.argsort(tri_to_face, kind='stable')  # 同一个面的三角形放在一起, 保持原来的先后顺序
+    tris = tri_faces[order]
+    face = tri_to_face[order]
+    tri_counts = np.bincount(face, minlength=number_faces)
+    first_tri = np.zeros(number_faces + 1, dtype=np.int64)
+    np.cumsum(tri_counts, out=first_tri[1:])
+    rank = np.arange(len(face)) - first_tri[face]  # 三角形在所属面中的序号
+    first = rank == 0
+    out = np.zeros((number_faces, int(tri_counts.max()) + 2 if len(face) else 3), dtype=np.int32)
+    out[face[first], 0:3] = tris[first]
+    out[face[~first], rank[~first] + 2] = tris[~first, 2]
+    return out
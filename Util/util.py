@@ -4,7 +4,18 @@ import pickle
 import json
 import scipy.io as io
 import numpy as np
-from Util.align_trajectory import align_sim3, my_align_sim3
+from Util.align_trajectory import align_sim3, align_sim3_batch, refine_sim3, refine_sim3_batch, ransac_sim3, \
+    ransac_sim3_batch
+from Util.batch import run_batch, report_errors
+from Util.mesh_io import load_obj_arrays, faces_to_list, faces_to_array, write_obj_arrays, enable_mesh_cache, disable_mesh_cache
+from Util.vtk_mesh import face_polydata, edge_polydata, set_mapper_vertices
+from Util.spatial_index import nearest_vertices, match_vertices
+from Util.topology import triangulate_faces, restore_faces
+from Util.filters import OneEuroFilter
+from Util.deformation_transfer import DeformationTransfer, triangle_correspondence
+from Util.pipeline import Pipeline
+from Util.mesh_sequence import natural_sort_key
+from Util.icp import ICP
 from scipy import optimize
 from scipy.optimize import least_squares
 from math import atan2
@@ -48,24 +59,20 @@ def load_pts(path):
     return data
 
 
+_anti_shake_filter = OneEuroFilter(freq=10, mincutoff=10, beta=0.05)
+
+
 def Anti_shake_single(index, coord):
-    global tmp_coord
-    MPT = 3.14159265358979323846
-    MINCUTOFF = 10
-    BETA = 0.05
-    FREQUENCY = 10
+    """
+    对单个序列逐帧去抖动, index 为 0 时重新开始
+    多个序列同时滤波时, 每个序列使用自己的 Util.filters.OneEuroFilter
+    :param index: 帧号
+    :param coord: 当前帧的坐标数组
+    :return: 滤波后的坐标
+    """
     if index == 0:
-        tmp_coord = coord
-    else:
-        tmp2_coord = []
-        for indx in range(0, coord.shape[0]):
-            dcutoff_x = MINCUTOFF + BETA*abs(coord[indx] - tmp_coord[indx])
-            tao_x = 1./(2*MPT*dcutoff_x)
-            alpha_x = 1./(1+tao_x*FREQUENCY)
-            new_coord_x = alpha_x*coord[indx]+(1-alpha_x)*tmp_coord[indx]
-            tmp2_coord.append(new_coord_x)
-        tmp_coord = tmp2_coord
-    return tmp_coord
+        _anti_shake_filter.reset()
+    return _anti_shake_filter(coord)
 
 
 def save_pickle_file(filename, file):
@@ -84,74 +91,23 @@ def load_pickle_file(filename):
 
 
 def GetTriangleMapper(vertexs, faces):
-    points = vtk.vtkPoints()
-    for v in vertexs:
-        points.InsertNextPoint(v)
-    lines = vtk.vtkCellArray()
-    line = vtk.vtkLine()
-    for f in faces:
-        if len(f) == 4:
-            line.GetPointIds().SetId(0, f[0] - 1)
-            line.GetPointIds().SetId(1, f[1] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[1] - 1)
-            line.GetPointIds().SetId(1, f[2] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[2] - 1)
-            line.GetPointIds().SetId(1, f[3] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[3] - 1)
-            line.GetPointIds().SetId(1, f[1] - 1)
-            lines.InsertNextCell(line)
-        else:
-            if len(f) == 3:
-                line.GetPointIds().SetId(0, f[0] - 1)
-                line.GetPointIds().SetId(1, f[1] - 1)
-                lines.InsertNextCell(line)
-                line.GetPointIds().SetId(0, f[1] - 1)
-                line.GetPointIds().SetId(1, f[2] - 1)
-                lines.InsertNextCell(line)
-                line.GetPointIds().SetId(0, f[2] - 1)
-                line.GetPointIds().SetId(1, f[0] - 1)
-                lines.InsertNextCell(line)
-
-    linesPolyData = vtk.vtkPolyData()
-    linesPolyData.SetPoints(points)
-    linesPolyData.SetLines(lines)
+    """
+    网格线的 mapper, 相邻面片共用的边只画一次
+    :param vertexs: obj 顶点
+    :param faces: 点序
+    :return: 传给actor使用的mapper, 之后的帧用 set_mapper_vertices 更新顶点
+    """
     mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputData(linesPolyData)
+    mapper.SetInputData(edge_polydata(vertexs, faces))
     return mapper
 
 def GetFaceMapper(vertexs, faces):
     """
     :param vertexs: obj 顶点
     :param faces: 点序
-    :return: 传给actor使用的mapper
-    """
-    # Setup four points
-    points = vtk.vtkPoints()
-    for v in vertexs:
-        points.InsertNextPoint(v[0], v[1], v[2])  # 设置顶点
-
-    # Create the polygon
-    polygon = vtk.vtkPolygon()
-    polygon.GetPointIds().SetNumberOfIds(4)
-    polygons = vtk.vtkCellArray()  # 设置单元 设置拓扑结构
-    for i, f in enumerate(faces):
-        if len(f) == 4:
-            polygon.GetPointIds().SetId(0, f[0] - 1)
-            polygon.GetPointIds().SetId(1, f[1] - 1)
-            polygon.GetPointIds().SetId(2, f[2] - 1)
-            polygon.GetPointIds().SetId(3, f[3] - 1)
-        if len(f) == 3:
-            polygon.GetPointIds().SetId(0, f[0] - 1)
-            polygon.GetPointIds().SetId(1, f[1] - 1)
-            polygon.GetPointIds().SetId(2, f[2] - 1)
-        polygons.InsertNextCell(polygon)
-
-    polygonPolyData = vtk.vtkPolyData()
-    polygonPolyData.SetPoints(points)
-    polygonPolyData.SetPolys(polygons)
+    :return: 传给actor使用的mapper, 之后的帧用 set_mapper_vertices 更新顶点
+    """
+    polygonPolyData = face_polydata(vertexs, faces)
 
     mapper = vtk.vtkPolyDataMapper()
     if vtk.VTK_MAJOR_VERSION <= 5:
@@ -165,147 +121,131 @@ def loadObj(path):
     """Load obj file
     读取三角形和四边形的mesh
     返回vertex和face的list
+    解析由 load_obj_arrays 完成, 需要 numpy 数组时直接使用 load_obj_arrays
     """
     if path.endswith('.obj'):
-        f = open(path, 'r')
-        lines = f.readlines()
-        vertics = []
-        faces = []
-        vts = []
-        for line in lines:
-            if line.startswith('v') and not line.startswith('vt') and not line.startswith('vn'):
-                line_split = line.split()
-                ver = line_split[1:4]
-                ver = [float(v) for v in ver]
-                vertics.append(ver)
-            else:
-                if line.startswith('f'):
-                    line_split = line.split()
-                    if '/' in line:  # 根据需要这里补充obj的其他格式解析
-                        tmp_faces = line_split[1:]
-                        f = []
-                        for tmp_face in tmp_faces:
-                            f.append(int(tmp_face.split('/')[0]))
-                        faces.append(f)
-                    else:
-                        face = line_split[1:]
-                        face = [int(fa) for fa in face]
-                        faces.append(face)
-
-        return (vertics, faces)
+        vertics, faces = load_obj_arrays(path, dtype=np.float64)
+        return (vertics.tolist(), faces_to_list(faces))
 
     else:
         print('格式不正确，请检查obj格式')
         return
 
 
-def writeObj(file_name_path, vertexs, faces, vts=None):
+def writeObj(file_name_path, vertexs, faces, vts=None, face_uvs=None, precision=None, verbose=True):
     """write the obj file to the specific path
        file_name_path:保存的文件路径
-       vertexs:顶点数组 list
-       faces: 面 list
-    """
-    with open(file_name_path, 'w') as f:
-        for v in vertexs:
-            # print(v)
-            f.write("v {} {} {}\n".format(v[0], v[1], v[2]))
-        for face in faces:
-            if len(face) == 4:
-                f.write("f {} {} {} {}\n".format(face[0], face[1], face[2], face[3])) # 保存四个顶点
-            if len(face) == 3:
-                f.write("f {} {} {}\n".format(face[0], face[1], face[2]))  # 保存三个顶点
-        if vts != None:
-            for vt in vts:
-                f.write("vt {} {}\n".format(vt[0], vt[1]))
-        print("saved mesh to {}".format(file_name_path))
+       vertexs:顶点数组 list 或 numpy 数组
+       faces: 面 list 或 numpy 数组
+       vts: 纹理坐标, 写在面片之前, 面片写成 f v/vt
+       face_uvs: 面片对应的纹理坐标索引, 纹理坐标与顶点一一对应时可以不给
+       precision: 坐标保留的小数位数, None 时保留全部精度
+       verbose: 是否打印保存信息, 批量保存时关闭
+    """
+    if isinstance(faces, list):  # 跳过 Quad2Tri 追加在末尾的三角面 list
+        faces = [face for face in faces if len(face) and not isinstance(face[0], list)]
+    write_obj_arrays(file_name_path, vertexs, faces, vts, face_uvs, precision, verbose)
 
 
 def Quad2Tri(qv, qf):# 将四边形mesh 转化为 三角形mesh
     """
     :param qv: 四边形面的顶点
-    :param qf: 四边形面的点序
-    :return: 三角形顶点和面片点序以及还原点
-    原理是在点序的后面追加点
-    点序的分割按照 1 2 3 4---->(1,2,3)(2,3,4)这种方式分割 顶点不变
-    """
-    trif = []
-    self_trif = []
-    for face in qf:
-        if len(face) == 4:
-            f0 = [face[0], face[1], face[2]]
-            trif.append(f0)
-            f1 = [face[0], face[2], face[3]]
-            trif.append(f1)
-        else:
-            self_trif.append(face)
-    index = len(trif)
-    tv = qv
-    trif.append(self_trif)
-    return tv, trif, index
+    :param qf: 四边形面的点序 (三角形, 四边形, 多边形可以混合)
+    :return: 三角形顶点和面片点序以及还原表
+    每个面按扇形分割 1 2 3 4---->(1,2,3)(1,3,4) 顶点不变, 原来的三角形不变
+    还原表为每个三角面对应的原始面序号, 见 Util.topology
+    """
+    tf, index = triangulate_faces(qf)
+    return qv, tf.tolist(), index
+
+
+def _tri2quad_faces(tf, index):
+    """
+    :param index: 还原表 (每个三角面对应的原始面序号), 或旧格式的还原点: 前 index 个三角面两两合并为四边形
+    :return: 还原后的面片数组
+    """
+    if isinstance(index, (int, np.integer)):
+        tf = faces_to_array(tf)
+        pairs = tf[:index].reshape(-1, 2, 3)
+        qf = np.concatenate((pairs[:, 0, :], pairs[:, 1, 2:]), axis=1)
+        rest = tf[index:, :3]
+        if len(rest):
+            qf = faces_to_array(qf.tolist() + rest.tolist())
+        return qf
+    return restore_faces(tf, index)
 
 
 def Tri2Quad(tv, tf, index):  # 将三角mesh 转化为 四边形mesh
     """
     :param tv: 三角形面的的顶点
     :param tf: 三角形边形面的点序
-    :index : 还原点 index之后的点序不需要还原
+    :index : Quad2Tri 返回的还原表 (旧格式的整数还原点也可以使用)
     :return: 四边形顶点和面片点序
-    点序的分割按照(1,2,3)(2,3,4)----> 1 2 3 4这种方式分割 顶点不变
-    """
-    qf = []
-    for i in range(0, index, 2):
-        qf_tmp = [tf[i][0], tf[i][1], tf[i][2], tf[i+1][2]]
-        qf.append(qf_tmp)
-    if len(tf) == index:
-        pass
-    else:
-        qf.append(tf[index:])
-    return tv, qf
+    点序的分割按照(1,2,3)(1,3,4)----> 1 2 3 4这种方式还原 顶点不变
+    """
+    return tv, faces_to_list(_tri2quad_faces(tf, index))
+
+
+def _quad2tri_file(file_dir, file, target_dir):
+    v, f = load_obj_arrays(os.path.join(file_dir, file), dtype=np.float64)
+    tf, index = triangulate_faces(f)
+    writeObj(os.path.join(target_dir, file), v, tf, verbose=False)
+    return index
 
 
-def batch_convert_quad2tri(file_dir, filenames, target_dir):
+def batch_convert_quad2tri(file_dir, filenames, target_dir, workers=1, chunksize=16):
     """
     description:批量将四边形的面片转化为三角形面片
     :param file_dir: 文件所在目录
     :param filenames: 批量的文件名字
     :param target_dir: 保存的文件夹
-    :return: 还原点文件
+    :param workers: 并行的进程数, 1 为串行, None 为cpu核数
+    :param chunksize: 每次分给一个进程的文件数
+    :return: 还原表, 所有文件拓扑相同时只有一个 (保存一次), 否则为与filenames中的obj顺序一致的 list, 处理失败的文件为None
     """
-    index_list = []
-    for file in filenames:
-        if file.endswith('.obj'):
-            file_path = os.path.join(file_dir, file)
-            v, f = loadObj(file_path)
-            # print("f is {}".format(f))
-            tv, tf, index = Quad2Tri(v, f)
-            writeObj(os.path.join(target_dir, file), tv, tf)
-            index_list.append(index)
-        else:
-            pass
+    obj_names = [file for file in filenames if file.endswith('.obj')]
+    tasks = [(file_dir, file, target_dir) for file in obj_names]
+    index_list, errors = run_batch(_quad2tri_file, tasks, workers, chunksize)
+    report_errors(errors, obj_names)
+    done = [index for index in index_list if index is not None]
+    if done and not errors and all(np.array_equal(index, done[0]) for index in done):
+        index_list = done[0]
     save_pickle_file(os.path.join(target_dir, "index.pkl"), index_list)
     return index_list
 
 
-def batch_convert_tri2quad(file_dir, filenames, target_dir, index):
+def _tri2quad_file(file_dir, file, target_dir, index, return_mesh):
+    v, f = load_obj_arrays(os.path.join(file_dir, file), dtype=np.float64)
+    qf = _tri2quad_faces(f, index)
+    writeObj(os.path.join(target_dir, file), v, qf, verbose=False)
+    if return_mesh:
+        return v.tolist(), faces_to_list(qf)
+
+
+def batch_convert_tri2quad(file_dir, filenames, target_dir, index, workers=1, chunksize=16):
     """
     description:批量将三角形的面片转化为四边形的面片
     :param file_dir: 文件所在目录
     :param filenames: 批量的文件名字
     :param target_dir: 保存的文件夹
-    :param index: 还原点文件
+    :param index: 还原表, batch_convert_quad2tri 的返回值 (所有文件共用一个或每个文件一个)
+    :param workers: 并行的进程数, 1 为串行, None 为cpu核数
+    :param chunksize: 每次分给一个进程的文件数
     :return: 返回最后一个测试用例
     """
+    tasks = []
+    obj_names = []
     for i, file in enumerate(filenames):
         if file.endswith('.obj'):
-            file_path = os.path.join(file_dir, file)
-            v, f = loadObj(file_path)
-            if isinstance(index,  int):
-                qv, qf = Tri2Quad(v, f, index)
-            if isinstance(index, list):
-                qv, qf = Tri2Quad(v, f, index[i])
-            writeObj(os.path.join(target_dir, file), qv, qf)
-        else:
-            pass
+            shared = isinstance(index, (int, np.integer, np.ndarray))
+            tasks.append((file_dir, file, target_dir, index if shared else index[i], False))
+            obj_names.append(file)
+    if not tasks:
+        return None, None
+    tasks[-1] = tasks[-1][:-1] + (True,)  # 只有最后一个文件需要把结果传回来
+    results, errors = run_batch(_tri2quad_file, tasks, workers, chunksize)
+    report_errors(errors, obj_names)
+    qv, qf = results[-1] if results[-1] is not None else (None, None)
     return qv, qf
 
 
@@ -353,45 +293,21 @@ def find_cloest_index_in_obj(objPath, txtPath, matlab=True):
     :param matlab: 索引是否为matlab格式
     :return: 返回索引list
     """
-    v, f = loadObj(objPath)
-    markpoints_1 = loadmarkpoint(txtPath)
-    row, col = markpoints_1.shape
-    ind1 = []
-    for i in range(0, row):
-        dis_vector = (v - markpoints_1[i, :])  # distance vector
-
-        distance = dis_vector[:, 0] * dis_vector[:, 0] + dis_vector[:, 1] * dis_vector[:, 1] + \
-                   dis_vector[:, 2] * dis_vector[:, 2]
-        index = np.argmin(distance)
-        if matlab:
-            ind1.append(index + 1)
-        else:
-            ind1.append(index)
-    return ind1
+    v, f = load_obj_arrays(objPath, dtype=np.float64)
+    return find_cloest_index_in_obj_withV(v, txtPath, matlab)
 
 
 def find_cloest_index_in_obj_withV(v, txtPath, matlab=True):
     """
     在指定的路径的obj的顶点中找到距离txt中的点最近的索引
+    同一个模型的 KD 树只建一次, 见 Util.spatial_index
     :param v: 模型顶点数组
     :param txtPath: 点的路径
     :param matlab: 索引是否为matlab格式
     :return: 返回索引
     """
     markpoints_1 = loadmarkpoint(txtPath)
-    row, col = markpoints_1.shape
-    ind1 = []
-    for i in range(0, row):
-        dis_vector = (v - markpoints_1[i, :])  # distance vector
-
-        distance = dis_vector[:, 0] * dis_vector[:, 0] + dis_vector[:, 1] * dis_vector[:, 1] + \
-                   dis_vector[:, 2] * dis_vector[:, 2]
-        index = np.argmin(distance)
-        if matlab:
-            ind1.append(index + 1)
-        else:
-            ind1.append(index)
-    return ind1
+    return nearest_vertices(v, markpoints_1, matlab=matlab).tolist()
 
 
 def List2mat(file_mat_path, FaceMarker):
@@ -436,23 +352,21 @@ def con_filename_to_string(txtPathandName, file_path):
 def ExtractFaceVertexIndex(Face_verts, Head_verts, err=1e-9):
     """
     通过给定面部顶点和头部顶点数据返回面部数据在头部数据中的索引位置
+    使用头部顶点的 KD 树一次匹配所有面部顶点, 匹配不上的点一次全部报告
     :param Face_verts: 面部顶点数据 list
     :param Head_verts: 头部顶点数据 list
-    :err :精度
+    :err :精度 (距离的平方)
     :return: 面部顶点数据在头部数据中的索引
     """
     f_v = np.array(Face_verts)
-    h_v = np.array(Head_verts)
-    index = []
-    for v in f_v:
-        assert len(v) == 3, '顶点长度不为3'
-        h_tmp = h_v - v
-        hv_sum = np.sum(h_tmp**2, axis=1)
-        ind = np.where(hv_sum <= err)
-        assert len(ind[0]) >= 1, '点序为空, 人脸数据可能头部数据不匹配'
-        index.append(ind[0][0])
-    assert len(index) == len(f_v), "索引与面部数据长度不一致"
-    return index
+    assert f_v.ndim == 2 and f_v.shape[1] == 3, '顶点长度不为3'
+    index, unmatched, ambiguous = match_vertices(Head_verts, f_v, np.sqrt(err))
+    if len(ambiguous) > 0:
+        print("{} 个面部顶点在头部中有多个匹配, 取序号最小的顶点: {}".format(len(ambiguous), ambiguous.tolist()))
+    if len(unmatched) > 0:
+        print("{} 个面部顶点在头部中没有匹配: {}".format(len(unmatched), unmatched.tolist()))
+    assert len(unmatched) == 0, '点序为空, 人脸数据可能头部数据不匹配'
+    return index.tolist()
 
 
 def ExtracFaceFromHead(Head_v, face_index, face_f):
@@ -463,11 +377,8 @@ def ExtracFaceFromHead(Head_v, face_index, face_f):
     :param face_f: 面部点序 list
     :return: 脸部数据顶点及对应脸部点序 list
     """
-    face_v = []
-    Head_v = np.array(Head_v)
-    for i, ind in enumerate(face_index):
-        face_v.append(Head_v[ind, :].tolist())
-    return face_v, face_f
+    face_v = np.asarray(Head_v)[np.asarray(face_index, dtype=np.intp)]
+    return face_v.tolist(), face_f
 
 
 
@@ -480,39 +391,63 @@ def ConvertFace2Head(Face_v, Head_v, Head_f, index):
     :param index: 脸部数据对应整个头部数据的点的索引 list 1, n
     :return: 替换脸部的整个头部的顶点信息和点序
     """
-    Face_v = np.array(Face_v)
     Head_v = np.array(Head_v)
-    for i, ind in enumerate(index):
-        Head_v[ind, :] = Face_v[i, :]
+    Head_v[np.asarray(index, dtype=np.intp)] = np.asarray(Face_v)
     return Head_v.tolist(), Head_f
 
 
-def batch_convert_head_to_face(head_path, face_index, face_f, face_path):
+def _head_to_face_file(face_index, face_f, head_path, file_name, face_path, return_mesh):
+    head_v, _ = load_obj_arrays(os.path.join(head_path, file_name), dtype=np.float64)
+    face_v = head_v[face_index]
+    writeObj(os.path.join(face_path, file_name), face_v, face_f, verbose=False)
+    if return_mesh:
+        return face_v.tolist(), face_f
+
+
+def batch_convert_head_to_face(head_path, face_index, face_f, face_path, workers=1, chunksize=16, skip_existing=True):
     """
     批量将头部数据转化为面部数据
     :param head_path: 头部文件数据路径
     :param face_path: 面部数据文件路径
     :param face_index: 面部数据索引
     :param face_f: 面部点序
+    :param workers: 并行的进程数, 1 为串行, None 为cpu核数
+    :param chunksize: 每次分给一个进程的文件数
+    :param skip_existing: 是否跳过已经存在的面部文件 (由 Util.pipeline 判断是否需要重新生成时设为 False)
     :return: 最后一个转化的face_v face_f
     """
     files = os.listdir(head_path)
+    tasks = []
     for file_name in files:
         if file_name.endswith('.obj'):
-            if os.path.exists(os.path.join(face_path, file_name)):
+            if skip_existing and os.path.exists(os.path.join(face_path, file_name)):
                 print("skip file {}".format(os.path.join(face_path, file_name)))
                 # 文件存在便不再重新生成 节约生成时间 所以要完全重新生成的话，要清空生成文件夹下所有的文件
             else:
-                file = os.path.join(head_path, file_name)
-                head_v, head_f = loadObj(file)
-                face_v, face_f = ExtracFaceFromHead(head_v, face_index, face_f)
-                writeObj(os.path.join(face_path, file_name), face_v, face_f)
+                tasks.append((head_path, file_name, face_path, False))
         else:
             pass
+    if not tasks:
+        return None, face_f
+    tasks[-1] = tasks[-1][:-1] + (True,)
+    # face_index face_f 每个进程只传递一次
+    results, errors = run_batch(_head_to_face_file, tasks, workers, chunksize,
+                                shared_args=(np.asarray(face_index, dtype=np.intp), face_f))
+    report_errors(errors, [task[1] for task in tasks])
+    face_v, face_f = results[-1] if results[-1] is not None else (None, face_f)
     return face_v, face_f
 
 
-def batch_convert_face_to_head(faces_path, save_head_path, head_v, head_f, face_index):
+def _face_to_head_file(head_v, head_f, face_index, faces_path, file_name, save_head_path, return_mesh):
+    face_v, _ = load_obj_arrays(os.path.join(faces_path, file_name), dtype=np.float64)
+    Head_v = np.array(head_v, dtype=np.float64)
+    Head_v[face_index] = face_v
+    writeObj(os.path.join(save_head_path, file_name), Head_v, head_f, verbose=False)
+    if return_mesh:
+        return Head_v.tolist(), head_f
+
+
+def batch_convert_face_to_head(faces_path, save_head_path, head_v, head_f, face_index, workers=1, chunksize=16):
     """
     批量将面部部数据转化为头部数据 即：换脸 使脸部数据公用相同的颈部和后脑勺
     :param faces_path: 面部数据路径
@@ -520,43 +455,108 @@ def batch_convert_face_to_head(faces_path, save_head_path, head_v, head_f, face_
     :param head_v: 要换的头
     :param head_f: 要换的头的点序
     :param face_index: 需要更换的头部数据（面部点）
+    :param workers: 并行的进程数, 1 为串行, None 为cpu核数
+    :param chunksize: 每次分给一个进程的文件数
     :return: 最后一个头部的顶点和点序
     """
-    face_file_names = os.listdir(faces_path)
-    for file_name in face_file_names:
-        if file_name.endswith('.obj'):
-            file = os.path.join(faces_path, file_name)
-            face_v, face_f = loadObj(file)
-            Head_v, Head_f = ConvertFace2Head(face_v, head_v, head_f, face_index)
-            writeObj(os.path.join(save_head_path, file_name), Head_v, Head_f)
-        else:
-            pass
+    face_file_names = [file_name for file_name in os.listdir(faces_path) if file_name.endswith('.obj')]
+    tasks = [(faces_path, file_name, save_head_path, i == len(face_file_names) - 1)
+             for i, file_name in enumerate(face_file_names)]
+    # 头部模板和 face_index 每个进程只传递一次
+    results, errors = run_batch(_face_to_head_file, tasks, workers, chunksize,
+                                shared_args=(head_v, head_f, np.asarray(face_index, dtype=np.intp)))
+    report_errors(errors, face_file_names)
+    Head_v, Head_f = results[-1] if results and results[-1] is not None else (None, head_f)
     return Head_v, Head_f
 
 
-def AlignTwoFaceWithRandomPoints(FirstFace_verts, SecondFace_verts, numberof_points=7):
+def AlignTwoFaceWithRandomPoints(FirstFace_verts, SecondFace_verts, numberof_points=7, threshold=None, max_iter=1000,
+                                 time_budget=None, seed=None, return_sRt=False):
     """
     将第二个人脸对齐到第一个人脸, 通过计算旋转矩阵, 平移矩阵等等 注意第二个像第一个人脸对齐 即要对齐的人脸是第二个参数
+    用 RANSAC 随机抽取多组不重复的点计算 sim3, 选择内点最多的一组, 再用所有内点重新计算, 表情变化大的区域作为外点被排除
     :param FirstFace: 第一个人脸顶点数据 n x 3
     :param SecondFace: 第二个人脸顶点数据 第一个人脸和第二个人最好定数一样 n x 3
-    :param numberof_points:选用多少点进行刚体变换
-    :return: 返回第二个人脸对齐后的数据
+    :param numberof_points: 每组随机点的个数 (至少 3), 默认与以前一样为 7; 3 为最小样本, 外点多时需要的组数最少
+    :param threshold: 内点的距离阈值, None 时按误差的中位数自动确定, 见 ransac_sim3_batch
+    :param max_iter: 最多抽取的组数
+    :param time_budget: 抽取的时间上限 秒, None 为不限制
+    :param seed: 随机数种子或 np.random.Generator, 相同的种子结果相同
+    :return: 返回第二个人脸对齐后的数据; return_sRt 为 True 时同时返回 s, R, t, 内点比例, 内点的平均误差
     """
-    Number_points = len(FirstFace_verts)
-    select_index = np.random.randint(low=0, high=Number_points, size=numberof_points)
-    Face1 = np.array(FirstFace_verts)
-    Face2 = np.array(SecondFace_verts)
-    Face1_select = Face1[select_index, :].T
-    Face2_selcet = Face2[select_index, :].T
-    s, R, t, _ = align_sim3(Face1_select, Face2_selcet)
-    # print("align error is {}".format(error))
+    Face1 = np.array(FirstFace_verts, dtype=np.float64)
+    Face2 = np.array(SecondFace_verts, dtype=np.float64)
+    s, R, t, t_error, inliers = ransac_sim3(Face1.T, Face2.T, threshold, numberof_points, max_iter, time_budget,
+                                            rng=seed)
     model_aligned = s * R.dot(Face2.T) + t
-    alignment_error = model_aligned - Face1.T
-    t_error = np.sqrt(np.sum(np.multiply(alignment_error, alignment_error), 0))
-    print("model aligned error is {}".format(np.mean(t_error)))
+    inlier_ratio = inliers.mean()
+    res = t_error[inliers].mean() if inliers.any() else np.inf
+    print("model aligned error is {}, inlier ratio is {:.3f}, inlier error is {}".format(np.mean(t_error), inlier_ratio, res))
+    if return_sRt:
+        return model_aligned.T.tolist(), s, R, t, inlier_ratio, res
     return model_aligned.T.tolist()
 
 
+def AlignFramesWithRandomPoints(FirstFace_verts, frames, out=None, chunk_size=16, numberof_points=3, threshold=None,
+                                max_iter=1000, time_budget=None, seed=None):
+    """
+    用 RANSAC 将一个序列的所有帧对齐到第一个人脸, 每 chunk_size 帧一起抽样和计算, 见 AlignTwoFaceWithRandomPoints
+    :param FirstFace_verts: 第一个人脸顶点数据 n x 3
+    :param frames: 要对齐的所有帧 T x n x 3, 可以是 MeshSequence.frames
+    :param out: 保存结果的 T x n x 3 数组, 可以是 frames 本身 (原地对齐), 默认新建
+    :param chunk_size: 每次计算的帧数, 限制内存占用
+    :param time_budget: 每块帧的抽取时间上限 秒, None 为不限制
+    :param seed: 随机数种子或 np.random.Generator, 所有块共用一个随机数生成器, 参数相同时结果相同
+    :return: 对齐后的帧, s (T,), R (T x 3 x 3), t (T x 3 x 1), 每帧的内点比例 (T,), 每帧内点的平均误差 (T,)
+    """
+    rng = np.random.default_rng(seed)
+    model = np.array(FirstFace_verts, dtype=np.float64).T  # 3 x n
+    number_frames = len(frames)
+    if out is None:
+        out = np.empty(np.shape(frames), dtype=np.result_type(frames.dtype, np.float32))
+    s = np.empty((number_frames,))
+    R = np.empty((number_frames, 3, 3))
+    t = np.empty((number_frames, 3, 1))
+    inlier_ratio = np.empty((number_frames,))
+    res = np.empty((number_frames,))
+    for start in range(0, number_frames, chunk_size):
+        end = min(start + chunk_size, number_frames)
+        data = np.asarray(frames[start:end], dtype=np.float64).transpose(0, 2, 1)  # c x 3 x n
+        s[start:end], R[start:end], t[start:end], t_error, inliers = ransac_sim3_batch(
+            np.broadcast_to(model, data.shape), data, threshold, numberof_points, max_iter, time_budget, rng=rng)
+        inlier_ratio[start:end] = inliers.mean(axis=1)
+        res[start:end] = (t_error * inliers).sum(axis=1) / np.maximum(inliers.sum(axis=1), 1)
+        out[start:end] = (s[start:end, np.newaxis, np.newaxis] * np.matmul(R[start:end], data) + t[start:end]).transpose(0, 2, 1)
+    return out, s, R, t, inlier_ratio, res
+
+
+def BatchAlignFacewithRandomPoints(FaceToalignPath, FaceAligned_verts, SavePath, chunk_size=16, threshold=None,
+                                   time_budget=None, seed=0):
+    """
+    批量稳定人脸
+    每 chunk_size 个文件一起用 AlignFramesWithRandomPoints 对齐, 种子固定时结果可以复现
+    :param FaceToalignPath: 要对齐的人脸路径
+    :param FaceAligned_verts: 选好的对齐人脸顶点
+    :param SavePath: 要保存的路径
+    :param chunk_size: 一次读入内存的文件数
+    :param threshold: 内点的距离阈值, None 时自动确定
+    :param time_budget: 每块文件的抽取时间上限 秒
+    :param seed: 随机数种子
+    """
+    rng = np.random.default_rng(seed)
+    file_names = sorted(filename for filename in os.listdir(FaceToalignPath) if filename.endswith('.obj'))
+    for start in range(0, len(file_names), chunk_size):
+        chunk_names = file_names[start:start + chunk_size]
+        meshes = [load_obj_arrays(os.path.join(FaceToalignPath, filename), dtype=np.float64) for filename in chunk_names]
+        frames = np.stack([v for v, _ in meshes])
+        aligned, _, _, _, inlier_ratio, res = AlignFramesWithRandomPoints(FaceAligned_verts, frames, out=frames,
+                                                                          chunk_size=chunk_size, threshold=threshold,
+                                                                          time_budget=time_budget, seed=rng)
+        for filename, (_, f), v, ratio, r in zip(chunk_names, meshes, aligned, inlier_ratio, res):
+            print("{} inlier ratio is {:.3f}, inlier error is {}".format(filename, ratio, r))
+            write_obj_arrays(os.path.join(SavePath, filename), v, f, precision=None)
+
+
 def R_to_axis_angle(matrix):
     """Convert the rotation matrix into the axis-angle notation.
     Conversion equations
@@ -636,13 +636,15 @@ def R_axis_angle(matrix, axis, angle):
     return matrix
 
 
-def AlignTwoFaceWithFixedPoints(FirstFace_verts, SecondFace_verts, pointsindex, non_linear_align=False, return_sRt=False):
+def AlignTwoFaceWithFixedPoints(FirstFace_verts, SecondFace_verts, pointsindex, non_linear_align=False, return_sRt=False,
+                                init=None, huber=None):
     """
-    非线性对齐要求对齐点数大于8
     将第二个人脸对齐到第一个人脸, 通过计算旋转矩阵, 平移矩阵等等 注意第二个像第一个人脸对齐 即要对齐的人脸是第二个参数
     :param FirstFace: 第一个人脸顶点数据 n x 3
     :param SecondFace: 第二个人脸顶点数据 第一个人脸和第二个人最好点数一样 n x 3
     :param pointsindex: 需要對齊所使用的點序 一維list
+    :param init: 非线性对齐的初始值 (s, R, t), 例如上一帧 return_sRt 返回的结果
+    :param huber: 非线性对齐使用的 Huber 阈值, 见 caculate_transform
     :return: 返回第二个人脸对齐后的数据
     """
     if non_linear_align:
@@ -651,7 +653,7 @@ def AlignTwoFaceWithFixedPoints(FirstFace_verts, SecondFace_verts, pointsindex,
         Face2 = np.array(SecondFace_verts)
         Face1_select = Face1[select_index, :]
         Face2_selcet = Face2[select_index, :]
-        R, t, s, res = caculate_transform(Face1_select, Face2_selcet)
+        R, t, s, res = caculate_transform(Face1_select, Face2_selcet, init=init, huber=huber)
         t = t[:, np.newaxis]
         model_aligned = s * R.dot(Face2.T) + t
         alignment_error = model_aligned - Face1.T
@@ -682,39 +684,128 @@ def AlignTwoFaceWithFixedPoints(FirstFace_verts, SecondFace_verts, pointsindex,
         return model_aligned.tolist()
 
 
-def BatchAlignFacewithRandomPoints(FaceToalignPath, FaceAligned_verts, SavePath):
+def AlignFramesWithFixedPoints(FirstFace_verts, frames, pointsindex, out=None, chunk_size=512, non_linear_align=False,
+                               huber=None, points_weights=None):
+    """
+    将一个序列的所有帧对齐到第一个人脸, 结果与逐帧调用 AlignTwoFaceWithFixedPoints 一致
+    :param FirstFace_verts: 第一个人脸顶点数据 n x 3
+    :param frames: 要对齐的所有帧 T x n x 3, 可以是 MeshSequence.frames
+    :param pointsindex: 对齐所使用的点序 一维list, 可以用 Util.rigid_region.select_rigid_anchors 自动选择
+    :param non_linear_align: 是否在 Umeyama 的结果上再用 LM 优化 (所有帧一起迭代)
+    :param huber: 非线性对齐使用的 Huber 阈值, 见 caculate_transform
+    :param points_weights: 每个对齐点的权重, 例如 select_rigid_anchors 返回的权重, 默认相同
+    :param out: 保存结果的 T x n x 3 数组, 可以是 frames 本身 (原地对齐), 默认新建
+    :param chunk_size: 每次计算的帧数, 限制内存占用
+    :return: 对齐后的帧, s (T,), R (T x 3 x 3), t (T x 3 x 1), 每帧的平均误差 (T,)
+    """
+    select_index = np.array(pointsindex)
+    Face1 = np.array(FirstFace_verts, dtype=np.float64)
+    model = Face1[select_index, :].T  # 3 x k
+    number_frames = len(frames)
+    if out is None:
+        out = np.empty(np.shape(frames), dtype=np.result_type(frames.dtype, np.float32))
+    s = np.empty((number_frames,))
+    R = np.empty((number_frames, 3, 3))
+    t = np.empty((number_frames, 3, 1))
+    res = np.empty((number_frames,))
+    for start in range(0, number_frames, chunk_size):
+        end = min(start + chunk_size, number_frames)
+        Face2 = np.asarray(frames[start:end], dtype=np.float64)
+        data = Face2[:, select_index, :].transpose(0, 2, 1)  # c x 3 x k
+        chunk_model = np.broadcast_to(model, data.shape)
+        s[start:end], R[start:end], t[start:end], _ = align_sim3_batch(chunk_model, data, points_weights)
+        if non_linear_align:
+            s[start:end], R[start:end], t[start:end], _ = refine_sim3_batch(chunk_model, data, s[start:end],
+                                                                            R[start:end], t[start:end], points_weights,
+                                                                            huber=huber)
+        model_aligned = s[start:end, np.newaxis, np.newaxis] * np.matmul(Face2, R[start:end].transpose(0, 2, 1)) \
+            + t[start:end].transpose(0, 2, 1)
+        res[start:end] = np.linalg.norm(model_aligned - Face1, axis=2).mean(axis=1)
+        out[start:end] = model_aligned
+    return out, s, R, t, res
+
+
+def BatchAlignFacewithFixedPoints(FaceToalignPath, FaceAligned_verts, SavePath, points_index, non_linear_align=False, return_sRt=False, chunk_size=256, huber=None,
+                                  points_weights=None):
     """
     批量稳定人脸
+    每 chunk_size 个文件一起用 AlignFramesWithFixedPoints 对齐
     :param FaceToalignPath: 要对齐的人脸路径
     :param FaceAligned_verts: 选好的对齐人脸顶点
     :param SavePath: 要保存的路径
-    :return: 最后一个对齐的人脸
+    :param chunk_size: 一次读入内存的文件数
+    :param huber: 非线性对齐使用的 Huber 阈值, 见 caculate_transform
+    :param points_weights: 每个对齐点的权重, 见 AlignFramesWithFixedPoints
+    :return: return_sRt 为 True 时返回所有文件 (按 os.listdir 顺序) 的 s, R, t
+    """
+    file_names = [filename for filename in os.listdir(FaceToalignPath) if filename.endswith('.obj')]
+    all_s, all_R, all_t = [], [], []
+    for start in range(0, len(file_names), chunk_size):
+        chunk_names = file_names[start:start + chunk_size]
+        meshes = [load_obj_arrays(os.path.join(FaceToalignPath, filename), dtype=np.float64) for filename in chunk_names]
+        frames = np.stack([v for v, _ in meshes])
+        aligned, s, R, t, res = AlignFramesWithFixedPoints(FaceAligned_verts, frames, points_index, out=frames,
+                                                           non_linear_align=non_linear_align, huber=huber,
+                                                           points_weights=points_weights)
+        for filename, (_, f), v, r in zip(chunk_names, meshes, aligned, res):
+            print("{} aligned error is {}".format(filename, r))
+            write_obj_arrays(os.path.join(SavePath, filename), v, f, precision=None)
+        all_s.append(s)
+        all_R.append(R)
+        all_t.append(t)
+    if return_sRt and all_s:
+        return np.concatenate(all_s), np.concatenate(all_R), np.concatenate(all_t)
+
+
+def AlignTwoFaceWithICP(FirstFace_verts, SecondFace_verts, FirstFace_faces=None, point_to_plane=True, scale=False,
+                        trim=0.9, init=None, return_sRt=False):
+    """
+    用 ICP 将第二个模型对齐到第一个模型, 两个模型不需要相同的点序 (例如扫描数据), 见 Util.icp.ICP
+    :param FirstFace_verts: 第一个模型 (目标) 顶点 n x 3
+    :param SecondFace_verts: 要对齐的模型顶点 m x 3
+    :param FirstFace_faces: 第一个模型的面片, 用于计算点到面的法向, 没有时按最近邻估计
+    :param point_to_plane: True 为点到面, False 为点到点 (收敛慢, 没有 init 时先做几次点到面迭代, 见 ICP)
+    :param scale: 是否同时求缩放
+    :param trim: 每次迭代保留的对应点比例
+    :param init: 初值 (s, R, t), None 时只对齐重心
+    :return: 返回第二个模型对齐后的数据; return_sRt 为 True 时同时返回 s, R, t, 平均距离
     """
-    file_names = os.listdir(FaceToalignPath)
-    for filename in file_names:
-        if filename.endswith('.obj'):
-            file = os.path.join(FaceToalignPath, filename)
-            ToAlign_v, ToAlign_f = loadObj(file)
-            aligned_v = AlignTwoFaceWithRandomPoints(FaceAligned_verts, ToAlign_v)
-            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f)
+    icp = ICP(FirstFace_verts, FirstFace_faces, point_to_plane=point_to_plane, scale=scale, trim=trim)
+    Face2 = np.array(SecondFace_verts, dtype=np.float64)
+    s, R, t, res, ratio = icp.align(Face2, init)
+    print("model aligned error is {}, inlier ratio is {:.3f}".format(res, ratio))
+    model_aligned = s * R.dot(Face2.T) + t
+    if return_sRt:
+        return model_aligned.T.tolist(), s, R, t, res
+    return model_aligned.T.tolist()
 
 
-def BatchAlignFacewithFixedPoints(FaceToalignPath, FaceAligned_verts, SavePath, points_index, non_linear_align=False, return_sRt=False):
+def BatchAlignFacewithICP(FaceToalignPath, FaceAligned_verts, SavePath, FaceAligned_faces=None, point_to_plane=True,
+                          scale=False, trim=0.9, return_sRt=False):
     """
-    批量稳定人脸
-    :param FaceToalignPath: 要对齐的人脸路径
-    :param FaceAligned_verts: 选好的对齐人脸顶点
+    批量用 ICP 稳定没有相同点序的模型, 文件按数字顺序处理, 每一帧从上一帧的结果开始迭代
+    :param FaceToalignPath: 要对齐的模型路径
+    :param FaceAligned_verts: 对齐的目标顶点, 目标的 KD 树和法向只计算一次
     :param SavePath: 要保存的路径
-    :return: 最后一个对齐的人脸
+    :param FaceAligned_faces: 目标的面片, 用于计算法向
+    :return: return_sRt 为 True 时返回所有文件 (按数字顺序) 的 s, R, t
     """
-    file_names = os.listdir(FaceToalignPath)
-    for filename in file_names:
-        if filename.endswith('.obj'):
-            file = os.path.join(FaceToalignPath, filename)
-            ToAlign_v, ToAlign_f = loadObj(file)
-            # print("ToAlign_f is {}".format(ToAlign_f))
-            aligned_v = AlignTwoFaceWithFixedPoints(FaceAligned_verts, ToAlign_v, points_index, non_linear_align, return_sRt)
-            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f)
+    icp = ICP(FaceAligned_verts, FaceAligned_faces, point_to_plane=point_to_plane, scale=scale, trim=trim)
+    file_names = sorted([filename for filename in os.listdir(FaceToalignPath) if filename.endswith('.obj')],
+                        key=natural_sort_key)
+    number_files = len(file_names)
+    all_s, all_R, all_t = np.empty((number_files,)), np.empty((number_files, 3, 3)), np.empty((number_files, 3, 1))
+    init = None
+    for i, filename in enumerate(file_names):
+        v, f = load_obj_arrays(os.path.join(FaceToalignPath, filename), dtype=np.float64)
+        # 拓扑可以逐帧不同, 所以逐个文件调用 align 而不是 align_sequence
+        all_s[i], all_R[i], all_t[i], res, ratio = icp.align(v, init)
+        init = (all_s[i], all_R[i], all_t[i])
+        print("{} aligned error is {}, inlier ratio is {:.3f}".format(filename, res, ratio))
+        write_obj_arrays(os.path.join(SavePath, filename), all_s[i] * v.dot(all_R[i].T) + all_t[i, :, 0], f,
+                         precision=None)
+    if return_sRt:
+        return all_s, all_R, all_t
 
 
 def resSimXform(b, A, B):
@@ -726,68 +817,158 @@ def resSimXform(b, A, B):
     return result
 
 
-def caculate_transform(Model, Data):
+def caculate_transform(Model, Data, init=None, weights=None, huber=None):
     """
-    使用此方法要求点数大于等于8
     对齐Data 到 Model
     calculate the R t s between PointsA and PointsB
+    先用 Umeyama 求闭式解 (或者使用 init, 例如上一帧的结果), 再用 LM 迭代优化 (解析雅可比)
+    最小二乘时闭式解已经是最优解, 优化只在给定 weights 或 huber 时改变结果
     :param Model: n * 3  ndarray
     :param Data: n * 3  ndarray
-    :return: R t s
-    """
-
-    model = Model.T  # 3 * n
-    data = Data.T  # 3 * n
-    cent = np.vstack((np.mean(model, axis=1), np.mean(data, axis=1))).T
-    cent_0 = cent[:, 0]
-    model_center = cent_0[:, np.newaxis]
-    cent_1 = cent[:, 1]
-    data_center = cent_1[:, np.newaxis]
-    model_zerocentered = model - model_center
-    data_zerocentered = data - data_center
-    n = model.shape[1]
-    Cov_matrix = 1.0/n * model_zerocentered.dot(data_zerocentered.T)
-    U, D, V = np.linalg.svd(Cov_matrix)
-    V = V.T
-    W = np.eye(V.shape[0], V.shape[0])
-    if np.linalg.det(V.dot(W).dot(U.T)) == -1:
-        print("计算出的旋转矩阵为反射矩阵，纠正中..")
-        W[-1, -1] = np.linalg.det(V.dot(U.T))
-    R = V.dot(W).dot(U.T)
-    sigma2 = (1.0 / n) * np.multiply(data_zerocentered, data_zerocentered).sum()
-    s = 1.0 / sigma2 * np.trace(np.dot(np.diag(D), W))
-    t = model_center - s*R.dot(data_center)
-    b0 = np.zeros((8,))
-    if np.isreal(R).all():
-        axis, theta = R_to_axis_angle(R)
-        b0[0:3] = axis
-        b0[3] = theta
-        if not np.isreal(b0).all():
-            b0 = np.abs(b0)
+    :param init: 初始值 (s, R, t), None 时使用 Umeyama 的结果
+    :param weights: 每个点的权重 (n,)
+    :param huber: Huber 损失的阈值, 用于抑制误差大的点, None 为最小二乘
+    :return: R t s res
+    """
+    model = np.asarray(Model, dtype=np.float64).T  # 3 * n
+    data = np.asarray(Data, dtype=np.float64).T  # 3 * n
+    if init is None:
+        s, R, t, _ = align_sim3(model, data)
     else:
-        print("R is {}".format(R))
-        print("R中存在非实数")
-    b0[4:7] = t.T
-    b0[7] = s
-    # b = least_squares(fun=resSimXform, x0=b0, jac='3-point', method='lm', args=(data, model),
-    #                   ftol=1e-12, xtol=1e-12, gtol=1e-12, max_nfev=1000)  # 参数只能是一维向量么
-    b = optimize.minimize(fun=resSimXform, x0=b0, jac=False, method='BFGS', args=(data, model),
-                          options={"gtol": 0.001, "maxiter": 8000, "disp":False, "eps": 1e-7})
-    r = b.x[0:4]
-    t = b.x[4:7]
-    s = b.x[7]
-    R = R_axis_angle(R, r[0:3], r[3])
+        s, R, t = init
+    s, R, t, _ = refine_sim3(model, data, s, R, np.reshape(t, (3, 1)), weights, huber)
+    t = t[:, 0]
     rot_A = s*R.dot(data) + t[:, np.newaxis]
     res = np.sum(np.sqrt(np.sum((model-rot_A)**2, axis=1)))/model.shape[1]
     # print("对齐误差是{}".format(res))
     return R, t, s, res
 
 
+def _prepare_neutral_face(head_path, head_name, face_file, rootPath, role, extract_blendshapes):
+    """
+    保存中性头部和中性面部, 计算面部区域在头部中的点序, extract_blendshapes 为 True 时提取所有头部 blendshape 的面部区域
+    """
+    assert os.path.isfile(face_file), "{} 不存在, 需要提前准备好头部的脸部区域".format(face_file)
+    head_v, head_f = loadObj(os.path.join(head_path, head_name))
+    writeObj(os.path.join(rootPath, role, "Quad", "Head", "NeutralPose", head_name), head_v, head_f)
+    face_v, face_f = loadObj(face_file)
+    writeObj(os.path.join(rootPath, role, "Quad", "Face", "NeutralPose", os.path.basename(face_file)), face_v, face_f)
+    face_index = ExtractFaceVertexIndex(face_v, head_v)  # 面部区域占头部区域的点序位置
+    save_pickle_file(os.path.join(rootPath, role, "Quad", "Face", "NeutralPose", "face_index.pkl"), face_index)
+    if extract_blendshapes:
+        batch_convert_head_to_face(head_path, face_index, face_f, os.path.join(rootPath, role, "Quad", "Face", "Blendshapes"),
+                                   skip_existing=False)  # 提取所有面部区域
+        print("{} 的所有blendshape面部数据提取完毕..".format(role))
+
+
+def _triangulate_dir(file_dir, target_dir):
+    batch_convert_quad2tri(file_dir, os.listdir(file_dir), target_dir)
+
+
+def _triangulate_neutral_face(face_file, target_dir):
+    v, f = loadObj(face_file)
+    tv, tf, index = Quad2Tri(v, f)
+    writeObj(os.path.join(target_dir, os.path.basename(face_file)), tv, tf)
+    save_pickle_file(os.path.join(target_dir, "index.pkl"), index)
+
+
+def _align_to_neutral_face(face_path, neutral_face_file, save_path, FaceMarker_path, column):
+    """
+    用前 10 个标记点对齐, column 为 0 时使用演员的标记点, 1 为角色
+    """
+    FaceMarker = io.loadmat(FaceMarker_path)['Marker']
+    v, _ = loadObj(neutral_face_file)
+    BatchAlignFacewithFixedPoints(face_path, v, save_path, [t - 1 for t in FaceMarker[0:10, column]])
+
+
+def _transfer_faces(rootPath, ActorFaceNeutralPoseName, CharactorFaceNeutralPoseName, FaceMarker_path):
+    BlendShapeTransferStep2(rootPath, ActorFaceNeutralPoseName, CharactorFaceNeutralPoseName,
+                            io.loadmat(FaceMarker_path)['Marker'])
+
+
+def _charactor_faces_to_heads(rootPath, CharactorHead, CharactorFaceNeutralPoseName, FaceMarker_path):
+    charactor = os.path.join(rootPath, "Charactor")
+    BasicBlenshapeTransferstep3(os.path.join(charactor, "Tri", "Face", "Blendshapes"),
+                                os.path.join(charactor, "Tri", "Face", "NeutralPose", CharactorFaceNeutralPoseName),
+                                os.path.join(charactor, "Quad", "Face", "NeutralPose", "face_index.pkl"),
+                                CharactorHead,
+                                os.path.join(charactor, "Tri", "Face", "NeutralPose", "index.pkl"),
+                                [t - 1 for t in io.loadmat(FaceMarker_path)['Marker'][0:10, 1]],
+                                os.path.join(charactor, "Tri", "Face", "AlignedBlendshapes"),
+                                os.path.join(charactor, "Quad", "Face", "Blendshapes"),
+                                os.path.join(charactor, "Quad", "Head", "Blendshapes"))
+
+
+def BlendShapeTransferPipeline(Actor_head_path, ActorNeutralHeadPoseName, CharactorHeadPath,
+                               CharactorHeadNeutralPoseName, ActorFaceNeutralPosePath, ActorFaceNeutralPoseName,
+                               CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName, source_txt, target_txt, rootPath,
+                               workers=2):
+    """
+    blendshape 迁移的完整流水线 (BlendShapeTransferStep1 -> BlendShapeTransferStep2 -> BasicBlenshapeTransferstep3)
+    输入没有变化的 stage 直接跳过, 演员和角色的处理同时运行, 见 Util.pipeline
+    参数与 BlendShapeTransferStep1 相同
+    :param workers: 同时运行的 stage 个数
+    :return: Pipeline, pipeline.run() 运行全部, pipeline.run(["actor_align"]) 只运行到演员面部对齐,
+             raise_on_failure=True 时 stage 失败抛出异常
+    """
+    actor = os.path.join(rootPath, "Actor")
+    charactor = os.path.join(rootPath, "Charactor")
+    actor_face = os.path.join(ActorFaceNeutralPosePath, ActorFaceNeutralPoseName)
+    charactor_face = os.path.join(CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName)
+    charactor_head = os.path.join(CharactorHeadPath, CharactorHeadNeutralPoseName)
+    FaceMarker_path = os.path.join(rootPath, "Face_Marker.mat")
+    if not os.path.isdir(rootPath):
+        os.makedirs(rootPath)
+    pipeline = Pipeline(rootPath, workers)
+    pipeline.add("actor_face", _prepare_neutral_face,
+                 (Actor_head_path, ActorNeutralHeadPoseName, actor_face, rootPath, "Actor", True),
+                 inputs=[Actor_head_path, actor_face],
+                 outputs=[os.path.join(actor, "Quad", "Head", "NeutralPose"), os.path.join(actor, "Quad", "Face", "NeutralPose"),
+                          os.path.join(actor, "Quad", "Face", "Blendshapes")])
+    pipeline.add("charactor_face", _prepare_neutral_face,
+                 (CharactorHeadPath, CharactorHeadNeutralPoseName, charactor_face, rootPath, "Charactor", False),
+                 inputs=[charactor_head, charactor_face],
+                 outputs=[os.path.join(charactor, "Quad", "Head", "NeutralPose"),
+                          os.path.join(charactor, "Quad", "Face", "NeutralPose")])
+    pipeline.add("face_marker", make_Face_Marker, (actor_face, source_txt, charactor_face, target_txt, FaceMarker_path),
+                 inputs=[actor_face, source_txt, charactor_face, target_txt], outputs=[FaceMarker_path])  # 面部数据的mat文件索引
+    # 面部数据三角化并且对齐
+    pipeline.add("actor_triangulate", _triangulate_dir,
+                 (os.path.join(actor, "Quad", "Face", "Blendshapes"), os.path.join(actor, "Tri", "Face", "Blendshapes")),
+                 inputs=[os.path.join(actor, "Quad", "Face", "Blendshapes")],
+                 outputs=[os.path.join(actor, "Tri", "Face", "Blendshapes")])
+    pipeline.add("charactor_triangulate", _triangulate_neutral_face,
+                 (charactor_face, os.path.join(charactor, "Tri", "Face", "NeutralPose")),
+                 inputs=[charactor_face], outputs=[os.path.join(charactor, "Tri", "Face", "NeutralPose")])
+    pipeline.add("actor_align", _align_to_neutral_face,
+                 (os.path.join(actor, "Tri", "Face", "Blendshapes"), actor_face,
+                  os.path.join(actor, "Tri", "Face", "AlignedBlendshapes"), FaceMarker_path, 0),
+                 inputs=[os.path.join(actor, "Tri", "Face", "Blendshapes"), actor_face, FaceMarker_path],
+                 outputs=[os.path.join(actor, "Tri", "Face", "AlignedBlendshapes")])
+    pipeline.add("transfer", _transfer_faces,
+                 (rootPath, ActorFaceNeutralPoseName, CharactorFaceNeutralPoseName, FaceMarker_path),
+                 inputs=[os.path.join(actor, "Quad", "Face", "NeutralPose"), os.path.join(actor, "Tri", "Face", "AlignedBlendshapes"),
+                         os.path.join(charactor, "Tri", "Face", "NeutralPose"), FaceMarker_path],
+                 outputs=[os.path.join(charactor, "Tri", "Face", "Blendshapes")])
+    pipeline.add("charactor_head", _charactor_faces_to_heads,
+                 (rootPath, charactor_head, CharactorFaceNeutralPoseName, FaceMarker_path),
+                 inputs=[os.path.join(charactor, "Tri", "Face", "Blendshapes"), os.path.join(charactor, "Tri", "Face", "NeutralPose"),
+                         os.path.join(charactor, "Quad", "Face", "NeutralPose"), charactor_head, FaceMarker_path],
+                 outputs=[os.path.join(charactor, "Tri", "Face", "AlignedBlendshapes"),
+                          os.path.join(charactor, "Quad", "Face", "Blendshapes"),
+                          os.path.join(charactor, "Quad", "Head", "Blendshapes")])
+    return pipeline
+
+
 def BlendShapeTransferStep1(Actor_head_path, ActorNeutralHeadPoseName, CharactorHeadPath,
                            CharactorHeadNeutralPoseName, ActorFaceNeutralPosePath, ActorFaceNeutralPoseName,
-                           CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName, source_txt, target_txt, rootPath):
+                           CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName, source_txt, target_txt, rootPath,
+                           workers=2, force=False):
     """
     BasicBlenshapeTransfer_step1的改进版本
+    按 BlendShapeTransferPipeline 运行到演员面部对齐和角色中性面部的准备和三角化为止, 输入没有变化时直接跳过,
+    之后可以运行 BlendShapeTransferStep2 和 BasicBlenshapeTransferstep3, 或者直接使用 BlendShapeTransferPipeline(...).run()
+    任何 stage 失败时抛出 RuntimeError
     :param Actor_head_path:
     :param ActorNeutralHeadPoseName:
     :param CharactorHeadPath:
@@ -797,132 +978,52 @@ def BlendShapeTransferStep1(Actor_head_path, ActorNeutralHeadPoseName, Charactor
     :param CharactorFaceNeutralPosePath:
     :param CharactorFaceNeutralPoseName:
     :param rootPath:
-    :return:
+    :param workers: 同时运行的 stage 个数
+    :param force: 忽略缓存全部重新运行
+    :return: 标记点索引 [演员索引, 角色索引] (2 x M list), matlab 格式, 与 Face_Marker.mat 中的 Marker 互为转置
     """
-    if not os.path.isdir(rootPath):
-        os.mkdir(rootPath)
-    if not os.path.isdir(os.path.join(rootPath, "Actor")):
-        os.mkdir(os.path.join(rootPath, "Actor"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor")):
-        os.mkdir(os.path.join(rootPath, "Charactor"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Face")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Face"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Face")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Face"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Face")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Face"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Face")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Face"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Head")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Head"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Head")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Head"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Head")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Head"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Head")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Head"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Face", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Face", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Face", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Face", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Face", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Face", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Head", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Head", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Face", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Face", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Head", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Head", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Head", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Head", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Head", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Head", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Head", "NeutralPose")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Head", "NeutralPose"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Head", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Head", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Head", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Head", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Head", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Head", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Head", "Blendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Head", "Blendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "AlignedBlendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Tri", "Face", "AlignedBlendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Tri", "Face", "AlignedBlendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Tri", "Face", "AlignedBlendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "AlignedBlendshapes")):
-        os.mkdir(os.path.join(rootPath, "Charactor", "Quad", "Face", "AlignedBlendshapes"))
-    if not os.path.isdir(os.path.join(rootPath, "Actor", "Quad", "Face", "AlignedBlendshapes")):
-        os.mkdir(os.path.join(rootPath, "Actor", "Quad", "Face", "AlignedBlendshapes"))
-
-    Actor_Neutral_Head = os.path.join(Actor_head_path, ActorNeutralHeadPoseName)
-    Actor_Neutral_Head_v, Actor_Neutral_Head_f = loadObj(Actor_Neutral_Head)
-    Charactor_Neutral_Head = os.path.join(CharactorHeadPath, CharactorHeadNeutralPoseName)
-    Charactor_Neutral_Head_v, Charactor_Neutral_Head_f = loadObj(Charactor_Neutral_Head)
-    Actor_ind = []
-    Charactor_ind = []
-    writeObj(os.path.join(rootPath, "Actor", "Quad", "Head", "NeutralPose", ActorNeutralHeadPoseName), Actor_Neutral_Head_v, Actor_Neutral_Head_f)
-    writeObj(os.path.join(rootPath, "Charactor", "Quad", "Head", "NeutralPose", CharactorHeadNeutralPoseName),
-             Charactor_Neutral_Head_v, Charactor_Neutral_Head_f)
-    if os.path.isfile(os.path.join(ActorFaceNeutralPosePath, ActorFaceNeutralPoseName)):  # 如果头部的脸部区域有提前准备好
-        Actor_neutral_face = os.path.join(ActorFaceNeutralPosePath, ActorFaceNeutralPoseName)
-        Actor_neutral_face_v, Actor_neutral_face_f = loadObj(Actor_neutral_face)
-        Actor_ind = find_cloest_index_in_obj_withV(Actor_neutral_face_v, source_txt)  # 演员面部索引
-        writeObj(os.path.join(rootPath, "Actor", "Quad", "Face", "NeutralPose", ActorFaceNeutralPoseName),
-                 Actor_neutral_face_v, Actor_neutral_face_f)
-        face_index = ExtractFaceVertexIndex(Actor_neutral_face_v, Actor_Neutral_Head_v)  # 面部区域占头部区域的点序位置
-        save_pickle_file(os.path.join(rootPath, "Actor", "Quad", "Face", "NeutralPose", "face_index.pkl"), face_index)
-        batch_convert_head_to_face(Actor_head_path, face_index, Actor_neutral_face_f, os.path.join(rootPath, "Actor", "Quad", "Face", "Blendshapes"))  # 提取所有面部区域
-        print("演员的所有blendshape面部数据提取完毕..")
-    if os.path.isfile(os.path.join(CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName)):  # 如果头部的脸部区域有提前准备好
-        Charactor_neutral_face = os.path.join(CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName)
-        Charactor_neutral_face_v, Charactor_neutral_face_f = loadObj(Charactor_neutral_face)
-        Charactor_ind = find_cloest_index_in_obj_withV(Charactor_neutral_face_v, target_txt)  # 角色面部索引
-        writeObj(os.path.join(rootPath, "Charactor", "Quad", "Face", "NeutralPose", CharactorFaceNeutralPoseName),
-                 Charactor_neutral_face_v, Charactor_neutral_face_f)
-        face_index = ExtractFaceVertexIndex(Charactor_neutral_face_v, Charactor_Neutral_Head_v)  # 面部区域占头部区域的点序位置
-        save_pickle_file(os.path.join(rootPath, "Charactor", "Quad", "Face", "NeutralPose", "face_index.pkl"), face_index)
-    FaceMarker = []
-    FaceMarker.append(Actor_ind)
-    FaceMarker.append(Charactor_ind)
-    FaceMarker_path = os.path.join(rootPath, "Face_Marker.mat")
-    FaceMarker_numpy = List2mat(FaceMarker_path, FaceMarker)  # 生成面部数据的mat文件索引
-    """
-    下面的代码对面部数据三角化并且对齐
-    """
-    filedir = os.path.join(rootPath, "Actor", "Quad", "Face", "Blendshapes")
-    filenames = os.listdir(filedir)
-    target_dir = os.path.join(rootPath, "Actor", "Tri", "Face", "Blendshapes")
-    index_list = batch_convert_quad2tri(filedir, filenames, target_dir)  # 演员面部三角化
-    tv, tf, index = Quad2Tri(Charactor_neutral_face_v, Charactor_neutral_face_f)  #角色面部三角化
-    writeObj(os.path.join(rootPath, "Charactor", "Tri", "Face", "NeutralPose", CharactorFaceNeutralPoseName), tv, tf)
-    save_pickle_file(os.path.join(rootPath, "Charactor", "Tri", "Face", "NeutralPose", "index.pkl"), index)
-    # align 这里可以不对齐
-    Face_to_align = os.path.join(rootPath, "Actor", "Tri", "Face", "Blendshapes")
-    Face_aligned_v = Actor_neutral_face_v
-    AlignedFaces_path_tosave = os.path.join(rootPath, "Actor", "Tri", "Face", "AlignedBlendshapes")
-    AlignPoints_index = [t-1 for t in Actor_ind[0:10]]  # 对其人脸的索引
-    print("对齐原始人脸")
-    BatchAlignFacewithFixedPoints(Face_to_align, Face_aligned_v, AlignedFaces_path_tosave,
-                                  AlignPoints_index)
-    return FaceMarker
+    pipeline = BlendShapeTransferPipeline(Actor_head_path, ActorNeutralHeadPoseName, CharactorHeadPath,
+                                          CharactorHeadNeutralPoseName, ActorFaceNeutralPosePath, ActorFaceNeutralPoseName,
+                                          CharactorFaceNeutralPosePath, CharactorFaceNeutralPoseName, source_txt, target_txt,
+                                          rootPath, workers)
+    pipeline.run(["actor_align", "charactor_face", "charactor_triangulate"], force, raise_on_failure=True)
+    Marker = io.loadmat(os.path.join(rootPath, "Face_Marker.mat"))['Marker']
+    return [Marker[:, 0].tolist(), Marker[:, 1].tolist()]
+
+
+def BlendShapeTransferStep2(rootPath, ActorFaceNeutralPoseName, CharactorFaceNeutralPoseName, FaceMarker, batch_size=32):
+    """
+    代替 matlab 的变形迁移: 把对齐后的演员面部 blendshape 迁移到角色面部, 结果作为 BasicBlenshapeTransferstep3 的输入
+    角色的稀疏方程只分解一次, 所有 blendshape 分批回代, 见 Util.deformation_transfer
+    :param rootPath: BlendShapeTransferStep1 使用的 rootPath
+    :param ActorFaceNeutralPoseName: 演员中性面部的文件名
+    :param CharactorFaceNeutralPoseName: 角色中性面部的文件名
+    :param FaceMarker: 标记点索引, matlab 格式, 可以是 BlendShapeTransferStep1 返回的 [演员索引, 角色索引] (2 x M),
+                       也可以是 Face_Marker.mat 中的 Marker (M, 2), 第一列为演员, 第二列为角色
+    :param batch_size: 每批一起回代的 blendshape 个数
+    :return: 迁移结果的保存路径
+    """
+    actor_v, actor_f = load_obj_arrays(os.path.join(rootPath, "Actor", "Quad", "Face", "NeutralPose", ActorFaceNeutralPoseName),
+                                       dtype=np.float64)
+    charactor_v, charactor_f = load_obj_arrays(os.path.join(rootPath, "Charactor", "Tri", "Face", "NeutralPose",
+                                                            CharactorFaceNeutralPoseName), dtype=np.float64)
+    FaceMarker = np.asarray(FaceMarker, dtype=np.int64) - 1
+    if FaceMarker.shape[0] == 2 and FaceMarker.shape[1] != 2:  # [演员索引, 角色索引]
+        FaceMarker = FaceMarker.T
+    assert FaceMarker.ndim == 2 and FaceMarker.shape[1] == 2, "FaceMarker 的形状 {} 不是 (M, 2)".format(FaceMarker.shape)
+    correspondence = triangle_correspondence(actor_v, actor_f, charactor_v, charactor_f, FaceMarker[:, 0], FaceMarker[:, 1])
+    transfer = DeformationTransfer(actor_v, actor_f, charactor_v, charactor_f, correspondence)
+    blendshape_path = os.path.join(rootPath, "Actor", "Tri", "Face", "AlignedBlendshapes")
+    save_path = os.path.join(rootPath, "Charactor", "Tri", "Face", "Blendshapes")
+    os.makedirs(save_path, exist_ok=True)
+    names = sorted([name for name in os.listdir(blendshape_path) if name.endswith(".obj")])
+    for start in range(0, len(names), batch_size):
+        batch = names[start:start + batch_size]
+        shapes = np.stack([load_obj_arrays(os.path.join(blendshape_path, name), dtype=np.float64)[0] for name in batch])
+        for name, v in zip(batch, transfer.transfer(shapes, batch_size)):
+            write_obj_arrays(os.path.join(save_path, name), v, charactor_f)
+        print("迁移 {}/{}...".format(start + len(batch), len(names)))
+    return save_path
 
 
 
@@ -941,6 +1042,8 @@ def BasicBlenshapeTransferstep3(Charactor_transfered_face_path, aligned_face, fa
     :param Quad_Head_path_tosave: 四边形头部要保存的路径
     :return:
     """
+    for path in (AlignedFaces_path_tosave, Quad_Face_path_tosave, Quad_Head_path_tosave):
+        os.makedirs(path, exist_ok=True)
     Face_aligned_v, Face_aligned_f = loadObj(aligned_face)
     BatchAlignFacewithFixedPoints(Charactor_transfered_face_path, Face_aligned_v, AlignedFaces_path_tosave, AlignPoints_index)
     backup_ind = load_pickle_file(index_path)
@@ -1115,6 +1218,11 @@ if __name__ == '__main__':
     # # saved_path = "D:\\Blendshape-Based Animation\\charactor\\Chactor_Au_aigned_tri"
     # # # fixedPoints_index = [1900, 7969, 5271]  # 对齐外星人用的索引
     # # fixedPoints_index = [16438, 2977, 984, 14115, 14916, 5011]  # 小姐姐
+    # # 或者从整个序列中自动选择刚体区域:
+    # # from Util import mesh_sequence, rigid_region
+    # # seq = mesh_sequence.obj_dir_to_sequence(face_path, os.path.join(saved_path, "sequence"))
+    # # fixedPoints_index, fixedPoints_weights, _ = rigid_region.select_rigid_anchors(seq)
+    # # BatchAlignFacewithFixedPoints(face_path, face_v, saved_path, fixedPoints_index, points_weights=fixedPoints_weights)
     # # BatchAlignFacewithFixedPoints(face_path, face_v, saved_path, fixedPoints_index)
     # """
     # step0:对齐blendshape
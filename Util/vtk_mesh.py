@@ -0,0 +1,159 @@
+import vtk
+import numpy as np
+from vtk.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
+from Util.mesh_io import faces_to_array
+
+"""
+vtk mesh 的构建和顶点更新
+顶点直接以 float32 连续数组的形式交给 vtkPoints (numpy_to_vtk 不复制数据), 不再逐点 SetPoint
+面片和线段由 offsets + connectivity 数组一次构建 vtkCellArray, 不再逐个 InsertNextCell
+"""
+
+
+def _as_points(vertices):
+    vertices = np.asarray(vertices, dtype=np.float32)
+    return np.ascontiguousarray(vertices.reshape(len(vertices), -1)[:, :3])
+
+
+def _cell_array(counts, connectivity):
+    """
+    :param counts: 每个单元的点数
+    :param connectivity: 所有单元的点序 (从 0 开始) 依次排列
+    :return: vtkCellArray
+    """
+    cells = vtk.vtkCellArray()
+    counts = np.asarray(counts, dtype=np.int64)
+    connectivity = np.asarray(connectivity, dtype=np.int64)
+    if vtk.VTK_MAJOR_VERSION >= 9:
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        cells.SetData(numpy_to_vtkIdTypeArray(offsets, deep=True), numpy_to_vtkIdTypeArray(connectivity, deep=True))
+    else:  # 旧版本只支持 [n, id0, id1, ...] 的格式
+        legacy = np.insert(connectivity, np.cumsum(counts) - counts, counts)
+        cells.SetCells(len(counts), numpy_to_vtkIdTypeArray(legacy, deep=True))
+    return cells
+
+
+def face_edges(faces):
+    """
+    :param faces: 面片 list 或数组 (从 1 开始, 三角形和四边形可以混合)
+    :return: 去重后的边 (E, 2), 从 0 开始, 每条边 较小的序号在前
+    """
+    faces = faces_to_array(faces)
+    counts = (faces > 0).sum(axis=1)
+    cols = np.arange(faces.shape[1])
+    mask = cols < counts[:, None]
+    nxt = np.where(cols + 1 < counts[:, None], cols + 1, 0)  # 最后一个点连回第一个点
+    start = faces[mask]
+    end = np.take_along_axis(faces, nxt, axis=1)[mask]
+    low = np.minimum(start, end).astype(np.int64) - 1
+    high = np.maximum(start, end).astype(np.int64) - 1
+    keys = np.unique((low << 32) | high)  # 两个序号合成一个整数去重, 比 np.unique(axis=0) 快很多
+    return np.stack((keys >> 32, keys & 0xffffffff), axis=1)
+
+
+def face_polydata(vertices, faces):
+    """
+    :param vertices: 顶点 (V, 3) 数组或 list
+    :param faces: 面片 list 或数组 (从 1 开始, 三角形和四边形可以混合)
+    :return: vtkPolyData
+    """
+    faces = faces_to_array(faces)
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(vtk.vtkPoints())
+    set_polydata_vertices(polydata, vertices)
+    polydata.SetPolys(_cell_array((faces > 0).sum(axis=1), faces[faces > 0] - 1))
+    return polydata
+
+
+def edge_polydata(vertices, faces):
+    """
+    网格线, 相邻面片共用的边只生成一次
+    :param vertices: 顶点 (V, 3) 数组或 list
+    :param faces: 面片 list 或数组 (从 1 开始)
+    :return: vtkPolyData
+    """
+    edges = face_edges(faces)
+    polydata = vtk.vtkPolyData()
+    polydata.SetPoints(vtk.vtkPoints())
+    set_polydata_vertices(polydata, vertices)
+    polydata.SetLines(_cell_array(np.full(len(edges), 2), edges.ravel()))
+    return polydata
+
+
+def set_polydata_vertices(polydata, vertices):
+    """
+    只更新顶点, 拓扑不变
+    :param polydata: vtkPolyData
+    :param vertices: 顶点 (V, 3) 数组或 list
+    """
+    vertices = _as_points(vertices)
+    points = polydata.GetPoints()
+    points.SetData(numpy_to_vtk(vertices, deep=False))  # numpy_to_vtk 会保留 vertices 的引用
+    points.Modified()
+
+
+def set_mapper_vertices(mapper, vertices):
+    """
+    更新 GetFaceMapper / GetTriangleMapper 返回的 mapper 的顶点, 每帧不需要重新构建 mapper
+    :param mapper: vtkPolyDataMapper
+    :param vertices: 顶点 (V, 3) 数组或 list
+    """
+    set_polydata_vertices(mapper.GetInput(), vertices)
+
+
+def vertex_gather_index(faces, number_points):
+    """
+    vtkOBJReader 读取带纹理坐标的 obj 时, 按面片的每一个角生成一个点,
+    第 i 个点对应 obj 中的第 faces 展开后第 i 个顶点
+    :param faces: 面片 list 或数组 (从 1 开始)
+    :param number_points: vtk mesh 的点数
+    :return: (number_points,) 的索引, vtk 点 = obj 顶点[index]
+    """
+    faces = faces_to_array(faces)
+    index = faces[faces > 0].astype(np.intp) - 1  # 按行展开并去掉补齐的 0
+    assert len(index) >= number_points, "面片的角点数 {} 少于 vtk mesh 的点数 {}".format(len(index), number_points)
+    return index[:number_points]
+
+
+class VertexUploader(object):
+    """
+    每帧更新 vtk mesh 的顶点, 代替逐点 SetPoint 的循环
+    顶点数与 vtk 点数相同时直接使用传入的数组, 否则 (带纹理坐标的 obj) 按面片把顶点展开到预分配的缓冲区
+    """
+
+    def __init__(self, mesh, faces=None):
+        """
+        :param mesh: vtkPolyData
+        :param faces: obj 的面片, 只有带纹理坐标的 obj 需要
+        """
+        self.mesh = mesh
+        self.points = mesh.GetPoints()
+        self.number_points = self.points.GetNumberOfPoints()
+        self.faces = faces
+        self.index = None
+        self.buffer = None
+        self._bound = None  # 当前 vtkPoints 使用的 numpy 数组
+
+    def _bind(self, array):
+        if array is not self._bound:
+            self.points.SetData(numpy_to_vtk(array, deep=False))  # numpy_to_vtk 会保留 array 的引用
+            self._bound = array
+
+    def update(self, vertices):
+        """
+        :param vertices: 顶点 (V, 3) 数组或 list
+        """
+        vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        if vertices.ndim != 2:
+            vertices = vertices.reshape(-1, 3)
+        if len(vertices) == self.number_points:
+            self._bind(vertices)
+        else:
+            if self.index is None:
+                assert self.faces is not None, "顶点数与 vtk 点数不一致时需要面片"
+                self.index = vertex_gather_index(self.faces, self.number_points)
+                self.buffer = np.empty((self.number_points, 3), dtype=np.float32)
+            np.take(vertices, self.index, axis=0, out=self.buffer)
+            self._bind(self.buffer)
+        self.points.Modified()  # 不写会没有反应
@@ -1,8 +1,11 @@
 
 import sys
-from PyQt5 import QtWidgets
+from functools import partial
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQT_form import Ui_Form
 from util import *
+from Util.blendshape import BlendshapeRig
+from Util.vtk_mesh import VertexUploader
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 from vtk.util.colors import *
 
@@ -20,24 +23,45 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         pass
 
 
+REEVALUATE_INTERVAL = 1000  # 增量更新这么多次后完整计算一次
+
+
 class Blendshape(object):
 
     def __init__(self, file_names, mean_file_name):
-        self.verts = []
+        verts = []
         self.face = None
         for file in file_names:
             v, f = loadObj(file)
-            self.verts.append(np.array(v))
+            verts.append(v)
         self.face = f
-        self.number_blendshapes = len(self.verts)
-        self.weights = np.zeros((self.number_blendshapes,), dtype=np.float32)
-        self.sum_blendshapes = np.zeros_like(np.array(v), dtype=np.float32)
         self.mean_value = self.Get_mean_valule(mean_file_name)
+        names = [os.path.splitext(os.path.basename(file))[0] for file in file_names]
+        self.rig = BlendshapeRig(self.mean_value, verts, faces=f, names=names)  # ./Models 中的主成分本身就是相对均值的偏移
+        self.number_blendshapes = self.rig.number_shapes
+        self.weights = np.zeros((self.number_blendshapes,), dtype=np.float32)
+        self.sum_blendshapes = self.rig.buffer()
+        self.number_updates = 0
 
     def Get_mean_valule(self, mean_mesh_file):
         v, f = loadObj(mean_mesh_file)
         return np.array(v, dtype=np.float32)
 
+    def set_weight(self, k, weight):
+        """
+        增量更新: 只把 Δw * delta_k 加到 sum_blendshapes 上
+        :param k: 表情序号
+        :param weight: 新的系数
+        """
+        delta = weight - self.weights[k]
+        if delta == 0:
+            return
+        self.rig.apply_delta(self.sum_blendshapes, k, delta)
+        self.weights[k] = weight
+        self.number_updates += 1
+        if self.number_updates >= REEVALUATE_INTERVAL:  # 消除累加的浮点误差
+            self.rig.evaluate(self.weights, out=self.sum_blendshapes)
+            self.number_updates = 0
 
 
 class MyPyQT_Form(QtWidgets.QWidget, Ui_Form, Blendshape):
@@ -45,6 +69,15 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form, Blendshape):
         super(MyPyQT_Form, self).__init__()
         super(Ui_Form, self).__init__(file_names, mean_file_name)
         self.setupUi(self)
+        self.target_weights = self.weights.copy()  # 滑块给出的系数, 渲染前才应用到顶点上
+        self.create_sliders()
+        # 连续拖动滑块时合并事件, 每次屏幕刷新最多渲染一次
+        screen = QtGui.QGuiApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60.0
+        self.render_timer = QtCore.QTimer(self)
+        self.render_timer.setSingleShot(True)
+        self.render_timer.setInterval(int(1000 / refresh_rate))
+        self.render_timer.timeout.connect(self.set_Actor_mapper)
         self.vtkWidget = QVTKRenderWindowInteractor(self.frame)
         self.ren = vtk.vtkRenderer()
         self.vtkWidget.GetRenderWindow().AddRenderer(self.ren)
@@ -52,37 +85,50 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form, Blendshape):
         self.vtkWidget.resize(999, 1109)  # 设置vtk 交互窗口大小
         self.camera = vtk.vtkCamera()
         self.actor = vtk.vtkActor()
+        self.uploader = None
         self.loadActor()
         self.CreateScene()
 
+    def create_sliders(self):
+        """
+        按 rig 中表情的个数生成滑块, 代替 PyQT_form 中固定的 4 个滑块
+        """
+        self.verticalLayoutWidget.hide()
+        for label in (self.label, self.label_2, self.label_3, self.label_4):
+            label.hide()
+        scroll = QtWidgets.QScrollArea(self)
+        scroll.setGeometry(QtCore.QRect(1160, 30, 311, 621))
+        scroll.setWidgetResizable(True)
+        panel = QtWidgets.QWidget()
+        layout = QtWidgets.QFormLayout(panel)
+        self.sliders = []
+        for k, name in enumerate(self.rig.names):
+            slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+            slider.setMinimum(-100)
+            slider.setMaximum(100)
+            slider.valueChanged['int'].connect(partial(self.slider_value_changed, k))
+            layout.addRow(name, slider)
+            self.sliders.append(slider)
+        scroll.setWidget(panel)
+
+    def slider_value_changed(self, k, value):
+        self.textEdit.setText("{} value is {}".format(self.rig.names[k], value/100))
+        self.target_weights[k] = value/100
+        if not self.render_timer.isActive():
+            self.render_timer.start()
+
+    # PyQT_form 中连接的固定滑块 (已隐藏)
     def slider1_value_changed(self, value):
-        self.textEdit.setText("value is {}".format(value/100))
-        self.weights[0] = value/100
-        tmp = [self.weights[i] * self.verts[i] for i in range(0, self.number_blendshapes)]
-        self.sum_blendshapes = sum(tmp) + self.mean_value
-        print(self.sum_blendshapes.shape)
-        self.set_Actor_mapper()
+        self.slider_value_changed(0, value)
 
     def slider2_value_changed(self, value):
-        self.textEdit.setText("value is {}".format(value/100))
-        self.weights[1] = value/100
-        tmp = [self.weights[i] * self.verts[i] for i in range(0, self.number_blendshapes)]
-        self.sum_blendshapes = sum(tmp) + self.mean_value
-        self.set_Actor_mapper()
+        self.slider_value_changed(1, value)
 
     def slider3_value_changed(self, value):
-        self.textEdit.setText("value is {}".format(value/100))
-        self.weights[2] = value/100
-        tmp = [self.weights[i] * self.verts[i] for i in range(0, self.number_blendshapes)]
-        self.sum_blendshapes = sum(tmp) + self.mean_value
-        self.set_Actor_mapper()
+        self.slider_value_changed(2, value)
 
     def slider4_value_changed(self, value):
-        self.textEdit.setText("value is {}".format(value/100))
-        self.weights[3] = value/100
-        tmp = [self.weights[i] * self.verts[i] for i in range(0, self.number_blendshapes)]
-        self.sum_blendshapes = sum(tmp) + self.mean_value
-        self.set_Actor_mapper()
+        self.slider_value_changed(3, value)
 
     def CreateGround(self):
         plane = vtk.vtkPlaneSource()
@@ -138,9 +184,11 @@ class MyPyQT_Form(QtWidgets.QWidget, Ui_Form, Blendshape):
         self.ren.AddActor(self.actor)
 
     def set_Actor_mapper(self):
-        mapper = GetFaceMapper(self.sum_blendshapes, self.face)
-        print("hello")
-        self.actor.SetMapper(mapper)
+        for k in np.flatnonzero(self.target_weights != self.weights):  # 两次渲染之间每个滑块只应用最后的值
+            self.set_weight(k, self.target_weights[k])
+        if self.uploader is None:
+            self.uploader = VertexUploader(self.actor.GetMapper().GetInput())
+        self.uploader.update(self.sum_blendshapes)  # 一直使用同一个缓冲区, 只通知 vtk 顶点已修改
         # self.iren.ReInitialize()
         self.iren.Render()
 
@@ -4,6 +4,7 @@ import json
 import numpy as np
 import os
 import pickle
+from mathutils import kdtree
 
 def loadmarkpoint(txt_path):
     with open(txt_path, 'r') as f:
@@ -12,12 +13,14 @@ def loadmarkpoint(txt_path):
     return mark_points
 
 def find_closet_index(points, gt):
-    row, col = points.shape
-    ind = []
-    for i in range(0, row):
-        dis = np.sum((gt-points[i])**2, axis=1)
-        ind.append(np.argmin(dis))
-    return ind
+    """
+    使用 blender 自带的 KD 树, 建树一次后逐点查询, 不再对每个点计算到所有顶点的距离
+    """
+    tree = kdtree.KDTree(len(gt))
+    for i, co in enumerate(gt):
+        tree.insert(co, i)
+    tree.balance()
+    return [tree.find(p)[1] for p in points]
 
 def save_pickle_file(filename, file):
     with open(filename, 'wb') as f:
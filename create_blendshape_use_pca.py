@@ -1,38 +1,35 @@
-from sklearn.decomposition import PCA
 from Util.util import *
+from Util.mesh_sequence import MeshSequence, obj_dir_to_sequence
+from Util.pca import fit_pca
 
 
 if __name__ == "__main__":
     face_model_path = "\\\\192.168.20.63\\ai\\face_data\\20190419\\Data_DeepLearning\\test_output"
+    enable_mesh_cache()  # 网络路径上的obj 再次运行时直接读取本地缓存
     vert0, face0 = loadObj(os.path.join(face_model_path, "1.obj"))
-    if not os.path.exists(os.path.join(face_model_path, "summary.npy")):
-        verts = np.empty([len(vert0*3), 1], dtype=np.float32)
+    seq_path = os.path.join(face_model_path, "sequence")
+    if not os.path.exists(seq_path):
+        filenames = []
         for i in range(1, 9080):
             face_file = os.path.join(face_model_path, "{}.obj".format(i))
             if os.path.exists(face_file):
-                vert, face = loadObj(face_file)
-                vert = np.array(vert, dtype=np.float32).reshape([-1, 1])
-                verts = np.hstack((verts, vert))
-                if i % 100 == 0:
-                    print("process {}...".format(i))
+                filenames.append("{}.obj".format(i))
             else:
                 print("{} is not existed".format(face_file))
-        verts = np.delete(verts, 0, axis=1)
-        np.save(os.path.join(face_model_path, "summary.npy"), verts)
-        print("{} saved..".format(os.path.join(face_model_path, "summary.npy")))
+        seq = obj_dir_to_sequence(face_model_path, seq_path, filenames)
+        print("{} saved..".format(seq_path))
     else:
-        verts = np.load(os.path.join(face_model_path, "summary.npy"))
-    verts_row_samples = verts.transpose()
-    mean_value = np.mean(verts_row_samples, axis=0)
-    verts_row_samples_mean = verts_row_samples - mean_value
-    pca = PCA(n_components=160, whiten=False)
-    pca.fit(verts_row_samples)
-    data_reduced = pca.transform(verts_row_samples)
+        seq = MeshSequence(seq_path)
+    verts_row_samples = seq.frames.reshape([len(seq), -1])  # (帧数, 3V) 内存映射, 不读入整个序列
+    pca = fit_pca(verts_row_samples, n_components=160)
+    pca.save(os.path.join(face_model_path, "pca"))
+    mean_value = pca.mean
+    data_reduced = pca.coefficients
     print(data_reduced.shape)
     print("coe is {}".format(data_reduced.shape))
-    print("特征向量的维度是{}".format(pca.components_.shape))
+    print("特征向量的维度是{}".format(pca.components.shape))
     writeObj(os.path.join("./Blendshapes", "{}.obj".format("mean_value")), mean_value.reshape([-1, 3]).tolist(), face0)
     for i in range(0, 160):
-        feature_vector = pca.components_[i, :] + mean_value
+        feature_vector = pca.components[i, :] + mean_value
         v = np.reshape(feature_vector, [-1, 3])
         writeObj(os.path.join("./Blendshapes", "{}.obj".format(i)), v.tolist(), face0)
\ No newline at end of file
@@ -1,5 +1,6 @@
 from Util.util import *
-from itertools import chain
+from Util.vtk_mesh import VertexUploader
+from Util.blendshape import BlendshapeRig
 import cv2
 
 class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
@@ -18,8 +19,7 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         print("sss...")
         global count
         print("count is {}".format(count))
-        calculated_mesh = coes[count].dot(delta_V) + b0[np.newaxis, :]
-        v = calculated_mesh.reshape(-1, 3)
+        v = rig.evaluate(coes[count], out=frame)  # 只改写被表情移动过的顶点
         Modify_Vertex(mesh, v, f0)
         # accessEachFace(mesh)
         actor.SetMapper(mapper)
@@ -41,8 +41,7 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         if key == "Left":
             global count
             print("count is {}".format(count))
-            calculated_mesh = coes[count].dot(delta_V) + b0[np.newaxis, :]
-            v = calculated_mesh.reshape(-1, 3)
+            v = rig.evaluate(coes[count], out=frame)  # 只改写被表情移动过的顶点
             Modify_Vertex(mesh, v, f0)
             # accessEachFace(mesh)
             actor.SetMapper(mapper)
@@ -62,24 +61,22 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
 
 
 def Modify_Vertex(mesh, to_set_verts, f):
-    points = mesh.GetPoints()  # vtkPoints
-    number_Vertices = points.GetNumberOfPoints()
-    f = list(chain((*f)))
-    for i in range(0, number_Vertices):
-        mesh.GetPoints().SetPoint(i, to_set_verts[f[i]-1][0], to_set_verts[f[i]-1][1], to_set_verts[f[i]-1][2])
-    mesh.GetPoints().Modified()  # 不写会没有反应
+    global uploader
+    if uploader is None or uploader.mesh is not mesh:
+        uploader = VertexUploader(mesh, f)  # 带纹理坐标时只在第一帧计算展开的索引
+    uploader.update(to_set_verts)
 
 v0 = None
 f0 = None
-delta_V = None
-
-b0 = None
+rig = None
+frame = None
 count = 0
 mapper = vtk.vtkPolyDataMapper()
 actor = vtk.vtkActor()
 mesh = None
 reader = vtk.vtkOBJReader()
 renWin = vtk.vtkRenderWindow()
+uploader = None
 
 
 if __name__ == "__main__":
@@ -92,15 +89,11 @@ if __name__ == "__main__":
     number_blendshapes = len(names)
     coes = load_pickle_file(coe_path)
     v0, f0 = loadObj(os.path.join(blendshape_path, "head_geo.obj"))
-    V = np.array(v0, dtype=np.float32).flatten()
-    for name in names:
-        if name != "head_geo":
-            v, f = loadObj(os.path.join(blendshape_path, "{}.obj".format(name)))
-            v = np.array(v, dtype=np.float32).flatten()
-            V = np.vstack((V, v))
-    V = np.delete(V, 0, axis=0)
-    b0 = np.array(v0, dtype=np.float32).flatten()
-    delta_V = V - b0
+    target_names = [name for name in names if name != "head_geo"]
+    rig = BlendshapeRig.from_obj_files(os.path.join(blendshape_path, "head_geo.obj"),
+                                       [os.path.join(blendshape_path, "{}.obj".format(name)) for name in target_names],
+                                       names=target_names)
+    frame = rig.buffer()
 
     ColorBackground = [0.0, 0.0, 0.0]
     model_name = os.path.join(model_path, "head_geo.obj")
@@ -1,8 +1,9 @@
 # coding: = utf-8
 # Author: Liyou
 
-from sklearn.decomposition import PCA
 from util import *
+from Util.mesh_sequence import MeshSequence, obj_dir_to_sequence
+from Util.pca import fit_pca, select_components, reconstruct_to_obj_dir
 """
 实际训练的数据应该仅仅是平滑后面部数据
 对面部数据做一次PCA，观察每一个特征向量样子，特征值理论上即为blendshape系数
@@ -21,47 +22,35 @@ if __name__ == "__main__":
     face_model_path = "\\\\192.168.80.195\\data3\\LiyouWang\\simple_dist_0419"
     pca_align = True
     vert0, face0 = loadObj(os.path.join(face_model_path, "smooth-0.obj"))
-    if not os.path.exists(os.path.join(face_model_path, "summary.npy")):
-        verts = np.empty([len(vert0*3), 1], dtype=np.float32)
+    seq_path = os.path.join(face_model_path, "sequence")
+    if not os.path.exists(seq_path):
+        filenames = []
         for i in range(0, 571):
             face_file = os.path.join(face_model_path, "smooth-{}.obj".format(i))
             if os.path.exists(face_file):
-                vert, face = loadObj(face_file)
-                vert = np.array(vert, dtype=np.float32).reshape([-1, 1])
-                verts = np.hstack((verts, vert))
-                if i % 100 == 0:
-                    print("process {}...".format(i))
+                filenames.append("smooth-{}.obj".format(i))
             else:
                 print("{} is not existed".format(face_file))
-        verts = np.delete(verts, 0, axis=1)
-        np.save(os.path.join(face_model_path, "summary.npy"), verts)
-        print("{} saved..".format(os.path.join(face_model_path, "summary.npy")))
+        seq = obj_dir_to_sequence(face_model_path, seq_path, filenames)
+        print("{} saved..".format(seq_path))
     else:
-        verts = np.load(os.path.join(face_model_path, "summary.npy"))
-    verts_row_samples = verts.transpose()
-    mean_value = np.mean(verts_row_samples, axis=0)
-    verts_row_samples_mean = verts_row_samples - mean_value
-    pca = PCA(n_components=0.99998, whiten=False)
-    pca.fit(verts_row_samples)
-    # print(verts_row_samples.shape)
-    # print("方差解释率为 {}".format(pca.explained_variance_))
-    # feature_vector = coe.dot(pca.components_) + mean_value
-    data_reduced = pca.transform(verts_row_samples)
+        seq = MeshSequence(seq_path)
+    verts_row_samples = seq.frames.reshape([len(seq), -1])  # (帧数, 3V) 内存映射, 不读入整个序列
+    pca = fit_pca(verts_row_samples, n_components=0.99998)
+    pca.save(os.path.join(face_model_path, "pca"))
+    mean_value = pca.mean
+    # print("方差解释率为 {}".format(pca.explained_variance))
+    # feature_vector = coe.dot(pca.components) + mean_value
+    data_reduced = pca.coefficients
     print(data_reduced.shape)
     print("coe is {}".format(data_reduced.shape))
-    print("特征向量的维度是{}".format(pca.components_.shape))
+    print("特征向量的维度是{}".format(pca.components.shape))
     writeObj(os.path.join("./Models", "{}.obj".format("mean_value")), mean_value.reshape([-1, 3]).tolist(), face0)
     for i in range(0, 10):
-        feature_vector = pca.components_[i, :]  # + mean_value
+        feature_vector = pca.components[i, :]  # + mean_value
         v = np.reshape(feature_vector, [-1, 3])
         writeObj(os.path.join("./Models", "{}.obj".format(i)), v.tolist(), face0)
     if pca_align:
         PCA_align = os.path.join("\\\\192.168.80.195\\data3\\LiyouWang", "2019-5-13-pcaalign")
-        coe = data_reduced[:, 1:]
-        feature_vec = pca.components_[1:, :]
-        stablized_data = np.dot(coe, feature_vec) + mean_value  # 去噪声
-        for i in range(0, stablized_data.shape[0]):
-            v = np.reshape(stablized_data[i, :], [-1, 3])
-            writeObj(os.path.join(PCA_align, "smooth-{}.obj".format(i)), v, face0)
-
-
+        index = select_components(pca, drop=[0])  # 去掉第 0 个主成分去噪声
+        reconstruct_to_obj_dir(pca, index, face0, PCA_align, names=seq.names)
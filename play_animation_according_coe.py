@@ -1,5 +1,6 @@
 from Util.util import *
-from itertools import chain
+from Util.vtk_mesh import VertexUploader
+from Util.blendshape import BlendshapeRig
 
 class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
 
@@ -14,8 +15,7 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         key = self.GetInteractor().GetKeySym()
         if key == "Left":
             global count
-            calculated_mesh = coes[count].dot(delta_V) + b0[np.newaxis, :]
-            v = calculated_mesh.reshape(-1, 3)
+            v = rig.evaluate(coes[count], out=frame)  # 只改写被表情移动过的顶点
             Modify_Vertex(mesh, v, f0)
             # accessEachFace(mesh)
             actor.SetMapper(mapper)
@@ -28,23 +28,22 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
 
 
 def Modify_Vertex(mesh, to_set_verts, f):
-    points = mesh.GetPoints()  # vtkPoints
-    number_Vertices = points.GetNumberOfPoints()
-    f = list(chain((*f)))
-    for i in range(0, number_Vertices):
-        mesh.GetPoints().SetPoint(i, to_set_verts[f[i]-1][0], to_set_verts[f[i]-1][1], to_set_verts[f[i]-1][2])
-    mesh.GetPoints().Modified()  # 不写会没有反应
+    global uploader
+    if uploader is None or uploader.mesh is not mesh:
+        uploader = VertexUploader(mesh, f)  # 带纹理坐标时只在第一帧计算展开的索引
+    uploader.update(to_set_verts)
 
 v0 = None
 f0 = None
-delta_V = None
-b0 = None
+rig = None
+frame = None
 count = 0
 mapper = vtk.vtkPolyDataMapper()
 actor = vtk.vtkActor()
 mesh = None
 reader = vtk.vtkOBJReader()
 renWin = vtk.vtkRenderWindow()
+uploader = None
 
 if __name__ == "__main__":
     coe_path = os.path.join("\\\\192.168.20.63\\ai\\Liyou_wang_data\\fit_coe_output_v2", "coe.pkl")
@@ -54,14 +53,9 @@ if __name__ == "__main__":
     number_blendshapes = 39
     coes = load_pickle_file(coe_path)
     v0, f0 = loadObj(os.path.join(blendshape_path, "0.obj"))
-    V = np.array(v0, dtype=np.float32).flatten()
-    for i in range(1, number_blendshapes):
-        v, f = loadObj(os.path.join(blendshape_path, "{}.obj".format(i)))
-        v = np.array(v, dtype=np.float32).flatten()
-        V = np.vstack((V, v))
-    V = np.delete(V, 0, axis=0)
-    b0 = np.array(v0, dtype=np.float32).flatten()
-    delta_V = V - b0
+    rig = BlendshapeRig.from_obj_files(os.path.join(blendshape_path, "0.obj"),
+                                       [os.path.join(blendshape_path, "{}.obj".format(i)) for i in range(1, number_blendshapes)])
+    frame = rig.buffer()
 
     ColorBackground = [0.0, 0.0, 0.0]
     model_name = os.path.join(model_path, "basis.obj")
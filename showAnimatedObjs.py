@@ -1,7 +1,7 @@
 import vtk
-from util import GetTriangleMapper, GetFaceMapper
+from util import GetTriangleMapper, GetFaceMapper, set_mapper_vertices
 from vtk.util.colors import *
-from util import loadObj
+from util import loadObj, enable_mesh_cache
 import os
 import numpy as np
 import time
@@ -22,11 +22,12 @@ renWin = vtk.vtkRenderWindow()
 v = list()
 f = None
 actor = list()  # the list of links
+enable_mesh_cache()  # 网络路径上的obj 再次运行时直接读取本地缓存
 for file in filename:  # 加载第一个模型
     pt = os.path.join(actor_dir, file)
     if os.path.exists(pt):
         ver, f = loadObj(pt)
-        v.append(np.array(ver))
+        v.append(np.array(ver, dtype=np.float32))  # 播放时直接交给 vtk, 不再转换
         print("append {}".format(pt))
     else:
         print("{} is not exist".format(file))
@@ -44,8 +45,7 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
     def OnKeyPressEvent(self, obj, event):
         key = self.GetInteractor().GetKeySym()
         if (key == "Left"):
-            mapper1 = GetFaceMapper(v[self.i], f)
-            actor[0].SetMapper(mapper1)
+            set_mapper_vertices(actor[0].GetMapper(), v[self.i])  # 拓扑不变, 只更新顶点
             self.i += 1
             if self.i >= len(v):
                 self.i = 0
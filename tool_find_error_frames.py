@@ -2,8 +2,9 @@ import vtk
 import os
 import numpy as np
 from Util.util import *
+from Util.vtk_mesh import VertexUploader
+from Util.frame_source import FrameSource
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
-from itertools import chain
 
 
 class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
@@ -21,8 +22,8 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         if key == "Left":
             global count
             count += 1
-            if os.path.exists(os.path.join(model_path, "{}.obj".format(count))):
-                v, f = loadObj(os.path.join(model_path, "{}.obj".format(count)))
+            v = frame_source.get(count)
+            if v is not None:
                 # print(len(v))
                 Modify_Vertex(mesh, v, f)
                 # accessEachFace(mesh)
@@ -30,13 +31,13 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
                 print("{}.obj".format(count))
                 renWin.Render()
 
-            if count >= 6000:
+            if count >= len(frame_source) - 1:
                 print("replay")
                 count = 0
         if key == "Right":
             count -= 1
-            if os.path.exists(os.path.join(model_path, "{}.obj".format(count))):
-                v, f = loadObj(os.path.join(model_path, "{}.obj".format(count)))
+            v = frame_source.get(count)
+            if v is not None:
                 # print(len(v))
                 Modify_Vertex(mesh, v, f)
                 # accessEachFace(mesh)
@@ -66,38 +67,10 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
 
 
 def Modify_Vertex(mesh, to_set_verts, f):
-    points = mesh.GetPoints()  # vtkPoints
-    verts = mesh.GetVerts()
-    # print(mesh.GetNumberOfPoints())
-    # print(verts.GetData())
-    ver = vtk_to_numpy(verts.GetData())
-    # print(ver.shape)
-    number_Vertices = points.GetNumberOfPoints()
-    using_tex = True
-    if len(to_set_verts) == number_Vertices:
-        using_tex = False
-    # print(number_Vertices)
-    # print(len(to_set_verts))
-    # verts = []
-    # print(f)
-    # f = np.array(f, dtype=np.int32)
-    # f = f.flatten()
-    # f_flaten = [n for c in f for n in c]
-    if using_tex:
-        f = list(chain((*f)))
-    for i in range(0, number_Vertices):
-        # x = mesh.GetPoints().GetData().GetComponent(i, 0)
-        # y = mesh.GetPoints().GetData().GetComponent(i, 1)
-        # z = mesh.GetPoints().GetData().GetComponent(i, 2)
-        # verts.append([x, y, z])
-        # print(f[i])
-        if using_tex:
-            mesh.GetPoints().SetPoint(i, to_set_verts[f[i] - 1][0], to_set_verts[f[i] - 1][1],
-                                      to_set_verts[f[i] - 1][2])
-        else:
-            mesh.GetPoints().SetPoint(i, to_set_verts[i][0], to_set_verts[i][1], to_set_verts[i][2])
-    # writeObj("./model/test.obj", verts, f)
-    mesh.GetPoints().Modified()  # 不写会没有反应
+    global uploader
+    if uploader is None or uploader.mesh is not mesh:
+        uploader = VertexUploader(mesh, f)  # 带纹理坐标时只在第一帧计算展开的索引
+    uploader.update(to_set_verts)
 
 def accessEachFace(mesh):
     numberOfFaces = mesh.GetNumberOfCells()
@@ -118,21 +91,26 @@ actor = vtk.vtkActor()
 mesh = None
 reader = vtk.vtkOBJReader()
 renWin = vtk.vtkRenderWindow()
+uploader = None
 count = -1
 # model_path = "\\\\192.168.20.63\\ai\\Liyou_wang_data\\fit_coe_output"
 model_path = "\\\\192.168.20.63\\ai\\face_data\\20190514\\wrap"
 error_frames_path = "\\\\192.168.20.63\\ai\\face_data\\20190514\\DeepCapture\\DATAROOT\\error_frames"
 f = None
+number_frames = 6001
+frame_source = None
 error_frames = []
 if __name__ == "__main__":
     print("-----------------\n"
           "left play next frame, right play previous frame\n"
           "Up add current frame number to error frame, down save frame_names to local")
     ColorBackground = [0.0, 0.0, 0.0]
+    enable_mesh_cache()  # 网络路径上的obj 再次运行时直接读取本地缓存
     # model_name = os.path.join("./model", "Neutral_face.obj")
     base_face_root = "\\\\192.168.20.63\\ai\\face_data\\20190514\\DeepCapture\\DATAROOT\\BASEFACE"
     uv_model_name = os.path.join(model_path, "{}.obj".format("0"))
     v, f = loadObj(uv_model_name)
+    frame_source = FrameSource.from_obj_pattern(os.path.join(model_path, "{}.obj"), number_frames)
     jpg_file = os.path.join(base_face_root, "base.jpg")
     reader = vtk.vtkOBJReader()
     reader.SetFileName(uv_model_name)
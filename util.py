@@ -5,6 +5,8 @@ import json
 import scipy.io as io
 import numpy as np
 from Util.align_trajectory import align_sim3
+from Util.mesh_io import load_obj_arrays, faces_to_list, write_obj_arrays, enable_mesh_cache, disable_mesh_cache
+from Util.vtk_mesh import face_polydata, edge_polydata, set_mapper_vertices
 from scipy import optimize
 from scipy.optimize import least_squares
 from math import atan2
@@ -84,74 +86,23 @@ def load_pickle_file(filename):
 
 
 def GetTriangleMapper(vertexs, faces):
-    points = vtk.vtkPoints()
-    for v in vertexs:
-        points.InsertNextPoint(v)
-    lines = vtk.vtkCellArray()
-    line = vtk.vtkLine()
-    for f in faces:
-        if len(f) == 4:
-            line.GetPointIds().SetId(0, f[0] - 1)
-            line.GetPointIds().SetId(1, f[1] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[1] - 1)
-            line.GetPointIds().SetId(1, f[2] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[2] - 1)
-            line.GetPointIds().SetId(1, f[3] - 1)
-            lines.InsertNextCell(line)
-            line.GetPointIds().SetId(0, f[3] - 1)
-            line.GetPointIds().SetId(1, f[1] - 1)
-            lines.InsertNextCell(line)
-        else:
-            if len(f) == 3:
-                line.GetPointIds().SetId(0, f[0] - 1)
-                line.GetPointIds().SetId(1, f[1] - 1)
-                lines.InsertNextCell(line)
-                line.GetPointIds().SetId(0, f[1] - 1)
-                line.GetPointIds().SetId(1, f[2] - 1)
-                lines.InsertNextCell(line)
-                line.GetPointIds().SetId(0, f[2] - 1)
-                line.GetPointIds().SetId(1, f[0] - 1)
-                lines.InsertNextCell(line)
-
-    linesPolyData = vtk.vtkPolyData()
-    linesPolyData.SetPoints(points)
-    linesPolyData.SetLines(lines)
+    """
+    网格线的 mapper, 相邻面片共用的边只画一次
+    :param vertexs: obj 顶点
+    :param faces: 点序
+    :return: 传给actor使用的mapper, 之后的帧用 set_mapper_vertices 更新顶点
+    """
     mapper = vtk.vtkPolyDataMapper()
-    mapper.SetInputData(linesPolyData)
+    mapper.SetInputData(edge_polydata(vertexs, faces))
     return mapper
 
 def GetFaceMapper(vertexs, faces):
     """
     :param vertexs: obj 顶点
     :param faces: 点序
-    :return: 传给actor使用的mapper
+    :return: 传给actor使用的mapper, 之后的帧用 set_mapper_vertices 更新顶点
     """
-    # Setup four points
-    points = vtk.vtkPoints()
-    for v in vertexs:
-        points.InsertNextPoint(v[0], v[1], v[2])  # 设置顶点
-
-    # Create the polygon
-    polygon = vtk.vtkPolygon()
-    polygon.GetPointIds().SetNumberOfIds(4)
-    polygons = vtk.vtkCellArray()  # 设置单元 设置拓扑结构
-    for i, f in enumerate(faces):
-        if len(f) == 4:
-            polygon.GetPointIds().SetId(0, f[0] - 1)
-            polygon.GetPointIds().SetId(1, f[1] - 1)
-            polygon.GetPointIds().SetId(2, f[2] - 1)
-            polygon.GetPointIds().SetId(3, f[3] - 1)
-        if len(f) == 3:
-            polygon.GetPointIds().SetId(0, f[0] - 1)
-            polygon.GetPointIds().SetId(1, f[1] - 1)
-            polygon.GetPointIds().SetId(2, f[2] - 1)
-        polygons.InsertNextCell(polygon)
-
-    polygonPolyData = vtk.vtkPolyData()
-    polygonPolyData.SetPoints(points)
-    polygonPolyData.SetPolys(polygons)
+    polygonPolyData = face_polydata(vertexs, faces)
 
     mapper = vtk.vtkPolyDataMapper()
     if vtk.VTK_MAJOR_VERSION <= 5:
@@ -165,59 +116,30 @@ def loadObj(path):
     """Load obj file
     读取三角形和四边形的mesh
     返回vertex和face的list
+    解析由 load_obj_arrays 完成, 需要 numpy 数组时直接使用 load_obj_arrays
     """
     if path.endswith('.obj'):
-        f = open(path, 'r')
-        lines = f.readlines()
-        vertics = []
-        faces = []
-        vts = []
-        for line in lines:
-            if line.startswith('v') and not line.startswith('vt') and not line.startswith('vn'):
-                line_split = line.split()
-                ver = line_split[1:4]
-                ver = [float(v) for v in ver]
-                vertics.append(ver)
-            else:
-                if line.startswith('f'):
-                    line_split = line.split()
-                    if '/' in line:  # 根据需要这里补充obj的其他格式解析
-                        tmp_faces = line_split[1:]
-                        f = []
-                        for tmp_face in tmp_faces:
-                            f.append(int(tmp_face.split('/')[0]))
-                        faces.append(f)
-                    else:
-                        face = line_split[1:]
-                        face = [int(fa) for fa in face]
-                        faces.append(face)
-
-        return (vertics, faces)
+        vertics, faces = load_obj_arrays(path, dtype=np.float64)
+        return (vertics.tolist(), faces_to_list(faces))
 
     else:
         print('格式不正确，请检查obj格式')
         return
 
 
-def writeObj(file_name_path, vertexs, faces, vts=None):
+def writeObj(file_name_path, vertexs, faces, vts=None, face_uvs=None, precision=None, verbose=True):
     """write the obj file to the specific path
        file_name_path:保存的文件路径
-       vertexs:顶点数组 list
-       faces: 面 list
+       vertexs:顶点数组 list 或 numpy 数组
+       faces: 面 list 或 numpy 数组
+       vts: 纹理坐标, 写在面片之前, 面片写成 f v/vt
+       face_uvs: 面片对应的纹理坐标索引, 纹理坐标与顶点一一对应时可以不给
+       precision: 坐标保留的小数位数, None 时保留全部精度
+       verbose: 是否打印保存信息, 批量保存时关闭
     """
-    with open(file_name_path, 'w') as f:
-        for v in vertexs:
-            # print(v)
-            f.write("v {} {} {}\n".format(v[0], v[1], v[2]))
-        for face in faces:
-            if len(face) == 4:
-                f.write("f {} {} {} {}\n".format(face[0], face[1], face[2], face[3])) # 保存四个顶点
-            if len(face) == 3:
-                f.write("f {} {} {}\n".format(face[0], face[1], face[2]))  # 保存三个顶点
-        if vts != None:
-            for vt in vts:
-                f.write("vt {} {}\n".format(vt[0], vt[1]))
-        print("saved mesh to {}".format(file_name_path))
+    if isinstance(faces, list):  # 跳过 Quad2Tri 追加在末尾的三角面 list
+        faces = [face for face in faces if len(face) and not isinstance(face[0], list)]
+    write_obj_arrays(file_name_path, vertexs, faces, vts, face_uvs, precision, verbose)
 
 
 def Quad2Tri(qv, qf):# 将四边形mesh 转化为 三角形mesh
@@ -289,7 +211,7 @@ def batch_convert_quad2tri(file_dir, filenames, target_dir):
             v, f = loadObj(file_path)
             # print("f is {}".format(f))
             tv, tf, index = Quad2Tri(v, f)
-            writeObj(os.path.join(target_dir, file), tv, tf)
+            writeObj(os.path.join(target_dir, file), tv, tf, verbose=False)
             index_list.append(index)
         else:
             pass
@@ -314,7 +236,7 @@ def batch_convert_tri2quad(file_dir, filenames, target_dir, index):
                 qv, qf = Tri2Quad(v, f, index)
             if isinstance(index, list):
                 qv, qf = Tri2Quad(v, f, index[i])
-            writeObj(os.path.join(target_dir, file), qv, qf)
+            writeObj(os.path.join(target_dir, file), qv, qf, verbose=False)
         else:
             pass
     return qv, qf
@@ -506,7 +428,7 @@ def batch_convert_head_to_face(head_path, face_index, face_f, face_path):
                 file = os.path.join(head_path, file_name)
                 head_v, head_f = loadObj(file)
                 face_v, face_f = ExtracFaceFromHead(head_v, face_index, face_f)
-                writeObj(os.path.join(face_path, file_name), face_v, face_f)
+                writeObj(os.path.join(face_path, file_name), face_v, face_f, verbose=False)
         else:
             pass
     return face_v, face_f
@@ -528,7 +450,7 @@ def batch_convert_face_to_head(faces_path, save_head_path, head_v, head_f, face_
             file = os.path.join(faces_path, file_name)
             face_v, face_f = loadObj(file)
             Head_v, Head_f = ConvertFace2Head(face_v, head_v, head_f, face_index)
-            writeObj(os.path.join(save_head_path, file_name), Head_v, Head_f)
+            writeObj(os.path.join(save_head_path, file_name), Head_v, Head_f, verbose=False)
         else:
             pass
     return Head_v, Head_f
@@ -646,7 +568,7 @@ def AlignTwoFaceWithFixedPoints(FirstFace_verts, SecondFace_verts, pointsindex,
     :return: 返回第二个人脸对齐后的数据
     """
     if non_linear_align:
-       select_index = np.array(pointsindex)
+        select_index = np.array(pointsindex)
         Face1 = np.array(FirstFace_verts)
         Face2 = np.array(SecondFace_verts)
         Face1_select = Face1[select_index, :]
@@ -692,7 +614,7 @@ def BatchAlignFacewithRandomPoints(FaceToalignPath, FaceAligned_verts, SavePath)
             file = os.path.join(FaceToalignPath, filename)
             ToAlign_v, ToAlign_f = loadObj(file)
             aligned_v = AlignTwoFaceWithRandomPoints(FaceAligned_verts, ToAlign_v)
-            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f)
+            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f, verbose=False)
 
 
 def BatchAlignFacewithFixedPoints(FaceToalignPath, FaceAligned_verts, SavePath, points_index, non_linear_align=False, return_sRt=False):
@@ -710,7 +632,7 @@ def BatchAlignFacewithFixedPoints(FaceToalignPath, FaceAligned_verts, SavePath,
             ToAlign_v, ToAlign_f = loadObj(file)
             # print("ToAlign_f is {}".format(ToAlign_f))
             aligned_v = AlignTwoFaceWithFixedPoints(FaceAligned_verts, ToAlign_v, points_index, non_linear_align, return_sRt)
-            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f)
+            writeObj(os.path.join(SavePath, filename), aligned_v, ToAlign_f, verbose=False)
 
 
 def resSimXform(b, A, B):
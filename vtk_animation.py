@@ -2,6 +2,8 @@ import vtk
 import os
 import numpy as np
 from Util.util import *
+from Util.vtk_mesh import VertexUploader
+from Util.frame_source import FrameSource
 from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk
 
 class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
@@ -17,7 +19,7 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
         key = self.GetInteractor().GetKeySym()
         if key == "Left":
             global count
-            v, f = loadObj(os.path.join(model_path, "{}.obj".format(count+1)))
+            v = frame_source.get(count+1)
             # print(len(v))
             Modify_Vertex(mesh, v, f)
             # accessEachFace(mesh)
@@ -28,29 +30,10 @@ class MyInteractor(vtk.vtkInteractorStyleTrackballCamera):
 
 
 def Modify_Vertex(mesh, to_set_verts, f):
-    points = mesh.GetPoints()  # vtkPoints
-    verts = mesh.GetVerts()
-    print(mesh.GetNumberOfPoints())
-    # print(verts.GetData())
-    ver = vtk_to_numpy(verts.GetData())
-    # print(ver.shape)
-    number_Vertices = points.GetNumberOfPoints()
-    # print(number_Vertices)
-    # print(len(to_set_verts))
-    verts = []
-    f = np.array(f, dtype=np.int32)
-    f = f.flatten()
-    print(f.shape)
-    print(len(to_set_verts))
-    for i in range(0, number_Vertices):
-        # x = mesh.GetPoints().GetData().GetComponent(i, 0)
-        # y = mesh.GetPoints().GetData().GetComponent(i, 1)
-        # z = mesh.GetPoints().GetData().GetComponent(i, 2)
-        # verts.append([x, y, z])
-        # print(f[i])
-        mesh.GetPoints().SetPoint(i, to_set_verts[f[i]-1][0], to_set_verts[f[i]-1][1], to_set_verts[f[i]-1][2])
-    # writeObj("./model/test.obj", verts, f)
-    mesh.GetPoints().Modified()  # 不写会没有反应
+    global uploader
+    if uploader is None or uploader.mesh is not mesh:
+        uploader = VertexUploader(mesh, f)  # 带纹理坐标时只在第一帧计算展开的索引
+    uploader.update(to_set_verts)
 
 def accessEachFace(mesh):
     numberOfFaces = mesh.GetNumberOfCells()
@@ -71,14 +54,17 @@ actor = vtk.vtkActor()
 mesh = None
 reader = vtk.vtkOBJReader()
 renWin = vtk.vtkRenderWindow()
+uploader = None
 count = 0
 model_path = "\\\\192.168.20.63\\ai\\face_data\\20190419\\Data_DeepLearning\\test_output"
 f = None
+frame_source = None
 
 if __name__ == "__main__":
     ColorBackground = [0.0, 0.0, 0.0]
     model_name = os.path.join("./model", "Neutral_face.obj")
     v, f = loadObj(model_name)
+    frame_source = FrameSource.from_obj_pattern(os.path.join(model_path, "{}.obj"))
     jpg_file = os.path.join("./model", "basemesh.jpg")
     reader = vtk.vtkOBJReader()
     reader.SetFileName(model_name)